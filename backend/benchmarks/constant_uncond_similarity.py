@@ -0,0 +1,108 @@
+"""
+Output similarity and garment-branch cost of OOTD_CONSTANT_UNCOND_GARMENT against the exact unconditional branch.
+
+Run from backend/ (needs the OOTDiffusion checkpoints):
+
+    python -m benchmarks.constant_uncond_similarity --person person.jpg --cloth c1.jpg c2.jpg --seeds 0 1 2
+
+For each garment the garment branch is run uncached in both modes: exact (garment UNet on both guidance halves)
+and constant (conditional half only, the unconditional half from the per-category table). It reports the garment
+branch time of each, and the PSNR / SSIM of the constant-mode image against the exact one for every seed.
+"""
+import argparse
+import statistics
+import time
+
+import torch
+from PIL import Image
+
+from benchmarks.deep_cache_similarity import psnr, ssim
+from services.ootd_tryon_service import (
+    MODEL_TYPE_FOR_CLOTH_TYPE,
+    OOTD_CATEGORY_FOR_CLOTH_TYPE,
+    OOTD_IMAGE_SIZE,
+    OOTDTryOnService,
+)
+
+
+def garment_branch(model, model_type, category, cloth, constant_uncond):
+    # importable once the service has put services/ootd on sys.path
+    import inference_ootd_base
+
+    inference_ootd_base.CONSTANT_UNCOND_GARMENT = constant_uncond
+    model.garment_cache.clear()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    with torch.no_grad(), model.autocast():
+        conditioning = model.garment_conditioning(model_type, category, [cloth])
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return conditioning, time.perf_counter() - start
+
+
+def render(model, conditioning, image_vton, mask, image_ori, steps, image_scale, seed):
+    from pipelines_ootd.pipeline_ootd import stack_garment_features
+
+    prompt_embeds, garment_features = conditioning
+    with torch.no_grad(), model.autocast():
+        return model.pipe(
+            prompt_embeds=prompt_embeds,
+            spatial_attn_outputs=stack_garment_features(garment_features),
+            image_vton=image_vton,
+            mask=mask,
+            image_ori=image_ori,
+            num_inference_steps=steps,
+            image_guidance_scale=image_scale,
+            generator=torch.manual_seed(seed),
+            output_type="pt",
+        ).images.float()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--person", required=True)
+    parser.add_argument("--cloth", required=True, nargs="+")
+    parser.add_argument("--cloth-type", default="upper", choices=sorted(MODEL_TYPE_FOR_CLOTH_TYPE))
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--image-scale", type=float, default=2.0)
+    args = parser.parse_args()
+
+    service = OOTDTryOnService()
+    model_type = MODEL_TYPE_FOR_CLOTH_TYPE[args.cloth_type]
+    service._load_model(model_type)
+    model = service.ootd_models[model_type]
+    category = OOTD_CATEGORY_FOR_CLOTH_TYPE[args.cloth_type]
+
+    person = Image.open(args.person).convert("RGB")
+    image_ori, image_vton, mask = service._prepare_inputs(person, args.cloth_type)
+    # the first call also builds the unconditional table; keep it out of the timings
+    warm_up = Image.new("RGB", OOTD_IMAGE_SIZE, (255, 255, 255))
+    garment_branch(model, model_type, category, warm_up, True)
+    garment_branch(model, model_type, category, warm_up, False)
+
+    psnrs, ssims, exact_seconds, constant_seconds = [], [], [], []
+    for path in args.cloth:
+        cloth = Image.open(path).convert("RGB").resize(OOTD_IMAGE_SIZE, Image.Resampling.LANCZOS)
+        exact, seconds = garment_branch(model, model_type, category, cloth, False)
+        exact_seconds.append(seconds)
+        constant, seconds = garment_branch(model, model_type, category, cloth, True)
+        constant_seconds.append(seconds)
+
+        for seed in args.seeds:
+            reference = render(model, exact, image_vton, mask, image_ori, args.steps, args.image_scale, seed)
+            image = render(model, constant, image_vton, mask, image_ori, args.steps, args.image_scale, seed)
+            psnrs.append(psnr(image, reference))
+            ssims.append(ssim(image, reference))
+            print(f"{path}  seed {seed:4d}  PSNR {psnrs[-1]:6.2f} dB  SSIM {ssims[-1]:.4f}")
+
+    print(f"mean  PSNR {statistics.mean(psnrs):6.2f} dB  SSIM {statistics.mean(ssims):.4f}")
+    print(
+        f"garment branch: exact {statistics.mean(exact_seconds):.3f} s, "
+        f"constant {statistics.mean(constant_seconds):.3f} s per garment"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Seconds per denoising step of OotdPipeline on CPU for each option of the CPU profile.
+
+Run from backend/ (needs the OOTDiffusion checkpoints):
+
+    python -m benchmarks.cpu_profile --person person.jpg --cloth cloth.jpg --steps 4 --threads 16
+
+The options are enabled one after another on the same model, because channels_last and
+torch.compile can't be undone: fp32, + channels_last, + bf16 autocast, + torch.compile.
+For torch.compile the first (untimed) run includes compilation, or loading it from
+OOTD_COMPILE_CACHE_DIR.
+"""
+import argparse
+import os
+import statistics
+import time
+
+# The options are applied below, one at a time, instead of at load time
+os.environ["OOTD_DEVICE"] = "cpu"
+os.environ["OOTD_CPU_CHANNELS_LAST"] = "0"
+os.environ["OOTD_CPU_BF16"] = "0"
+os.environ["OOTD_COMPILE"] = "0"
+
+import torch
+from PIL import Image
+
+from services.ootd_tryon_service import (
+    MODEL_TYPE_FOR_CLOTH_TYPE,
+    OOTD_CATEGORY_FOR_CLOTH_TYPE,
+    OOTD_IMAGE_SIZE,
+    OOTDTryOnService,
+)
+
+
+def run_once(model, inputs, steps, image_scale, seed):
+    step_times = []
+    last = {"time": None}
+
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        now = time.perf_counter()
+        # the first step also pays for setup; only measure steady-state steps
+        if last["time"] is not None:
+            step_times.append(now - last["time"])
+        last["time"] = now
+        return {}
+
+    with torch.no_grad(), model.autocast():
+        model.pipe(
+            **inputs,
+            num_inference_steps=steps,
+            image_guidance_scale=image_scale,
+            generator=torch.manual_seed(seed),
+            callback_on_step_end=on_step_end,
+            output_type="latent",
+        )
+    return statistics.mean(step_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--person", required=True)
+    parser.add_argument("--cloth", required=True)
+    parser.add_argument("--cloth-type", default="upper", choices=sorted(MODEL_TYPE_FOR_CLOTH_TYPE))
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0: torch default)")
+    parser.add_argument("--image-scale", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-compile", action="store_true")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    print(f"{torch.get_num_threads()} intra-op threads, native bf16: {torch.ops.mkldnn._is_mkldnn_bf16_supported()}")
+
+    service = OOTDTryOnService()
+    model_type = MODEL_TYPE_FOR_CLOTH_TYPE[args.cloth_type]
+    service._load_model(model_type)
+    model = service.ootd_models[model_type]
+    # importable once the service has put services/ootd on sys.path
+    from pipelines_ootd.pipeline_ootd import stack_garment_features
+
+    person = Image.open(args.person).convert("RGB")
+    cloth = Image.open(args.cloth).convert("RGB").resize(OOTD_IMAGE_SIZE, Image.Resampling.LANCZOS)
+    image_ori, image_vton, mask = service._prepare_inputs(person, args.cloth_type)
+
+    with torch.no_grad():
+        prompt_embeds, garment_features = model.garment_conditioning(
+            model_type, OOTD_CATEGORY_FOR_CLOTH_TYPE[args.cloth_type], [cloth]
+        )
+        inputs = {
+            "prompt_embeds": prompt_embeds,
+            "spatial_attn_outputs": stack_garment_features(garment_features),
+            "person_latents": model.person_latents([image_vton], [image_ori]),
+            "image_vton": image_vton,
+            "mask": mask,
+            "image_ori": image_ori,
+        }
+
+    def enable_bf16():
+        model.autocast_dtype = torch.bfloat16
+
+    profiles = [
+        ("fp32", None),
+        ("+ channels_last", model.use_channels_last),
+        ("+ bf16 autocast", enable_bf16),
+    ]
+    if not args.skip_compile:
+        profiles.append(("+ torch.compile", model.compile_models))
+
+    for label, enable in profiles:
+        if enable is not None:
+            enable()
+        start = time.perf_counter()
+        # one untimed run to warm up kernels (and compile)
+        run_once(model, inputs, args.steps, args.image_scale, args.seed)
+        warmup = time.perf_counter() - start
+        step_seconds = statistics.mean(
+            run_once(model, inputs, args.steps, args.image_scale, args.seed) for _ in range(args.runs)
+        )
+        print(f"{label:18s} {step_seconds:8.3f} s/step   (warm-up run {warmup:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Speed and output similarity of DeepCache-style feature reuse in the vton UNet.
+
+Run from backend/ (needs the OOTDiffusion checkpoints):
+
+    python -m benchmarks.deep_cache_similarity --person person.jpg --cloth cloth.jpg --intervals 2 3 4 --depth 1
+
+Every configuration is run with the same seed as the full-compute baseline. It reports the
+mean wall time per image and the PSNR / SSIM of the decoded image against the baseline
+(SSIM on luma, 11x11 uniform windows).
+"""
+import argparse
+import statistics
+import time
+
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from services.ootd_tryon_service import (
+    MODEL_TYPE_FOR_CLOTH_TYPE,
+    OOTD_CATEGORY_FOR_CLOTH_TYPE,
+    OOTD_IMAGE_SIZE,
+    OOTDTryOnService,
+)
+
+
+def psnr(image, reference):
+    mse = F.mse_loss(image, reference).item()
+    return float("inf") if mse == 0 else 10 * torch.log10(torch.tensor(1.0 / mse)).item()
+
+
+def ssim(image, reference, window=11):
+    # images are (B, 3, H, W) in [0, 1]; compare luma
+    weights = torch.tensor([0.299, 0.587, 0.114], device=image.device).view(1, 3, 1, 1)
+    x, y = (image * weights).sum(1, keepdim=True), (reference * weights).sum(1, keepdim=True)
+    c1, c2 = 0.01**2, 0.03**2
+
+    mu_x, mu_y = F.avg_pool2d(x, window, 1), F.avg_pool2d(y, window, 1)
+    var_x = F.avg_pool2d(x * x, window, 1) - mu_x**2
+    var_y = F.avg_pool2d(y * y, window, 1) - mu_y**2
+    cov = F.avg_pool2d(x * y, window, 1) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x**2 + mu_y**2 + c1) * (var_x + var_y + c2))
+    return ssim_map.mean().item()
+
+
+def run_once(model, inputs, steps, image_scale, seed, interval, depth):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    with torch.no_grad():
+        images = model.pipe(
+            **inputs,
+            num_inference_steps=steps,
+            image_guidance_scale=image_scale,
+            generator=torch.manual_seed(seed),
+            output_type="pt",
+            deep_cache_interval=interval,
+            deep_cache_depth=depth,
+        ).images
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return images.float(), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--person", required=True)
+    parser.add_argument("--cloth", required=True)
+    parser.add_argument("--cloth-type", default="upper", choices=sorted(MODEL_TYPE_FOR_CLOTH_TYPE))
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--intervals", type=int, nargs="+", default=[2, 3, 4])
+    parser.add_argument("--depth", type=int, default=1)
+    parser.add_argument("--image-scale", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    service = OOTDTryOnService()
+    model_type = MODEL_TYPE_FOR_CLOTH_TYPE[args.cloth_type]
+    service._load_model(model_type)
+    model = service.ootd_models[model_type]
+    # importable once the service has put services/ootd on sys.path
+    from pipelines_ootd.pipeline_ootd import stack_garment_features
+
+    person = Image.open(args.person).convert("RGB")
+    cloth = Image.open(args.cloth).convert("RGB").resize(OOTD_IMAGE_SIZE, Image.Resampling.LANCZOS)
+    image_ori, image_vton, mask = service._prepare_inputs(person, args.cloth_type)
+
+    with torch.no_grad():
+        prompt_embeds, garment_features = model.garment_conditioning(
+            model_type, OOTD_CATEGORY_FOR_CLOTH_TYPE[args.cloth_type], [cloth]
+        )
+        inputs = {
+            "prompt_embeds": prompt_embeds,
+            "spatial_attn_outputs": stack_garment_features(garment_features),
+            "person_latents": model.person_latents([image_vton], [image_ori]),
+            "image_vton": image_vton,
+            "mask": mask,
+            "image_ori": image_ori,
+        }
+
+    reference = None
+    for interval in [1] + [interval for interval in args.intervals if interval > 1]:
+        # one untimed run to warm up kernels and the allocator
+        run_once(model, inputs, args.steps, args.image_scale, args.seed, interval, args.depth)
+        runs = [
+            run_once(model, inputs, args.steps, args.image_scale, args.seed, interval, args.depth)
+            for _ in range(args.runs)
+        ]
+        images, seconds = runs[-1][0], statistics.mean(t for _, t in runs)
+        if reference is None:
+            reference = images
+            print(f"interval  1 (full)        {seconds:7.3f}s")
+            continue
+        print(
+            f"interval {interval:2d} depth {args.depth}  {seconds:7.3f}s  "
+            f"PSNR {psnr(images, reference):6.2f} dB  SSIM {ssim(images, reference):.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Per-step cost of the OotdPipeline denoising loop, with and without `preallocate`.
+
+Run from backend/ (needs the OOTDiffusion checkpoints and, for allocation counts, CUDA):
+
+    python -m benchmarks.denoise_loop --person person.jpg --cloth cloth.jpg --steps 20 --runs 3
+
+For each mode it reports the mean step time, the number of CUDA allocator calls and the
+allocated bytes per step (from torch.cuda.memory_stats), and the largest difference between
+the final latents of the two modes.
+"""
+import argparse
+import statistics
+import time
+
+import torch
+from PIL import Image
+
+from services.ootd_tryon_service import (
+    MODEL_TYPE_FOR_CLOTH_TYPE,
+    OOTD_CATEGORY_FOR_CLOTH_TYPE,
+    OOTD_IMAGE_SIZE,
+    OOTDTryOnService,
+)
+
+
+def allocator_counters():
+    if not torch.cuda.is_available():
+        return None
+    stats = torch.cuda.memory_stats()
+    return stats["allocation.all.allocated"], stats["allocated_bytes.all.allocated"]
+
+
+def run_once(model, inputs, steps, image_scale, seed, preallocate):
+    step_times, step_allocs, step_bytes = [], [], []
+    last = {"time": None, "counters": None}
+
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        now, counters = time.perf_counter(), allocator_counters()
+        # the first step also pays for setup; only measure steady-state steps
+        if last["time"] is not None:
+            step_times.append(now - last["time"])
+            if counters is not None:
+                step_allocs.append(counters[0] - last["counters"][0])
+                step_bytes.append(counters[1] - last["counters"][1])
+        last["time"], last["counters"] = now, counters
+        return {}
+
+    with torch.no_grad():
+        latents = model.pipe(
+            **inputs,
+            num_inference_steps=steps,
+            image_guidance_scale=image_scale,
+            generator=torch.manual_seed(seed),
+            callback_on_step_end=on_step_end,
+            output_type="latent",
+            preallocate=preallocate,
+        ).images
+
+    return latents, {
+        "step_ms": 1000 * statistics.mean(step_times),
+        "allocs_per_step": statistics.mean(step_allocs) if step_allocs else None,
+        "mb_allocated_per_step": statistics.mean(step_bytes) / (1024 * 1024) if step_bytes else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--person", required=True)
+    parser.add_argument("--cloth", required=True)
+    parser.add_argument("--cloth-type", default="upper", choices=sorted(MODEL_TYPE_FOR_CLOTH_TYPE))
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--image-scale", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    service = OOTDTryOnService()
+    model_type = MODEL_TYPE_FOR_CLOTH_TYPE[args.cloth_type]
+    service._load_model(model_type)
+    model = service.ootd_models[model_type]
+    # importable once the service has put services/ootd on sys.path
+    from pipelines_ootd.pipeline_ootd import stack_garment_features
+
+    person = Image.open(args.person).convert("RGB")
+    cloth = Image.open(args.cloth).convert("RGB").resize(OOTD_IMAGE_SIZE, Image.Resampling.LANCZOS)
+    image_ori, image_vton, mask = service._prepare_inputs(person, args.cloth_type)
+
+    with torch.no_grad():
+        prompt_embeds, garment_features = model.garment_conditioning(
+            model_type, OOTD_CATEGORY_FOR_CLOTH_TYPE[args.cloth_type], [cloth]
+        )
+        inputs = {
+            "prompt_embeds": prompt_embeds,
+            "spatial_attn_outputs": stack_garment_features(garment_features),
+            "person_latents": model.person_latents([image_vton], [image_ori]),
+            "image_vton": image_vton,
+            "mask": mask,
+            "image_ori": image_ori,
+        }
+
+    results = {}
+    for preallocate in (False, True):
+        # one untimed run to warm up kernels and the allocator
+        run_once(model, inputs, args.steps, args.image_scale, args.seed, preallocate)
+        runs = [run_once(model, inputs, args.steps, args.image_scale, args.seed, preallocate) for _ in range(args.runs)]
+        results[preallocate] = runs[-1][0]
+        label = "preallocate" if preallocate else "default"
+        for key in ("step_ms", "allocs_per_step", "mb_allocated_per_step"):
+            values = [stats[key] for _, stats in runs if stats[key] is not None]
+            if values:
+                print(f"{label:12s} {key:22s} {statistics.mean(values):10.2f}")
+
+    max_diff = (results[True].float() - results[False].float()).abs().max().item()
+    print(f"max |latents(preallocate) - latents(default)| = {max_diff:.3e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Output quality and speed of the int8 dynamic-quantized OOTDiffusion models against float32, on CPU.
+
+Run from backend/ (needs the OOTDiffusion checkpoints):
+
+    python -m benchmarks.int8_quality --person person.jpg --cloth cloth.jpg --seeds 0 1 2 3 --steps 20
+
+The float32 model is run for every seed, then its UNet transformer layers and CLIP image encoder are
+quantized in place (honouring OOTD_INT8_EXCLUDE) and run again with the same seeds. It reports the
+PSNR / SSIM of each int8 image against its float32 counterpart and the mean time per image.
+"""
+import argparse
+import os
+import statistics
+import time
+
+# Float weights are loaded and quantized below, instead of loading a saved int8 artifact
+os.environ["OOTD_DEVICE"] = "cpu"
+os.environ["OOTD_QUANTIZE_INT8"] = "0"
+
+import torch
+from PIL import Image
+
+from benchmarks.deep_cache_similarity import psnr, ssim
+from services.ootd_tryon_service import (
+    MODEL_TYPE_FOR_CLOTH_TYPE,
+    OOTD_CATEGORY_FOR_CLOTH_TYPE,
+    OOTD_IMAGE_SIZE,
+    OOTDTryOnService,
+)
+
+
+def run_seeds(model, model_type, category, cloth, image_vton, mask, image_ori, seeds, steps, image_scale):
+    # importable once the service has put services/ootd on sys.path
+    from pipelines_ootd.pipeline_ootd import stack_garment_features
+
+    images, seconds = [], []
+    for seed in seeds:
+        start = time.perf_counter()
+        with torch.no_grad(), model.autocast():
+            prompt_embeds, garment_features = model.garment_conditioning(model_type, category, [cloth])
+            image = model.pipe(
+                prompt_embeds=prompt_embeds,
+                spatial_attn_outputs=stack_garment_features(garment_features),
+                image_vton=image_vton,
+                mask=mask,
+                image_ori=image_ori,
+                num_inference_steps=steps,
+                image_guidance_scale=image_scale,
+                generator=torch.manual_seed(seed),
+                output_type="pt",
+            ).images
+        seconds.append(time.perf_counter() - start)
+        images.append(image.float())
+    return images, statistics.mean(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--person", required=True)
+    parser.add_argument("--cloth", required=True)
+    parser.add_argument("--cloth-type", default="upper", choices=sorted(MODEL_TYPE_FOR_CLOTH_TYPE))
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2, 3])
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--image-scale", type=float, default=2.0)
+    args = parser.parse_args()
+
+    service = OOTDTryOnService()
+    model_type = MODEL_TYPE_FOR_CLOTH_TYPE[args.cloth_type]
+    service._load_model(model_type)
+    model = service.ootd_models[model_type]
+    category = OOTD_CATEGORY_FOR_CLOTH_TYPE[args.cloth_type]
+
+    person = Image.open(args.person).convert("RGB")
+    cloth = Image.open(args.cloth).convert("RGB").resize(OOTD_IMAGE_SIZE, Image.Resampling.LANCZOS)
+    image_ori, image_vton, mask = service._prepare_inputs(person, args.cloth_type)
+    inputs = (model, model_type, category, cloth, image_vton, mask, image_ori, args.seeds, args.steps, args.image_scale)
+
+    reference, float_seconds = run_seeds(*inputs)
+
+    model.quantize_component("unet_garm", model.pipe.unet_garm)
+    model.quantize_component("unet_vton", model.pipe.unet_vton)
+    model.quantize_component("image_encoder", model.image_encoder)
+    # garment features and the unconditional table were computed by the float models
+    model.garment_cache.clear()
+    model.constants.clear()
+    quantized, int8_seconds = run_seeds(*inputs)
+
+    psnrs, ssims = [], []
+    for seed, image, ref in zip(args.seeds, quantized, reference):
+        psnrs.append(psnr(image, ref))
+        ssims.append(ssim(image, ref))
+        print(f"seed {seed:4d}  PSNR {psnrs[-1]:6.2f} dB  SSIM {ssims[-1]:.4f}")
+    print(f"mean       PSNR {statistics.mean(psnrs):6.2f} dB  SSIM {statistics.mean(ssims):.4f}")
+    print(f"float32 {float_seconds:.1f} s/image, int8 {int8_seconds:.1f} s/image")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Time-to-ready and per-worker memory of the API server with several workers, pre-forked or independent.
+
+Run from backend/ on Linux (needs the OOTDiffusion checkpoints; TRYON_BACKEND and the OOTD_* settings are
+taken from the environment):
+
+    TRYON_BACKEND=local OOTD_DEVICE=cpu python -m benchmarks.startup --mode prefork --workers 4
+    TRYON_BACKEND=local OOTD_DEVICE=cpu python -m benchmarks.startup --mode uvicorn --workers 4
+
+`prefork` starts `python main.py` with PREFORK_WORKERS (weights loaded once, then forked), `uvicorn` starts
+`uvicorn main:app --workers` (every worker loads its own). Both run with PRELOAD_MODELS=1. The server is
+ready once /health/ready has answered 200 from every worker. For each process of the server it then
+reports RSS, PSS (shared pages divided among the processes mapping them) and the shared part of RSS, from
+/proc/<pid>/smaps_rollup. The sum of PSS is the memory the server really uses.
+
+`--mmap 0|1` and `--channels-last 0|1` override OOTD_MMAP_WEIGHTS and OOTD_CPU_CHANNELS_LAST, to check whether the
+weights really stay shared between workers:
+
+    TRYON_BACKEND=local OOTD_DEVICE=cpu python -m benchmarks.startup --workers 4 --mmap 1 --channels-last 0
+    TRYON_BACKEND=local OOTD_DEVICE=cpu python -m benchmarks.startup --workers 4 --mmap 0 --channels-last 0
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def ready_pid(port):
+    """pid of the worker that answered /health/ready with 200, or None"""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health/ready", timeout=5) as response:
+            return json.load(response).get("pid")
+    except (urllib.error.URLError, ConnectionError, TimeoutError, ValueError):
+        return None
+
+
+def descendants(pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the command name may contain spaces, the ppid follows its closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    found, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        found.append(current)
+        stack.extend(children.get(current, []))
+    return found
+
+
+def memory_kb(pid):
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    return fields
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default="prefork", choices=["prefork", "uvicorn"])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds to wait for every worker to be ready")
+    parser.add_argument("--mmap", choices=["0", "1"], help="OOTD_MMAP_WEIGHTS (default: from the environment)")
+    parser.add_argument("--channels-last", choices=["0", "1"], help="OOTD_CPU_CHANNELS_LAST (default: from the environment)")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PRELOAD_MODELS="1", PORT=str(args.port))
+    if args.mmap is not None:
+        env["OOTD_MMAP_WEIGHTS"] = args.mmap
+    if args.channels_last is not None:
+        env["OOTD_CPU_CHANNELS_LAST"] = args.channels_last
+    if args.mode == "prefork":
+        command = [sys.executable, "main.py"]
+        env["PREFORK_WORKERS"] = str(args.workers)
+    else:
+        command = [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.workers),
+        ]
+
+    start = time.perf_counter()
+    server = subprocess.Popen(command, env=env, start_new_session=True)
+    try:
+        ready = {}
+        while len(ready) < args.workers:
+            if server.poll() is not None:
+                raise SystemExit(f"server exited with code {server.returncode}")
+            if time.perf_counter() - start > args.timeout:
+                raise SystemExit(f"only {len(ready)} of {args.workers} workers ready after {args.timeout:.0f} s")
+            pid = ready_pid(args.port)
+            if pid is not None and pid not in ready:
+                ready[pid] = time.perf_counter() - start
+                print(f"worker {pid} ready after {ready[pid]:.1f} s")
+            time.sleep(0.2)
+        print(
+            f"{args.mode}, {args.workers} workers, mmap={env.get('OOTD_MMAP_WEIGHTS', '1')}, "
+            f"channels_last={env.get('OOTD_CPU_CHANNELS_LAST', '1')}: time-to-ready {max(ready.values()):.1f} s"
+        )
+
+        print(f"{'pid':>8s} {'role':8s} {'RSS MB':>9s} {'PSS MB':>9s} {'shared MB':>10s}")
+        total_pss = 0
+        for pid in descendants(server.pid):
+            fields = memory_kb(pid)
+            if not fields:
+                continue
+            role = "worker" if pid in ready else ("parent" if pid == server.pid else "helper")
+            shared = fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)
+            total_pss += fields.get("Pss", 0)
+            print(
+                f"{pid:8d} {role:8s} {fields.get('Rss', 0) / 1024:9.0f} {fields.get('Pss', 0) / 1024:9.0f} "
+                f"{shared / 1024:10.0f}"
+            )
+        print(f"total PSS {total_pss / 1024:.0f} MB")
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
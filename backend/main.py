@@ -1,16 +1,26 @@
 import os
+import json
+import asyncio
+import time
 import uvicorn
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from pathlib import Path
-import shutil
-from typing import Optional
+from typing import Optional, Tuple
 import logging
 
 from services.cloth_preprocessor import ClothPreprocessor
-from services.person_preprocessor import PersonPreprocessor
 from services.tryon_service import TryOnService
+from services.executor import get_executor
+from services.job_queue import TryOnJobQueue, JobStatus, QueueFullError
+from services.blob_store import BlobStore, derive_key
+from services.artifact_store import ArtifactStore, artifact_key
+from services.result_encoder import ResultEncoder, RESULT_SIZES
+from services.janitor import Janitor
+from services.metrics import get_metrics
+from services.readiness import Readiness
+from services import prefork, stage_workers
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,9 +42,221 @@ TEMP_DIR = Path("temp")
 for directory in [UPLOAD_DIR, RESULTS_DIR, TEMP_DIR]:
     directory.mkdir(exist_ok=True)
 
+blob_store = BlobStore({
+    "uploads": UPLOAD_DIR,
+    "cloth": TEMP_DIR / "cloth_processed",
+    "person": TEMP_DIR / "person_processed",
+    "results": RESULTS_DIR,
+})
+
+# Stage outputs stay decoded in memory and only hit disk when evicted or requested
+artifact_store = ArtifactStore(blob_store)
+result_encoder = ResultEncoder(artifact_store, TEMP_DIR / "result_variants")
+
+# Content-addressed responses never change, so clients and CDNs may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
 cloth_preprocessor = ClothPreprocessor()
-person_preprocessor = PersonPreprocessor()
-tryon_service = TryOnService()
+tryon_service = TryOnService(artifact_store)
+executor = get_executor()
+job_queue = TryOnJobQueue(tryon_service)
+
+def _job_pinned_keys():
+    """Inputs of queued and running jobs must survive eviction until the job is done"""
+    # Called from the janitor's worker thread; active_jobs takes a snapshot of the job table
+    for job in job_queue.active_jobs():
+        yield artifact_key(job.cloth_path)
+        yield artifact_key(job.person_path)
+
+readiness = Readiness()
+readiness.register("rembg")
+readiness.register("person_pose")
+for model_type in tryon_service.preload_model_types():
+    readiness.register(f"ootd_{model_type}")
+
+async def _preload_models():
+    """Load and warm up every model before reporting ready (PRELOAD_MODELS=1)"""
+    await readiness.preload(
+        "rembg",
+        lambda: executor.run_compute(cloth_preprocessor.load),
+        lambda: executor.run_compute(cloth_preprocessor.warm_up),
+    )
+    
+    # One warm-up per process worker, submitted together so each worker gets one
+    async def warm_up_person_workers():
+        reports = await asyncio.gather(
+            *[executor.run_process(stage_workers.warm_up) for _ in range(executor.process_workers)]
+        )
+        return {
+            "workers": len(reports),
+            "rss_bytes_per_worker": max((r["rss_bytes"] or 0) for r in reports) or None,
+        }
+    await readiness.preload("person_pose", warm_up_person_workers)
+    
+    for model_type in tryon_service.preload_model_types():
+        await readiness.preload(
+            f"ootd_{model_type}",
+            lambda: executor.run_io(tryon_service.load_local_model, model_type),
+            lambda: executor.run_compute(tryon_service.warm_up_local_model, model_type),
+        )
+    
+    readiness.finished_at = time.time()
+    logger.info(f"Preload finished, ready={readiness.ready}")
+
+temp_ttl = float(os.getenv("JANITOR_TEMP_TTL_SECONDS", "21600"))
+janitor = Janitor(
+    {
+        "uploads": (UPLOAD_DIR, float(os.getenv("JANITOR_UPLOADS_TTL_SECONDS", "86400"))),
+        "temp": (TEMP_DIR, temp_ttl),
+        "cloth": (TEMP_DIR / "cloth_processed", temp_ttl),
+        "person": (TEMP_DIR / "person_processed", temp_ttl),
+        "result_variants": (TEMP_DIR / "result_variants", temp_ttl),
+        "results": (RESULTS_DIR, float(os.getenv("JANITOR_RESULTS_TTL_SECONDS", "604800"))),
+        # only used by pre-forked workers; a file outlives its job by at least the job retention
+        "jobs": (TEMP_DIR / "jobs", job_queue.retention_seconds),
+    },
+    pinned_keys=_job_pinned_keys,
+)
+
+def share_state_across_workers():
+    """
+    Hand-offs between requests go through the filesystem, for pre-forked workers that don't share memory:
+    artifacts are written when stored, job states are mirrored to TEMP_DIR/jobs and janitor pins to TEMP_DIR/pins.
+    """
+    artifact_store.write_through = True
+    job_queue.share_state(TEMP_DIR / "jobs")
+    janitor.share_pins(TEMP_DIR / "pins")
+
+async def _resolve_upload(file: Optional[UploadFile], upload_hash: Optional[str]) -> Tuple[str, Path]:
+    """Return (hash, path) of an upload, storing `file` unless a known `upload_hash` was given"""
+    if upload_hash:
+        existing = blob_store.find("uploads", upload_hash)
+        if existing is not None:
+            logger.info(f"Reusing stored upload {upload_hash[:12]}...")
+            janitor.touch(existing)
+            return upload_hash, existing
+        if file is None:
+            raise HTTPException(status_code=404, detail="Unknown upload hash, please upload the file")
+    if file is None:
+        raise HTTPException(status_code=400, detail="Provide either a file or a known upload hash")
+    
+    data = await file.read()
+    suffix = Path(file.filename or "").suffix.lower()
+    upload_hash, path, created = await executor.run_io(blob_store.put_bytes, "uploads", data, suffix)
+    logger.info(f"Upload {file.filename} -> {path} ({len(data)} bytes, new={created})")
+    return upload_hash, path
+
+async def _preprocess_cloth_artifact(upload_hash: str, cloth_path: Path, category: str) -> Tuple[str, bool]:
+    """Returns (artifact_id, cached) of the preprocessed cloth"""
+    processed_hash = derive_key("cloth", upload_hash)
+    if artifact_store.contains("cloth", processed_hash):
+        logger.info(f"Reusing preprocessed cloth: {processed_hash[:12]}...")
+        return processed_hash, True
+    
+    with janitor.pin(upload_hash, processed_hash):
+        logger.info(f"Starting preprocessing: {processed_hash[:12]}...")
+        # rembg (ONNX Runtime) and OpenCV release the GIL, so a thread is enough here
+        processed_img = await executor.run_compute(cloth_preprocessor.process_image, str(cloth_path), category)
+        await executor.run_io(artifact_store.put, "cloth", processed_hash, processed_img)
+    logger.info(f"Preprocessing complete: {processed_hash[:12]}...")
+    return processed_hash, False
+
+async def _preprocess_person_artifact(upload_hash: str, person_path: Path) -> Tuple[str, bool]:
+    """Returns (artifact_id, cached) of the preprocessed person"""
+    processed_hash = derive_key("person", upload_hash)
+    if artifact_store.contains("person", processed_hash):
+        logger.info(f"Reusing preprocessed person: {processed_hash[:12]}...")
+        return processed_hash, True
+    
+    with janitor.pin(upload_hash, processed_hash):
+        # MediaPipe pose is not thread-safe and holds the GIL, so it runs in the process pool
+        processed_img = await executor.run_process(stage_workers.preprocess_person_image, str(person_path))
+        await executor.run_io(artifact_store.put, "person", processed_hash, processed_img)
+    return processed_hash, False
+
+def _check_stage_input(namespace: str, ref: str):
+    """Accept an artifact id, a path named by one, or an existing file path"""
+    key = artifact_key(ref)
+    if key is not None and artifact_store.contains(namespace, key):
+        return
+    if not os.path.exists(ref):
+        raise HTTPException(status_code=400, detail="Invalid file paths")
+
+def _parse_byte_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) of a single `bytes=` range; None to ignore the header. Raises 416 if unsatisfiable."""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else file_size - 1
+        else:
+            start = max(0, file_size - int(end_text))
+            end = file_size - 1
+    except ValueError:
+        return None
+    
+    end = min(end, file_size - 1)
+    if start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{file_size}"})
+    return start, end
+
+def _read_range(path: Path, start: int, end: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start + 1)
+
+async def _file_response(request: Request, path: Path, media_type: str, etag: str,
+                         immutable: bool, vary: Optional[str] = None) -> Response:
+    """FileResponse with a strong ETag, If-None-Match / If-Range handling and single byte ranges"""
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else "no-cache",
+    }
+    if vary:
+        headers["Vary"] = vary
+    janitor.touch(path)
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        file_size = path.stat().st_size
+        byte_range = _parse_byte_range(range_header, file_size)
+        if byte_range is not None:
+            start, end = byte_range
+            data = await executor.run_io(_read_range, path, start, end)
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+            return Response(data, status_code=206, media_type=media_type, headers=headers)
+    
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@app.on_event("startup")
+async def start_background_tasks():
+    await job_queue.start()
+    # One janitor per server: pre-forked workers other than worker 0 only record pins and touches
+    if prefork.is_primary_worker():
+        await janitor.start()
+    if readiness.enabled:
+        # Serve liveness while loading; readiness turns 200 once everything is warm
+        app.state.preload_task = asyncio.create_task(_preload_models())
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    preload_task = getattr(app.state, "preload_task", None)
+    if preload_task is not None:
+        preload_task.cancel()
+    await job_queue.stop()
+    await janitor.stop()
+    await executor.run_io(artifact_store.flush)
+    executor.shutdown(wait=False)
 
 @app.get("/")
 async def root():
@@ -42,40 +264,53 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    models = readiness.report()["models"]
     return {
-        "status": "healthy",
+        "status": "healthy" if readiness.ready else "starting",
         "services": {
-            "cloth_preprocessor": "ready",
-            "person_preprocessor": "ready",
-            "tryon_service": "ready"
+            "cloth_preprocessor": models["rembg"]["state"],
+            "person_preprocessor": models["person_pose"]["state"],
+            "tryon_service": "ready" if readiness.ready else "loading"
         }
     }
 
+@app.get("/health/live")
+async def liveness():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """503 until every preloaded model is loaded and warmed up"""
+    return JSONResponse(readiness.report(), status_code=200 if readiness.ready else 503)
+
+@app.api_route("/api/uploads/{upload_hash}", methods=["GET", "HEAD"])
+async def check_upload(upload_hash: str):
+    """Lets clients skip re-uploading an image the server already has"""
+    if not blob_store.exists("uploads", upload_hash):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"status": "success", "hash": upload_hash}
+
 @app.post("/api/preprocess/cloth")
 async def preprocess_cloth(
-    file: UploadFile = File(...),
-    category: str = Form(...)
+    file: Optional[UploadFile] = File(None),
+    category: str = Form(...),
+    known_hash: Optional[str] = Form(None, alias="hash")
 ):
+    upload_hash, cloth_path = await _resolve_upload(file, known_hash)
     try:
-        logger.info(f"Preprocessing cloth image: {file.filename}, category: {category}")
-        
-        cloth_path = UPLOAD_DIR / f"cloth_{file.filename}"
-        logger.info(f"Saving uploaded file to: {cloth_path}")
+        logger.info(f"Preprocessing cloth image: {cloth_path}, category: {category}")
         
-        with open(cloth_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        logger.info(f"File saved successfully, size: {cloth_path.stat().st_size} bytes")
-        logger.info(f"Starting preprocessing...")
-        
-        processed_path = cloth_preprocessor.process(str(cloth_path), category)
-        
-        logger.info(f"Preprocessing complete: {processed_path}")
+        processed_hash, cached = await _preprocess_cloth_artifact(upload_hash, cloth_path, category)
+        processed_path = artifact_store.path("cloth", processed_hash)
         
         return JSONResponse({
             "status": "success",
             "message": "Cloth preprocessed successfully",
-            "processed_path": processed_path,
+            "artifact_id": processed_hash,
+            "processed_path": str(processed_path),
+            "hash": upload_hash,
+            "processed_hash": processed_hash,
+            "cached": cached,
             "category": category
         })
     
@@ -84,20 +319,25 @@ async def preprocess_cloth(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/preprocess/person")
-async def preprocess_person(file: UploadFile = File(...)):
+async def preprocess_person(
+    file: Optional[UploadFile] = File(None),
+    known_hash: Optional[str] = Form(None, alias="hash")
+):
+    upload_hash, person_path = await _resolve_upload(file, known_hash)
     try:
-        logger.info(f"Preprocessing person image: {file.filename}")
-        
-        person_path = UPLOAD_DIR / f"person_{file.filename}"
-        with open(person_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        logger.info(f"Preprocessing person image: {person_path}")
         
-        processed_path = person_preprocessor.process(str(person_path))
+        processed_hash, cached = await _preprocess_person_artifact(upload_hash, person_path)
+        processed_path = artifact_store.path("person", processed_hash)
         
         return JSONResponse({
             "status": "success",
             "message": "Person image preprocessed successfully",
-            "processed_path": processed_path
+            "artifact_id": processed_hash,
+            "processed_path": str(processed_path),
+            "hash": upload_hash,
+            "processed_hash": processed_hash,
+            "cached": cached
         })
     
     except Exception as e:
@@ -113,23 +353,145 @@ async def virtual_tryon(
     try:
         logger.info(f"Running virtual try-on: cloth={cloth_path}, person={person_path}, category={category}")
         
-        if not os.path.exists(cloth_path) or not os.path.exists(person_path):
-            raise HTTPException(status_code=400, detail="Invalid file paths")
+        _check_stage_input("cloth", cloth_path)
+        _check_stage_input("person", person_path)
         
-        result_path = await tryon_service.run_tryon(cloth_path, person_path, category)
+        with janitor.pin(artifact_key(cloth_path), artifact_key(person_path)):
+            result_path, steps_run = await tryon_service.run_tryon(cloth_path, person_path, category)
         
         return JSONResponse({
             "status": "success",
             "message": "Virtual try-on completed successfully",
-            "result_path": result_path
+            "result_path": result_path,
+            "steps_run": steps_run,
         })
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in virtual try-on: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/tryon/full")
+async def full_tryon(
+    cloth_file: Optional[UploadFile] = File(None),
+    person_file: Optional[UploadFile] = File(None),
+    category: str = Form(...),
+    cloth_hash: Optional[str] = Form(None),
+    person_hash: Optional[str] = Form(None)
+):
+    """
+    Upload, preprocess and try on in one request. Cloth and person preprocessing
+    run concurrently and hand their outputs to the try-on in memory.
+    """
+    cloth_upload_hash, cloth_path = await _resolve_upload(cloth_file, cloth_hash)
+    person_upload_hash, person_path = await _resolve_upload(person_file, person_hash)
+    try:
+        logger.info(f"Running full try-on: cloth={cloth_path}, person={person_path}, category={category}")
+        
+        (cloth_id, cloth_cached), (person_id, person_cached) = await asyncio.gather(
+            _preprocess_cloth_artifact(cloth_upload_hash, cloth_path, category),
+            _preprocess_person_artifact(person_upload_hash, person_path),
+        )
+        
+        with janitor.pin(cloth_id, person_id):
+            result_path, steps_run = await tryon_service.run_tryon(cloth_id, person_id, category)
+        
+        return JSONResponse({
+            "status": "success",
+            "message": "Virtual try-on completed successfully",
+            "result_path": result_path,
+            "steps_run": steps_run,
+            "cloth": {"hash": cloth_upload_hash, "artifact_id": cloth_id, "cached": cloth_cached},
+            "person": {"hash": person_upload_hash, "artifact_id": person_id, "cached": person_cached},
+        })
+    
+    except Exception as e:
+        logger.error(f"Error in full try-on: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/jobs", status_code=202)
+async def submit_tryon_job(
+    cloth_path: str = Form(...),
+    person_path: str = Form(...),
+    category: str = Form(...)
+):
+    _check_stage_input("cloth", cloth_path)
+    _check_stage_input("person", person_path)
+    
+    try:
+        job = job_queue.submit(cloth_path, person_path, category)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    
+    return JSONResponse(
+        {
+            "status": "accepted",
+            "job_id": job.job_id,
+            "job_status": job.status,
+            "status_url": f"/api/jobs/{job.job_id}",
+            "events_url": f"/api/jobs/{job.job_id}/events",
+            "result_url": f"/api/jobs/{job.job_id}/result",
+        },
+        status_code=202,
+    )
+
+def _get_job_or_404(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}")
+async def get_tryon_job(job_id: str):
+    return _get_job_or_404(job_id).to_dict()
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_tryon_job_result(job_id: str):
+    job = _get_job_or_404(job_id)
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != JobStatus.SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    
+    return JSONResponse({
+        "status": "success",
+        "message": "Virtual try-on completed successfully",
+        "result_path": job.result_path,
+        "steps_run": job.steps_run,
+    })
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_tryon_job_events(job_id: str, request: Request):
+    """Server-Sent Events stream of job status and per-step progress"""
+    job = _get_job_or_404(job_id)
+    
+    async def event_stream():
+        async for event in job_queue.subscribe(job):
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event['status']}\ndata: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/result/{filename:path}")
-async def get_result(filename: str):
+async def get_result(
+    filename: str,
+    request: Request,
+    fmt: Optional[str] = Query(None, alias="format"),
+    size: str = Query("full")
+):
+    """
+    Try-on result, encoded once per format and size. `format` (png, webp, jpeg, avif)
+    defaults to the best one in the Accept header; `size` is full or thumb.
+    """
     # Remove 'results/' prefix if present (since RESULTS_DIR already has it)
     if filename.startswith("results/") or filename.startswith("results\\"):
         filename = filename.split("/", 1)[-1].split("\\", 1)[-1]
@@ -137,22 +499,90 @@ async def get_result(filename: str):
     file_path = RESULTS_DIR / filename
     logger.info(f"Fetching result: {file_path}")
     
-    if not file_path.exists():
-        logger.error(f"Result file not found: {file_path}")
+    key = artifact_key(filename)
+    if key is None or not artifact_store.contains("results", key):
+        if not file_path.is_file():
+            logger.error(f"Result file not found: {file_path}")
+            raise HTTPException(status_code=404, detail="Result not found")
+        # Not content-addressed, so it may change: validate by mtime and size
+        stat = file_path.stat()
+        return await _file_response(request, file_path, "image/png",
+                                    f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', immutable=False)
+    
+    if size not in RESULT_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(RESULT_SIZES)}")
+    try:
+        fmt_negotiated = result_encoder.negotiate(request.headers.get("accept"), fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if fmt_negotiated == "png" and size == "full":
+        # Results are held in memory until someone asks for the file
+        variant_path = await executor.run_io(artifact_store.persist, "results", key)
+    else:
+        variant_path = await executor.run_io(result_encoder.variant, key, fmt_negotiated, size)
+    if variant_path is None:
         raise HTTPException(status_code=404, detail="Result not found")
-    return FileResponse(file_path)
+    
+    return await _file_response(
+        request,
+        variant_path,
+        result_encoder.media_type(fmt_negotiated),
+        f'"{key}-{size}-{fmt_negotiated}"',
+        immutable=True,
+        vary="Accept" if fmt in (None, "auto") else None,
+    )
+
+@app.get("/api/artifacts/{artifact_id}")
+async def get_artifact(artifact_id: str, request: Request):
+    """PNG of a preprocessed image or result, written to disk on first request"""
+    namespace = artifact_store.locate(artifact_id) if artifact_key(artifact_id) == artifact_id else None
+    if namespace is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    
+    file_path = await executor.run_io(artifact_store.persist, namespace, artifact_id)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return await _file_response(request, file_path, "image/png", f'"{artifact_id}"', immutable=True)
+
+@app.get("/api/metrics")
+async def get_metrics_report():
+    """Counters, disk usage per directory and in-memory cache sizes"""
+    job_counts = {}
+    for job in list(job_queue.jobs.values()):
+        job_counts[job.status] = job_counts.get(job.status, 0) + 1
+    
+    return {
+        **get_metrics().snapshot(),
+        "disk": janitor.stats(),
+        "artifacts": artifact_store.stats(),
+        "jobs": job_counts,
+    }
 
 @app.delete("/api/cleanup")
 async def cleanup_files():
+    """Delete all stored files except those in use by in-flight requests and jobs"""
     try:
-        for directory in [UPLOAD_DIR, RESULTS_DIR, TEMP_DIR]:
-            for file in directory.glob("*"):
-                if file.is_file():
-                    file.unlink()
-        return {"status": "success", "message": "Cleanup completed"}
+        pinned = janitor.pinned()
+        artifact_store.clear(keep=lambda key: key in pinned)
+        result = await executor.run_io(janitor.sweep, True)
+        return {
+            "status": "success",
+            "message": "Cleanup completed",
+            "deleted_files": result["evicted_files"],
+            "deleted_bytes": result["evicted_bytes"],
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
-    print("Starting Uvicorn server...")
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=False)
+    port = int(os.getenv("PORT", "8000"))
+    workers = int(os.getenv("PREFORK_WORKERS", "1"))
+    if workers > 1:
+        # The OOTDiffusion weights are loaded once here and shared by the forked workers
+        print(f"Starting {workers} pre-forked Uvicorn workers...")
+        share_state_across_workers()
+        prefork.serve(app, "0.0.0.0", port, workers, preload=lambda: prefork.preload_ootd(tryon_service))
+    else:
+        print("Starting Uvicorn server...")
+        uvicorn.run(app, host="0.0.0.0", port=port, reload=False)
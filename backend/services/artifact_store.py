@@ -0,0 +1,160 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from services.blob_store import BlobStore, atomic_save_image, is_content_key
+from services.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+def artifact_key(ref: str) -> Optional[str]:
+    """Content key for an artifact id or for a path named `<key>.<ext>`; None for any other path"""
+    if not ref:
+        return None
+    stem = Path(ref).stem
+    return stem if is_content_key(stem) else None
+
+
+class ArtifactStore:
+    """
+    Hand-off of stage outputs (processed cloth / person images, try-on results) between requests.
+
+    Recent outputs are kept as decoded arrays in an in-memory LRU, bounded by
+    `ARTIFACT_CACHE_MB`, and addressed by `(namespace, key)` where the key is the
+    blob store content key. A PNG is only written to the blob store when an
+    artifact is evicted, when `persist` is called (e.g. the file is downloaded or
+    handed to an external API) or on `flush`. Reads fall back to the PNG on disk.
+    With `write_through` every artifact is written on `put`, so that other
+    processes (pre-forked workers) can read it; the LRU then only saves decodes.
+
+    `put` and `persist` may write files, so call them from a worker thread.
+    """
+
+    def __init__(self, blob_store: BlobStore, max_bytes: Optional[int] = None, write_through: bool = False):
+        self.blob_store = blob_store
+        self.max_bytes = max_bytes or int(os.getenv("ARTIFACT_CACHE_MB", "512")) * 1024 * 1024
+        self.write_through = write_through
+
+        self._arrays: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        # Evicted artifacts whose PNG is still being written
+        self._spilling: Dict[Tuple[str, str], np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+
+    def path(self, namespace: str, key: str) -> Path:
+        return self.blob_store.path(namespace, key)
+
+    def put(self, namespace: str, key: str, image: Union[Image.Image, np.ndarray]):
+        array = np.asarray(image)
+        evicted = []
+        with self._lock:
+            previous = self._arrays.pop((namespace, key), None)
+            if previous is not None:
+                self.current_bytes -= previous.nbytes
+            self._arrays[(namespace, key)] = array
+            self.current_bytes += array.nbytes
+
+            while self.current_bytes > self.max_bytes and len(self._arrays) > 1:
+                evicted_id, evicted_array = self._arrays.popitem(last=False)
+                self.current_bytes -= evicted_array.nbytes
+                self._spilling[evicted_id] = evicted_array
+                evicted.append(evicted_id)
+
+        if self.write_through:
+            self.persist(namespace, key)
+        for namespace_, key_ in evicted:
+            get_metrics().incr(f"artifacts.spilled.{namespace_}")
+            self._spill(namespace_, key_)
+
+    def get_array(self, namespace: str, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            array = self._arrays.get((namespace, key))
+            if array is not None:
+                self._arrays.move_to_end((namespace, key))
+                return array
+            array = self._spilling.get((namespace, key))
+            if array is not None:
+                return array
+
+        path = self.blob_store.find(namespace, key)
+        if path is None:
+            return None
+        with Image.open(path) as image:
+            array = np.asarray(image)
+        logger.info(f"Loaded {namespace} artifact {key[:12]}... from disk")
+        return array
+
+    def get_image(self, namespace: str, key: str) -> Optional[Image.Image]:
+        array = self.get_array(namespace, key)
+        return Image.fromarray(array) if array is not None else None
+
+    def in_memory(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return (namespace, key) in self._arrays or (namespace, key) in self._spilling
+
+    def contains(self, namespace: str, key: str) -> bool:
+        return self.in_memory(namespace, key) or self.blob_store.exists(namespace, key)
+
+    def locate(self, key: str) -> Optional[str]:
+        """Namespace holding `key`, if any"""
+        for namespace in self.blob_store.namespaces:
+            if self.contains(namespace, key):
+                return namespace
+        return None
+
+    def persist(self, namespace: str, key: str) -> Optional[Path]:
+        """Make sure the artifact exists on disk and return its path"""
+        existing = self.blob_store.find(namespace, key)
+        if existing is not None:
+            return existing
+
+        with self._lock:
+            array = self._arrays.get((namespace, key))
+            if array is None:
+                array = self._spilling.get((namespace, key))
+        if array is None:
+            return None
+
+        path = self.path(namespace, key)
+        atomic_save_image(Image.fromarray(array), path)
+        logger.info(f"Persisted {namespace} artifact {key[:12]}... to {path}")
+        return path
+
+    def flush(self):
+        """Persist everything still held only in memory"""
+        with self._lock:
+            ids = list(self._arrays)
+        for namespace, key in ids:
+            self.persist(namespace, key)
+
+    def clear(self, keep: Optional[Callable[[str], bool]] = None):
+        """Drop in-memory artifacts, except those whose key `keep` returns True for"""
+        with self._lock:
+            for artifact_id in list(self._arrays):
+                if keep is not None and keep(artifact_id[1]):
+                    continue
+                self.current_bytes -= self._arrays.pop(artifact_id).nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._arrays),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _spill(self, namespace: str, key: str):
+        try:
+            self.persist(namespace, key)
+        except Exception as e:
+            logger.error(f"Failed to persist evicted {namespace} artifact {key[:12]}...: {str(e)}")
+        finally:
+            with self._lock:
+                self._spilling.pop((namespace, key), None)
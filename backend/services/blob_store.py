@@ -0,0 +1,93 @@
+import os
+import hashlib
+import logging
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derive_key(*parts) -> str:
+    """Key for a derived artifact: hash of the input hashes and the parameters that produced it"""
+    return hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def is_content_key(name: str) -> bool:
+    return len(name) == 64 and all(c in "0123456789abcdef" for c in name)
+
+
+def _temp_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+
+
+def atomic_write_bytes(data: bytes, path: Path):
+    tmp_path = _temp_path(path)
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def atomic_save_image(image: Image.Image, path: Path, format: str = "PNG", **save_kwargs):
+    """Write to a temp file and rename, so concurrent readers never see a partial image"""
+    tmp_path = _temp_path(path)
+    image.save(tmp_path, format=format, **save_kwargs)
+    os.replace(tmp_path, path)
+
+
+class BlobStore:
+    """
+    Content-addressed storage for uploads, stage outputs and results.
+
+    Uploads are keyed by the SHA-256 of their bytes; stage outputs by
+    `derive_key(stage, input_key, params...)`. Each namespace maps to one
+    directory and files are named `<key><suffix>`, so identical inputs share
+    one file and concurrent requests never overwrite each other.
+    """
+
+    def __init__(self, namespaces: Dict[str, Path]):
+        self.namespaces = {name: Path(directory) for name, directory in namespaces.items()}
+        for directory in self.namespaces.values():
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, namespace: str, key: str, suffix: str = ".png") -> Path:
+        return self.namespaces[namespace] / f"{key}{suffix}"
+
+    def find(self, namespace: str, key: str) -> Optional[Path]:
+        if not is_content_key(key):
+            return None
+        for candidate in self.namespaces[namespace].glob(f"{key}.*"):
+            if candidate.is_file() and not candidate.name.endswith(".tmp"):
+                return candidate
+        return None
+
+    def exists(self, namespace: str, key: str) -> bool:
+        return self.find(namespace, key) is not None
+
+    def put_bytes(self, namespace: str, data: bytes, suffix: str = "") -> Tuple[str, Path, bool]:
+        """Store `data` under its hash. Returns (key, path, created)."""
+        key = hash_bytes(data)
+        existing = self.find(namespace, key)
+        if existing is not None:
+            return key, existing, False
+
+        path = self.path(namespace, key, suffix)
+        atomic_write_bytes(data, path)
+        logger.info(f"Stored {namespace} blob {key[:12]}... ({len(data)} bytes)")
+        return key, path, True
@@ -1,9 +1,14 @@
+import os
 import cv2
 import numpy as np
 from PIL import Image
-from rembg import remove
+from rembg import remove, new_session
 from pathlib import Path
+from typing import Optional
 import logging
+import threading
+
+from services.blob_store import atomic_save_image
 
 logger = logging.getLogger(__name__)
 
@@ -11,8 +16,36 @@ class ClothPreprocessor:
     def __init__(self):
         self.output_dir = Path("temp/cloth_processed")
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        
+        # One ONNX Runtime session for all calls; `remove()` without one builds a new session every time
+        self.rembg_model = os.getenv("REMBG_MODEL", "u2net")
+        self.session = None
+        self._session_lock = threading.Lock()
+    
+    def load(self):
+        with self._session_lock:
+            if self.session is None:
+                logger.info(f"Loading rembg model: {self.rembg_model}")
+                self.session = new_session(self.rembg_model)
+    
+    def warm_up(self):
+        """Run the full preprocessing chain once on a blank image"""
+        img = Image.new("RGB", (64, 64), (255, 255, 255))
+        img_no_bg = self._remove_background(img)
+        self._resize_cloth(self._cleanup_cloth(self._straighten_cloth(img_no_bg)))
     
-    def process(self, image_path: str, category: str) -> str:
+    def process(self, image_path: str, category: str, output_path: Optional[str] = None) -> str:
+        img_resized = self.process_image(image_path, category)
+        
+        if output_path is None:
+            output_path = self.output_dir / f"cloth_processed_{Path(image_path).stem}.png"
+        atomic_save_image(img_resized, Path(output_path))
+        
+        logger.info(f"Cloth processed successfully: {output_path}")
+        return str(output_path)
+    
+    def process_image(self, image_path: str, category: str) -> Image.Image:
+        """Run the preprocessing steps and return the RGBA result without writing it to disk"""
         try:
             logger.info(f"Processing cloth image: {image_path}")
             
@@ -31,19 +64,15 @@ class ClothPreprocessor:
             img_resized = self._resize_cloth(img_clean)
             logger.info("Cloth resized")
             
-            output_filename = f"cloth_processed_{Path(image_path).stem}.png"
-            output_path = self.output_dir / output_filename
-            img_resized.save(output_path)
-            
-            logger.info(f"Cloth processed successfully: {output_path}")
-            return str(output_path)
+            return img_resized
         except Exception as e:
             logger.error(f"Error processing cloth image: {str(e)}", exc_info=True)
             raise
     
     def _remove_background(self, img: Image.Image) -> Image.Image:
         logger.info("Removing background from cloth...")
-        img_no_bg = remove(img)
+        self.load()
+        img_no_bg = remove(img, session=self.session)
         return img_no_bg
     
     def _straighten_cloth(self, img: Image.Image) -> Image.Image:
@@ -0,0 +1,96 @@
+import os
+import asyncio
+import functools
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return max(1, int(value))
+    except ValueError:
+        logger.warning(f"Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+class StageExecutor:
+    """
+    Execution layer for blocking pipeline work.
+
+    - io pool: file reads/writes and remote API calls
+    - compute pool: OpenCV / ONNX Runtime / PyTorch work that releases the GIL
+    - process pool: pure-CPU stages that hold the GIL or keep per-thread state (MediaPipe)
+
+    All pools are bounded so a burst of requests queues up instead of
+    oversubscribing the host, and the event loop stays free to serve other requests.
+    """
+
+    def __init__(
+        self,
+        io_workers: Optional[int] = None,
+        compute_workers: Optional[int] = None,
+        process_workers: Optional[int] = None,
+    ):
+        cpu_count = os.cpu_count() or 2
+
+        self.io_workers = io_workers or _env_int("IO_WORKERS", min(32, cpu_count * 4))
+        self.compute_workers = compute_workers or _env_int("COMPUTE_WORKERS", max(1, cpu_count // 2))
+        self.process_workers = process_workers or _env_int("PROCESS_WORKERS", max(1, min(4, cpu_count // 2)))
+
+        self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="io")
+        self._compute_pool = ThreadPoolExecutor(max_workers=self.compute_workers, thread_name_prefix="compute")
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+        logger.info(
+            f"StageExecutor initialized: io={self.io_workers}, "
+            f"compute={self.compute_workers}, process={self.process_workers}"
+        )
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        # Created lazily: worker processes are only spawned once a CPU-bound stage runs.
+        # "spawn" avoids forking a parent that already holds torch / OpenMP threads.
+        if self._process_pool is None:
+            context = multiprocessing.get_context(os.getenv("PROCESS_START_METHOD", "spawn"))
+            self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers, mp_context=context)
+        return self._process_pool
+
+    async def _submit(self, pool, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+
+    async def run_io(self, func: Callable, *args, **kwargs) -> Any:
+        """Run blocking I/O (disk, network) in the io thread pool."""
+        return await self._submit(self._io_pool, func, *args, **kwargs)
+
+    async def run_compute(self, func: Callable, *args, **kwargs) -> Any:
+        """Run GIL-releasing native work (OpenCV, ONNX Runtime, torch) in the compute thread pool."""
+        return await self._submit(self._compute_pool, func, *args, **kwargs)
+
+    async def run_process(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a CPU-heavy stage in the process pool. `func` and its arguments must be picklable."""
+        return await self._submit(self._get_process_pool(), func, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True):
+        logger.info("Shutting down StageExecutor...")
+        self._io_pool.shutdown(wait=wait)
+        self._compute_pool.shutdown(wait=wait)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=wait)
+            self._process_pool = None
+
+
+_executor: Optional[StageExecutor] = None
+
+
+def get_executor() -> StageExecutor:
+    global _executor
+    if _executor is None:
+        _executor = StageExecutor()
+    return _executor
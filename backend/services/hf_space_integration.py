@@ -5,6 +5,9 @@ Calls the official levihsu/OOTDiffusion space API using Gradio Client
 
 from gradio_client import Client, handle_file
 import logging
+from typing import Optional
+from services.executor import get_executor
+from services.blob_store import atomic_save_image
 from pathlib import Path
 from PIL import Image
 import time
@@ -34,7 +37,7 @@ class HFSpaceOOTD:
         if self.hf_token:
             logger.info("Using HuggingFace authentication token")
     
-    async def run_tryon(self, cloth_path: str, person_path: str, category: str) -> str:
+    async def run_tryon(self, cloth_path: str, person_path: str, category: str, result_path: Optional[str] = None) -> str:
         """
         Run virtual try-on using HuggingFace Space API
         
@@ -42,10 +45,15 @@ class HFSpaceOOTD:
             cloth_path: Path to cloth image
             person_path: Path to person image
             category: Category (upper_body, lower_body, dress)
+            result_path: Where to store the result (defaults to a timestamped name)
             
         Returns:
             Path to result image
         """
+        # The Gradio client is blocking (HTTP + polling), keep it off the event loop
+        return await get_executor().run_io(self._run_tryon_blocking, cloth_path, person_path, category, result_path)
+    
+    def _run_tryon_blocking(self, cloth_path: str, person_path: str, category: str, result_path: Optional[str] = None) -> str:
         logger.info(f"Calling HF Space API for try-on: cloth={cloth_path}, person={person_path}")
         
         try:
@@ -113,20 +121,14 @@ class HFSpaceOOTD:
                 
                 # Copy to our results directory
                 result_img = Image.open(result_image_path)
-                timestamp = int(time.time())
-                result_filename = f"tryon_result_{timestamp}.png"
-                result_path = self.results_dir / result_filename
-                result_img.save(result_path)
+                result_path = self._save_result(result_img, result_path)
                 
                 logger.info(f"Result saved: {result_path}")
                 return str(result_path)
             elif isinstance(result, str):
                 # Direct path returned
                 result_img = Image.open(result)
-                timestamp = int(time.time())
-                result_filename = f"tryon_result_{timestamp}.png"
-                result_path = self.results_dir / result_filename
-                result_img.save(result_path)
+                result_path = self._save_result(result_img, result_path)
                 
                 logger.info(f"Result saved: {result_path}")
                 return str(result_path)
@@ -138,6 +140,14 @@ class HFSpaceOOTD:
             logger.error(f"HF Space API call failed: {str(e)}", exc_info=True)
             raise
     
+    def _save_result(self, result_img: Image.Image, result_path: Optional[str] = None) -> Path:
+        if result_path is None:
+            timestamp = int(time.time())
+            result_path = self.results_dir / f"tryon_result_{timestamp}.png"
+        result_path = Path(result_path)
+        atomic_save_image(result_img, result_path)
+        return result_path
+    
     def _map_category(self, category: str) -> str:
         """Map our category names to OOTDiffusion Space format"""
         # Space expects: 'Upper-body', 'Lower-body', 'Dress'
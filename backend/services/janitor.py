@@ -0,0 +1,253 @@
+import os
+import json
+import uuid
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.executor import get_executor
+from services.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Half-written files (`.<name>.<uuid>.tmp`) younger than this are left alone
+TEMP_FILE_GRACE_SECONDS = 3600
+
+
+def file_key(path: Path) -> str:
+    """Content key a stored file belongs to: `<key>.png`, `<key>.thumb.webp`, ... -> `<key>`"""
+    return path.name.split(".", 1)[0]
+
+
+class Janitor:
+    """
+    Background eviction for the upload, temp and results directories.
+
+    Every `interval` seconds it deletes files not accessed within their
+    directory's TTL, then, while the total size is above `quota_bytes`, the
+    least-recently-accessed remaining files. Files whose content key is pinned
+    (in-flight requests via `pin()`, queued/running jobs via `pinned_keys`) are
+    never deleted. Last access is the newest of mtime, atime and accesses
+    recorded with `touch()`, since many filesystems do not update atime.
+
+    Pins and touches are local to the process. With pre-forked workers,
+    `share_pins` makes them visible to the one worker that runs the sweeps:
+    pins are also written to files and touches also set the file's atime.
+    """
+
+    def __init__(
+        self,
+        directories: Dict[str, Tuple[Path, float]],
+        quota_bytes: Optional[int] = None,
+        interval: Optional[float] = None,
+        pinned_keys: Optional[Callable[[], Iterable[str]]] = None,
+    ):
+        self.directories = {name: (Path(directory), ttl) for name, (directory, ttl) in directories.items()}
+        self.quota_bytes = quota_bytes or int(os.getenv("JANITOR_QUOTA_MB", "4096")) * 1024 * 1024
+        self.interval = interval or float(os.getenv("JANITOR_INTERVAL_SECONDS", "300"))
+        self.pinned_keys = pinned_keys
+
+        self._pins: Counter = Counter()
+        self._accessed: Dict[Path, float] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.pins_dir: Optional[Path] = None
+
+        self.usage: Dict[str, dict] = {}
+        self.last_sweep: Optional[float] = None
+
+    def share_pins(self, pins_dir: Path):
+        """Record pins in `pins_dir/<pid>.<uuid>.pin` and touches in atime, for the sweeps of other processes"""
+        self.pins_dir = Path(pins_dir)
+        self.pins_dir.mkdir(parents=True, exist_ok=True)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Janitor started (every {self.interval:.0f}s, quota {self.quota_bytes // (1024 * 1024)} MB)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await get_executor().run_io(self.sweep)
+            except Exception as e:
+                logger.error(f"Janitor sweep failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    @contextmanager
+    def pin(self, *keys: Optional[str]):
+        """Protect files of these content keys for the duration of a request"""
+        keys = [key for key in keys if key]
+        with self._lock:
+            self._pins.update(keys)
+        pin_path = None
+        if self.pins_dir is not None and keys:
+            pin_path = self.pins_dir / f"{os.getpid()}.{uuid.uuid4().hex}.pin"
+            pin_path.write_text(json.dumps(keys))
+        try:
+            yield
+        finally:
+            if pin_path is not None:
+                pin_path.unlink(missing_ok=True)
+            with self._lock:
+                self._pins.subtract(keys)
+                self._pins += Counter()
+
+    def touch(self, path: Path):
+        now = time.time()
+        with self._lock:
+            self._accessed[Path(path)] = now
+        if self.pins_dir is not None:
+            try:
+                os.utime(path, (now, os.stat(path).st_mtime))
+            except OSError:
+                pass
+
+    def pinned(self) -> Set[str]:
+        with self._lock:
+            pinned = set(self._pins)
+        if self.pinned_keys is not None:
+            pinned.update(key for key in self.pinned_keys() if key)
+        if self.pins_dir is not None:
+            pinned.update(self._shared_pins())
+        return pinned
+
+    def _shared_pins(self) -> Set[str]:
+        """Keys pinned by any live process, removing the pin files of processes that died"""
+        keys = set()
+        for path in self.pins_dir.glob("*.pin"):
+            try:
+                os.kill(int(path.name.split(".", 1)[0]), 0)
+            except ProcessLookupError:
+                path.unlink(missing_ok=True)
+                continue
+            except ValueError:
+                continue
+            except PermissionError:
+                # alive, owned by another user
+                pass
+            try:
+                keys.update(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue
+        return keys
+
+    def _last_access(self, path: Path, stat: os.stat_result) -> float:
+        with self._lock:
+            touched = self._accessed.get(path, 0.0)
+        return max(stat.st_mtime, stat.st_atime, touched)
+
+    def _scan(self) -> List[Tuple[str, Path, os.stat_result, float]]:
+        entries = []
+        for name, (directory, _) in self.directories.items():
+            if not directory.is_dir():
+                continue
+            for path in directory.iterdir():
+                try:
+                    if not path.is_file():
+                        continue
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((name, path, stat, self._last_access(path, stat)))
+        return entries
+
+    def _evict(self, name: str, path: Path, size: int, reason: str) -> bool:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            # e.g. still open on Windows; try again next sweep
+            logger.warning(f"Janitor could not delete {path}: {str(e)}")
+            return False
+        with self._lock:
+            self._accessed.pop(path, None)
+        metrics = get_metrics()
+        metrics.incr(f"janitor.evicted_files.{name}")
+        metrics.incr(f"janitor.evicted_bytes.{name}", size)
+        metrics.incr(f"janitor.evicted_files.by_{reason}")
+        return True
+
+    def sweep(self, purge: bool = False) -> dict:
+        """
+        One eviction pass (blocking, run it in a worker thread).
+        With `purge`, every unpinned file is deleted regardless of TTL and quota.
+        """
+        now = time.time()
+        pinned = self.pinned()
+        evicted_files = 0
+        evicted_bytes = 0
+        kept = []
+
+        for name, path, stat, last_access in self._scan():
+            if path.name.endswith(".tmp"):
+                if now - stat.st_mtime > TEMP_FILE_GRACE_SECONDS and self._evict(name, path, stat.st_size, "ttl"):
+                    evicted_files += 1
+                    evicted_bytes += stat.st_size
+                continue
+            if file_key(path) in pinned:
+                kept.append((name, path, stat, last_access))
+                continue
+
+            ttl = self.directories[name][1]
+            if purge or now - last_access > ttl:
+                if self._evict(name, path, stat.st_size, "purge" if purge else "ttl"):
+                    evicted_files += 1
+                    evicted_bytes += stat.st_size
+                    continue
+            kept.append((name, path, stat, last_access))
+
+        total_bytes = sum(stat.st_size for _, _, stat, _ in kept)
+        if total_bytes > self.quota_bytes:
+            for name, path, stat, _ in sorted(kept, key=lambda entry: entry[3]):
+                if total_bytes <= self.quota_bytes:
+                    break
+                if file_key(path) in pinned:
+                    continue
+                if self._evict(name, path, stat.st_size, "quota"):
+                    evicted_files += 1
+                    evicted_bytes += stat.st_size
+                    total_bytes -= stat.st_size
+
+        self._record_usage()
+        self.last_sweep = now
+        if evicted_files:
+            logger.info(f"Janitor evicted {evicted_files} file(s), {evicted_bytes / (1024 * 1024):.1f} MB")
+        return {"evicted_files": evicted_files, "evicted_bytes": evicted_bytes, "pinned": len(pinned)}
+
+    def _record_usage(self):
+        usage = {name: {"files": 0, "bytes": 0} for name in self.directories}
+        for name, _, stat, _ in self._scan():
+            usage[name]["files"] += 1
+            usage[name]["bytes"] += stat.st_size
+
+        metrics = get_metrics()
+        for name, stats in usage.items():
+            metrics.set_gauge(f"disk.files.{name}", stats["files"])
+            metrics.set_gauge(f"disk.bytes.{name}", stats["bytes"])
+        metrics.set_gauge("disk.bytes.total", sum(stats["bytes"] for stats in usage.values()))
+        metrics.set_gauge("disk.quota_bytes", self.quota_bytes)
+        self.usage = usage
+
+    def stats(self) -> dict:
+        return {
+            "quota_bytes": self.quota_bytes,
+            "interval_seconds": self.interval,
+            "last_sweep": self.last_sweep,
+            "directories": {
+                name: {"path": str(directory), "ttl_seconds": ttl, **self.usage.get(name, {})}
+                for name, (directory, ttl) in self.directories.items()
+            },
+        }
@@ -0,0 +1,316 @@
+import os
+import re
+import json
+import asyncio
+import logging
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+from services.blob_store import atomic_write_bytes
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+# How often a subscriber to another worker's job re-reads its shared state
+SHARED_POLL_SECONDS = 0.5
+
+
+class JobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    TERMINAL = (SUCCEEDED, FAILED)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class TryOnJob:
+    def __init__(self, cloth_path: str, person_path: str, category: str, config_key: str = ""):
+        self.job_id = uuid.uuid4().hex
+        self.cloth_path = cloth_path
+        self.person_path = person_path
+        self.category = category
+        # `TryOnService.config_key()` at submission: the same inputs under another configuration are another job
+        self.config_key = config_key
+
+        self.status = JobStatus.QUEUED
+        self.step = 0
+        self.total_steps = 0
+        self.result_path: Optional[str] = None
+        # Denoising steps run for the result, when it was generated locally (early termination may cut it short)
+        self.steps_run: Optional[int] = None
+        self.error: Optional[str] = None
+
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+        # Where the job state is mirrored for other workers (`TryOnJobQueue.share_state`), and whether this
+        # is a read-only snapshot of another worker's job
+        self.state_path: Optional[Path] = None
+        self.remote = False
+
+        self._subscribers: List[asyncio.Queue] = []
+
+    @classmethod
+    def from_state(cls, state: dict, state_path: Path) -> "TryOnJob":
+        """Read-only snapshot of a job from its shared state file"""
+        job = cls(state["cloth_path"], state["person_path"], state["category"])
+        for name in ("job_id", "status", "step", "total_steps", "result_path", "steps_run", "error",
+                     "created_at", "started_at", "finished_at"):
+            setattr(job, name, state[name])
+        job.state_path = state_path
+        job.remote = True
+        return job
+
+    @property
+    def key(self):
+        return (self.cloth_path, self.person_path, self.category, self.config_key)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in JobStatus.TERMINAL
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "step": self.step,
+            "total_steps": self.total_steps,
+            "progress": 1.0 if self.status == JobStatus.SUCCEEDED else (round(self.step / self.total_steps, 4) if self.total_steps else 0.0),
+            "result_path": self.result_path,
+            "steps_run": self.steps_run,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def save_state(self):
+        if self.state_path is None or self.remote:
+            return
+        state = {**self.to_dict(), "cloth_path": self.cloth_path, "person_path": self.person_path,
+                 "category": self.category}
+        try:
+            atomic_write_bytes(json.dumps(state).encode(), self.state_path)
+        except OSError as e:
+            logger.error(f"Failed to save the state of job {self.job_id}: {str(e)}")
+
+    def _publish(self):
+        event = self.to_dict()
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+        self.save_state()
+
+    def set_status(
+        self,
+        status: str,
+        result_path: Optional[str] = None,
+        error: Optional[str] = None,
+        steps_run: Optional[int] = None,
+    ):
+        self.status = status
+        if status == JobStatus.RUNNING:
+            self.started_at = time.time()
+        if status in JobStatus.TERMINAL:
+            self.finished_at = time.time()
+        if result_path is not None:
+            self.result_path = result_path
+        if steps_run is not None:
+            self.steps_run = steps_run
+        if error is not None:
+            self.error = error
+        self._publish()
+
+    def set_progress(self, step: int, total_steps: int):
+        self.step = step
+        self.total_steps = total_steps
+        self._publish()
+
+
+class TryOnJobQueue:
+    """
+    Asynchronous try-on jobs.
+
+    `submit` returns immediately with a job; a fixed number of worker tasks run
+    jobs through `TryOnService.run_tryon`. Progress is pushed from the
+    pipeline's `callback_on_step_end` hook to any number of subscribers.
+    Submitting the same (cloth, person, category) under the same configuration
+    while an earlier job is still queued, running or succeeded returns that job
+    instead of redoing the work.
+
+    Jobs live in the memory of the process that queued them. With pre-forked
+    workers, `share_state` mirrors them to files so that any worker can report
+    a job's status, stream its events and pin its inputs; the job still runs,
+    and identical submissions are still merged, within one worker.
+    """
+
+    def __init__(self, tryon_service, workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 retention_seconds: Optional[float] = None):
+        self.tryon_service = tryon_service
+        self.workers = workers or int(os.getenv("TRYON_JOB_WORKERS", "4"))
+        self.max_pending = max_pending or int(os.getenv("TRYON_JOB_MAX_PENDING", "32"))
+        self.retention_seconds = retention_seconds or float(os.getenv("TRYON_JOB_RETENTION_SECONDS", "3600"))
+
+        self.jobs: Dict[str, TryOnJob] = {}
+        self._jobs_by_key: Dict[tuple, TryOnJob] = {}
+        self.state_dir: Optional[Path] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    def share_state(self, state_dir: Path):
+        """Mirror every job's state to `state_dir/<job_id>.json`, and look up jobs of other workers there"""
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+
+    async def start(self):
+        if self._worker_tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        for i in range(self.workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker(i)))
+        logger.info(f"TryOnJobQueue started with {self.workers} worker(s)")
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, cloth_path: str, person_path: str, category: str) -> TryOnJob:
+        self._prune()
+
+        config_key = self.tryon_service.config_key()
+        existing = self._jobs_by_key.get((cloth_path, person_path, category, config_key))
+        if existing is not None and existing.status != JobStatus.FAILED:
+            logger.info(f"Reusing job {existing.job_id} for identical submission")
+            return existing
+
+        job = TryOnJob(cloth_path, person_path, category, config_key)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Too many pending try-on jobs (limit {self.max_pending})")
+
+        self.jobs[job.job_id] = job
+        self._jobs_by_key[job.key] = job
+        if self.state_dir is not None:
+            job.state_path = self.state_dir / f"{job.job_id}.json"
+            job.save_state()
+        logger.info(f"Queued try-on job {job.job_id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[TryOnJob]:
+        job = self.jobs.get(job_id)
+        if job is None and self.state_dir is not None:
+            job = self._load_shared(job_id)
+        return job
+
+    def active_jobs(self) -> List[TryOnJob]:
+        """Unfinished jobs of this worker and, with shared state, of the other workers"""
+        jobs = [job for job in list(self.jobs.values()) if not job.is_finished]
+        if self.state_dir is not None:
+            for path in self.state_dir.glob("*.json"):
+                if path.stem in self.jobs:
+                    continue
+                job = self._load_shared(path.stem)
+                if job is not None and not job.is_finished:
+                    jobs.append(job)
+        return jobs
+
+    def _load_shared(self, job_id: str) -> Optional[TryOnJob]:
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        path = self.state_dir / f"{job_id}.json"
+        try:
+            state = json.loads(path.read_text())
+            return TryOnJob.from_state(state, path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    async def subscribe(self, job: TryOnJob, heartbeat_seconds: float = 15.0) -> AsyncIterator[Optional[dict]]:
+        """
+        Yield job snapshots as they change, ending after a terminal status.
+        Yields None when nothing happened for `heartbeat_seconds` so callers can keep the connection alive.
+        """
+        if job.remote:
+            async for event in self._poll_shared(job, heartbeat_seconds):
+                yield event
+            return
+
+        queue: asyncio.Queue = asyncio.Queue()
+        job._subscribers.append(queue)
+        try:
+            event = job.to_dict()
+            yield event
+            while event["status"] not in JobStatus.TERMINAL:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+        finally:
+            job._subscribers.remove(queue)
+
+    async def _poll_shared(self, job: TryOnJob, heartbeat_seconds: float) -> AsyncIterator[Optional[dict]]:
+        """`subscribe` for another worker's job, re-reading its state file"""
+        event = job.to_dict()
+        yield event
+        idle = 0.0
+        while event["status"] not in JobStatus.TERMINAL:
+            await asyncio.sleep(SHARED_POLL_SECONDS)
+            latest = self._load_shared(job.job_id)
+            if latest is None:
+                # pruned by its worker
+                return
+            if latest.to_dict() != event:
+                event = latest.to_dict()
+                idle = 0.0
+                yield event
+                continue
+            idle += SHARED_POLL_SECONDS
+            if idle >= heartbeat_seconds:
+                idle = 0.0
+                yield None
+
+    async def _worker(self, worker_id: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                job.set_status(JobStatus.RUNNING)
+
+                # Called from the inference thread, so hop back onto the event loop
+                def on_progress(step: int, total_steps: int, job=job):
+                    loop.call_soon_threadsafe(job.set_progress, step, total_steps)
+
+                result_path, steps_run = await self.tryon_service.run_tryon(
+                    job.cloth_path, job.person_path, job.category, progress_callback=on_progress
+                )
+                job.set_status(JobStatus.SUCCEEDED, result_path=result_path, steps_run=steps_run)
+                logger.info(f"Try-on job {job.job_id} succeeded: {result_path}")
+            except asyncio.CancelledError:
+                job.set_status(JobStatus.FAILED, error="cancelled")
+                raise
+            except Exception as e:
+                logger.error(f"Try-on job {job.job_id} failed: {str(e)}", exc_info=True)
+                job.set_status(JobStatus.FAILED, error=str(e))
+            finally:
+                self._queue.task_done()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id, job in list(self.jobs.items()):
+            if job.is_finished and job.finished_at < cutoff:
+                del self.jobs[job_id]
+                if self._jobs_by_key.get(job.key) is job:
+                    del self._jobs_by_key[job.key]
+                if job.state_path is not None:
+                    job.state_path.unlink(missing_ok=True)
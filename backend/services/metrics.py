@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+
+class Metrics:
+    """
+    Process-wide counters and gauges, reported by `GET /api/metrics`.
+
+    Names are dotted, with any label folded into the name
+    (e.g. `janitor.evicted_files.uploads`).
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._gauges: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def incr(self, name: str, value: float = 1.0):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "counters": dict(sorted(self._counters.items())),
+                "gauges": dict(sorted(self._gauges.items())),
+            }
+
+
+_metrics: Optional[Metrics] = None
+
+
+def get_metrics() -> Metrics:
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
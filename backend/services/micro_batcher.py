@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from services.executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching in front of a batched model call.
+
+    Callers `submit(key, item)` and await their own result. Items with the same
+    key (compatible shapes / settings) that arrive within `window_ms` of the
+    oldest pending item are run together as one `run_batch(key, items)` call in
+    the compute pool, which must return one result per item, in order.
+    A single consumer runs batches one after another, so items that arrive
+    while the model is busy are collected into the next batch.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[Hashable, List[Any]], List[Any]],
+        max_batch_size: int = 4,
+        window_ms: float = 25.0,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window_ms / 1000.0
+
+        # key -> [(arrival_time, item, future)]
+        self._pending: Dict[Hashable, List[Tuple[float, Any, asyncio.Future]]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._consumer: Optional[asyncio.Task] = None
+
+        self.batches_run = 0
+        self.items_run = 0
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        if self._consumer is None or self._consumer.done():
+            self._wakeup = asyncio.Event()
+            self._consumer = loop.create_task(self._consume())
+
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append((time.monotonic(), item, future))
+        self._wakeup.set()
+        return await future
+
+    def _oldest_key(self) -> Hashable:
+        return min(self._pending, key=lambda k: self._pending[k][0][0])
+
+    async def _consume(self):
+        while True:
+            await self._wakeup.wait()
+            if not self._pending:
+                self._wakeup.clear()
+                continue
+
+            key = self._oldest_key()
+            group = self._pending[key]
+            wait = group[0][0] + self.window - time.monotonic()
+            if wait > 0 and len(group) < self.max_batch_size:
+                await asyncio.sleep(wait)
+                group = self._pending[key]
+
+            batch = group[: self.max_batch_size]
+            rest = group[self.max_batch_size :]
+            if rest:
+                self._pending[key] = rest
+            else:
+                del self._pending[key]
+
+            # Drop callers that went away while waiting
+            batch = [entry for entry in batch if not entry[2].done()]
+            if not batch:
+                continue
+
+            items = [item for _, item, _ in batch]
+            logger.info(f"Running micro-batch of {len(items)} item(s) for key {key}")
+            try:
+                results = await get_executor().run_compute(self.run_batch, key, items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"run_batch returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, _, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+            self.batches_run += 1
+            self.items_run += len(items)
@@ -0,0 +1,55 @@
+"""
+Export unet_garm and unet_vton of an OOTDiffusion checkpoint to ONNX, for OOTD_ONNX_DIR.
+
+Run from backend/ (needs the OOTDiffusion checkpoints):
+
+    python -m services.ootd.export_onnx --model-type hd --output checkpoints/onnx
+
+writes checkpoints/onnx/hd/unet_garm and checkpoints/onnx/hd/unet_vton. The export runs in fp32 on CPU
+with the torch-only options (token merging, int8, torch.compile) disabled.
+"""
+import argparse
+import os
+
+# Export the plain float32 UNets
+os.environ["OOTD_DEVICE"] = "cpu"
+os.environ["OOTD_COMPILE"] = "0"
+os.environ["OOTD_QUANTIZE_INT8"] = "0"
+os.environ["OOTD_TOKEN_MERGE_RATIO"] = "0"
+os.environ["OOTD_ONNX_DIR"] = ""
+
+import torch
+
+from services.ootd_tryon_service import OOTD_CATEGORY_FOR_CLOTH_TYPE, OOTD_IMAGE_SIZE, OOTDTryOnService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-type", default="hd", choices=["hd", "dc"])
+    parser.add_argument("--output", default="checkpoints/onnx")
+    parser.add_argument("--batch-size", type=int, default=2, help="example batch size (the exported axis is dynamic)")
+    args = parser.parse_args()
+
+    service = OOTDTryOnService()
+    service._load_model(args.model_type)
+    model = service.ootd_models[args.model_type]
+    # importable once the service has put services/ootd on sys.path
+    from onnx_backend import export_unets
+
+    category = OOTD_CATEGORY_FOR_CLOTH_TYPE["upper" if args.model_type == "hd" else "lower"]
+    prompt_image = torch.zeros(args.batch_size, 1, model.image_encoder.config.projection_dim)
+    prompt_embeds = model.build_prompt_embeds(args.model_type, category, prompt_image)
+
+    width, height = OOTD_IMAGE_SIZE
+    export_unets(
+        model.pipe.unet_garm,
+        model.pipe.unet_vton,
+        prompt_embeds,
+        os.path.join(args.output, args.model_type),
+        latent_height=height // model.pipe.vae_scale_factor,
+        latent_width=width // model.pipe.vae_scale_factor,
+    )
+
+
+if __name__ == "__main__":
+    main()
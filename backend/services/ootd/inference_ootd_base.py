@@ -0,0 +1,597 @@
+import os
+import contextlib
+import hashlib
+import json
+import logging
+import random
+import time
+from functools import cached_property
+from pathlib import Path
+
+import torch
+from diffusers import AutoencoderKL, UniPCMultistepScheduler
+from transformers import AutoProcessor, CLIPTextModel, CLIPTokenizer, CLIPVisionModelWithProjection
+
+from pipelines_ootd.attention_garm import BasicTransformerBlock as GarmTransformerBlock
+from pipelines_ootd.attention_vton import BasicTransformerBlock as VtonTransformerBlock
+from pipelines_ootd.pipeline_ootd import split_garment_features, stack_garment_features
+from quantization import quantize_dynamic_int8
+from tensor_cache import TensorLRUCache
+
+logger = logging.getLogger(__name__)
+
+# Checkpoints shared by the HD and DC models; only their UNets differ
+VIT_PATH = "checkpoints/clip-vit-large-patch14"
+MODEL_PATH = "checkpoints/ootd"
+
+# "cuda", "cpu", or "auto" for CUDA when available
+DEVICE = os.getenv("OOTD_DEVICE", "auto")
+# CPU profile: intra-op threads (0 keeps torch's default), channels_last convolutions and bf16 autocast
+# ("auto" when the CPU has native bf16, i.e. AVX512-BF16 or AMX)
+CPU_THREADS = int(os.getenv("OOTD_CPU_THREADS", "0"))
+CPU_CHANNELS_LAST = os.getenv("OOTD_CPU_CHANNELS_LAST", "1") == "1"
+CPU_BF16 = os.getenv("OOTD_CPU_BF16", "auto")
+# torch.compile the UNets and the VAE, with inductor's compiled graphs cached on disk across restarts
+COMPILE = os.getenv("OOTD_COMPILE", "0") == "1"
+COMPILE_CACHE_DIR = os.getenv("OOTD_COMPILE_CACHE_DIR", "checkpoints/torch_compile_cache")
+# CPU only: int8 dynamic quantization of the UNet attention / feed-forward layers and the CLIP image encoder,
+# saved to INT8_CACHE_DIR on first load. INT8_EXCLUDE lists glob patterns of layer names kept in float.
+QUANTIZE_INT8 = os.getenv("OOTD_QUANTIZE_INT8", "0") == "1"
+INT8_EXCLUDE = [
+    pattern.strip()
+    for pattern in os.getenv("OOTD_INT8_EXCLUDE", "image_encoder.visual_projection").split(",")
+    if pattern.strip()
+]
+INT8_CACHE_DIR = os.getenv("OOTD_INT8_CACHE_DIR", "checkpoints/int8")
+# Run both UNets through ONNX Runtime from {ONNX_DIR}/{hd,dc} (written by `python -m services.ootd.export_onnx`)
+ONNX_DIR = os.getenv("OOTD_ONNX_DIR", "")
+ONNX_PROVIDERS = [p.strip() for p in os.getenv("OOTD_ONNX_PROVIDERS", "CPUExecutionProvider").split(",") if p.strip()]
+
+# Load with low_cpu_mem_usage (no random init, weights read from the memory-mapped safetensors files)
+# and map the int8 artifacts instead of reading them
+MMAP_WEIGHTS = os.getenv("OOTD_MMAP_WEIGHTS", "1") == "1"
+
+# Garment features are ~140 MB per garment at 1024x768 in fp16 (both guidance halves), so by default they live in host memory.
+# With fp16 storage, freshly computed features are rounded the same way, so a garment's first request matches later ones
+GARMENT_CACHE_MB = int(os.getenv("OOTD_GARMENT_CACHE_MB", "2048"))
+GARMENT_CACHE_FP16 = os.getenv("OOTD_GARMENT_CACHE_FP16", "1") == "1"
+GARMENT_CACHE_DEVICE = os.getenv("OOTD_GARMENT_CACHE_DEVICE", "cpu")
+# Take the unconditional garment features from a per-category table instead of running them per garment.
+# Approximate: the real unconditional branch still sees the garment's CLIP embedding in its prompt.
+CONSTANT_UNCOND_GARMENT = os.getenv("OOTD_CONSTANT_UNCOND_GARMENT", "0") == "1"
+# Denoise and decode only the mask's bounding box plus a margin (in pixels) of context
+CROP_TO_MASK = os.getenv("OOTD_CROP_TO_MASK", "0") == "1"
+CROP_MARGIN = int(os.getenv("OOTD_CROP_MARGIN", "64"))
+# Denoising loop on persistent buffers with the repaint noise precomputed (see benchmarks/denoise_loop.py)
+PREALLOCATE_LOOP = os.getenv("OOTD_PREALLOCATE_LOOP", "0") == "1"
+# Full vton UNet forward every N steps, shallow blocks only in between (1 disables it)
+DEEP_CACHE_INTERVAL = int(os.getenv("OOTD_DEEP_CACHE_INTERVAL", "1"))
+DEEP_CACHE_DEPTH = int(os.getenv("OOTD_DEEP_CACHE_DEPTH", "1"))
+# Share of self-attention tokens merged in the outermost OOTD_TOKEN_MERGE_DEPTH down/up blocks (0 disables it)
+TOKEN_MERGE_RATIO = float(os.getenv("OOTD_TOKEN_MERGE_RATIO", "0"))
+TOKEN_MERGE_DEPTH = int(os.getenv("OOTD_TOKEN_MERGE_DEPTH", "1"))
+# Stop denoising once the predicted x0 inside the mask changes by less than this for PATIENCE steps (0: off)
+EARLY_STOP_THRESHOLD = float(os.getenv("OOTD_EARLY_STOP_THRESHOLD", "0")) or None
+EARLY_STOP_PATIENCE = int(os.getenv("OOTD_EARLY_STOP_PATIENCE", "3"))
+# VAE latents of person images (masked and original), ~200 KB each at 1024x768
+PERSON_CACHE_MB = int(os.getenv("OOTD_PERSON_CACHE_MB", "64"))
+
+
+def cpu_supports_bf16() -> bool:
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_device(gpu_id):
+    """Device string for `gpu_id`, or "cpu" per `OOTD_DEVICE`"""
+    if DEVICE == "cpu" or (DEVICE == "auto" and not torch.cuda.is_available()):
+        return "cpu"
+    return 'cuda:' + str(gpu_id)
+
+
+def config_key(device) -> str:
+    """
+    Fingerprint of the settings above that change the output image on `device`, including the approximate
+    opt-in ones, so that results stored under an older configuration are not served for the current one.
+    """
+    on_cpu = device == "cpu"
+    settings = {
+        "device": "cpu" if on_cpu else "cuda",
+        "cpu_bf16": on_cpu and (CPU_BF16 == "1" or (CPU_BF16 == "auto" and cpu_supports_bf16())),
+        "int8": sorted(INT8_EXCLUDE) if QUANTIZE_INT8 and on_cpu else None,
+        "compile": COMPILE,
+        "onnx": ONNX_DIR or None,
+        "garment_cache_fp16": GARMENT_CACHE_FP16,
+        "constant_uncond_garment": CONSTANT_UNCOND_GARMENT,
+        "crop": CROP_MARGIN if CROP_TO_MASK else None,
+        "preallocate": PREALLOCATE_LOOP,
+        "deep_cache": (DEEP_CACHE_INTERVAL, DEEP_CACHE_DEPTH) if DEEP_CACHE_INTERVAL > 1 else None,
+        "token_merge": (TOKEN_MERGE_RATIO, TOKEN_MERGE_DEPTH) if TOKEN_MERGE_RATIO > 0 else None,
+        "early_stop": (EARLY_STOP_THRESHOLD, EARLY_STOP_PATIENCE) if EARLY_STOP_THRESHOLD else None,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def from_pretrained(model_cls, path, **kwargs):
+    """
+    `model_cls.from_pretrained(path, **kwargs)`, with `low_cpu_mem_usage=True` under `OOTD_MMAP_WEIGHTS=1`.
+
+    The model is then built without initializing its weights, and the state dict is read from the memory-mapped
+    safetensors file instead of a second in-memory copy. Whether the parameters keep pointing into the mapping
+    (and so stay shared with other processes) or are copied into their own memory depends on the diffusers /
+    accelerate version and on dtype conversions; `benchmarks.startup --mmap` measures it.
+    """
+    if MMAP_WEIGHTS:
+        kwargs.setdefault("low_cpu_mem_usage", True)
+    return model_cls.from_pretrained(path, **kwargs)
+
+
+def quantize_component(name, model):
+    """int8 dynamic quantization of the transformer-block linears of a UNet, or all linears of the image encoder"""
+    within = None if name == "image_encoder" else (VtonTransformerBlock, GarmTransformerBlock)
+    count = quantize_dynamic_int8(model, name, exclude=INT8_EXCLUDE, within=within)
+    logger.info(f"Quantized {count} linear layers of {name} to int8")
+    return count
+
+
+def load_component(name, source, load, device):
+    """
+    `load()` the `unet_garm`, `unet_vton` or `image_encoder` component from checkpoint `source`.
+
+    With `OOTD_QUANTIZE_INT8=1` on CPU the component is int8-quantized once and saved to `OOTD_INT8_CACHE_DIR`.
+    Later starts load the quantized module from there, without loading the float weights.
+    """
+    if not (QUANTIZE_INT8 and device == "cpu"):
+        return load()
+
+    key = "|".join([name, source, ",".join(sorted(INT8_EXCLUDE)), torch.__version__])
+    path = Path(INT8_CACHE_DIR) / f"{name}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.pt"
+    if path.exists():
+        logger.info(f"Loading int8 {name} from {path}")
+        # packed int8 weights are repacked on load; the float layers stay mapped
+        return torch.load(path, map_location="cpu", mmap=MMAP_WEIGHTS)
+
+    model = load()
+    quantize_component(name, model)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    torch.save(model, tmp_path)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved int8 {name} to {path}")
+    return model
+
+
+def image_hash(image) -> str:
+    digest = hashlib.sha256(f"{image.mode}|{image.size}".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class SharedComponents:
+    """
+    The parts of an OOTDiffusion model that the HD and DC checkpoints have in common, loaded once per device
+    and on first use: the CLIP text encoder and tokenizer, the CLIP image encoder (int8 per `load_component`)
+    and its processor, and the VAE, once per dtype (the DC model runs fp16 on GPU, HD fp32).
+    The text encoder and image encoder stay fp32 for both, as each model loaded them before.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.vaes = {}
+
+    def vae(self, dtype):
+        if dtype not in self.vaes:
+            self.vaes[dtype] = from_pretrained(AutoencoderKL, MODEL_PATH, subfolder="vae", torch_dtype=dtype).to(
+                self.device
+            )
+        return self.vaes[dtype]
+
+    def scheduler(self):
+        """A new scheduler for each pipeline, as the schedulers keep per-run state"""
+        return UniPCMultistepScheduler.from_config(self.scheduler_config)
+
+    @cached_property
+    def scheduler_config(self):
+        return UniPCMultistepScheduler.load_config(MODEL_PATH, subfolder="scheduler")
+
+    @cached_property
+    def tokenizer(self):
+        return CLIPTokenizer.from_pretrained(MODEL_PATH, subfolder="tokenizer")
+
+    @cached_property
+    def text_encoder(self):
+        return from_pretrained(CLIPTextModel, MODEL_PATH, subfolder="text_encoder").to(self.device)
+
+    @cached_property
+    def auto_processor(self):
+        return AutoProcessor.from_pretrained(VIT_PATH)
+
+    @cached_property
+    def image_encoder(self):
+        return load_component(
+            "image_encoder", VIT_PATH, lambda: from_pretrained(CLIPVisionModelWithProjection, VIT_PATH), self.device
+        ).to(self.device)
+
+
+class OOTDiffusionBase:
+    """
+    Shared inference code for the OOTDiffusion HD / DC checkpoints.
+
+    Subclasses set `MODEL_TYPE`, load their UNets into `pipe` and take `auto_processor`, `image_encoder`,
+    `tokenizer`, `text_encoder` and the VAE from a `SharedComponents` on `gpu_id`, which may be shared with
+    the other model type.
+    Everything derived from a garment alone (CLIP image embedding, garment VAE latent and the
+    `unet_garm` spatial attention features) is kept in `garment_cache`, keyed by
+    (garment hash, category, model type), so repeat garments skip the garment branch.
+    Tensors that only depend on the loaded model and category (the text embedding and, with
+    `OOTD_CONSTANT_UNCOND_GARMENT=1`, the unconditional garment features) are computed once into
+    `constants`. VAE latents of person images are kept in `person_cache`, keyed by image hash, so a
+    person trying on several garments is only encoded once.
+    """
+
+    def __init__(self):
+        self.garment_cache = TensorLRUCache(
+            GARMENT_CACHE_MB * 1024 * 1024,
+            store_dtype=torch.float16 if GARMENT_CACHE_FP16 else None,
+            store_device=GARMENT_CACHE_DEVICE,
+        )
+        self.person_cache = TensorLRUCache(PERSON_CACHE_MB * 1024 * 1024, store_device=GARMENT_CACHE_DEVICE)
+        self.constants = {}
+        self.autocast_dtype = None
+        # Set to 1 when the UNets run on ONNX Runtime, which has no DeepCache
+        self.deep_cache_interval = DEEP_CACHE_INTERVAL
+
+
+    def resolve_device(self, gpu_id):
+        return resolve_device(gpu_id)
+
+
+    @property
+    def on_cpu(self):
+        return self.gpu_id == "cpu"
+
+
+    def load_component(self, name, source, load):
+        return load_component(name, source, load, self.gpu_id)
+
+
+    def quantize_component(self, name, model):
+        return quantize_component(name, model)
+
+
+    def prepare_models(self):
+        """Applies the optional model settings from the environment, called by subclasses once everything is loaded"""
+        if TOKEN_MERGE_RATIO > 0:
+            self.pipe.unet_vton.set_token_merge_ratio(TOKEN_MERGE_RATIO, TOKEN_MERGE_DEPTH)
+            self.pipe.unet_garm.set_token_merge_ratio(TOKEN_MERGE_RATIO, TOKEN_MERGE_DEPTH)
+
+        if self.on_cpu:
+            if CPU_THREADS > 0:
+                torch.set_num_threads(CPU_THREADS)
+            if CPU_CHANNELS_LAST:
+                self.use_channels_last()
+            if CPU_BF16 == "1" or (CPU_BF16 == "auto" and cpu_supports_bf16()):
+                self.autocast_dtype = torch.bfloat16
+            logger.info(
+                f"OOTD CPU profile: {torch.get_num_threads()} threads, channels_last={CPU_CHANNELS_LAST}, "
+                f"autocast={self.autocast_dtype}"
+            )
+        if COMPILE:
+            self.compile_models()
+        if ONNX_DIR:
+            self.use_onnx_unets(os.path.join(ONNX_DIR, self.MODEL_TYPE))
+
+
+    def use_onnx_unets(self, model_dir):
+        """Replaces both UNets with ONNX Runtime sessions exported to `model_dir`, if there is an export"""
+        from onnx_backend import load_onnx_unets
+
+        unets = load_onnx_unets(model_dir, ONNX_PROVIDERS, CPU_THREADS)
+        if unets is None:
+            logger.warning(f"No ONNX export in {model_dir}, keeping the torch UNets")
+            return False
+        self.pipe.unet_garm, self.pipe.unet_vton = unets
+        if self.deep_cache_interval > 1:
+            logger.warning("DeepCache is not available with the ONNX UNets, ignoring OOTD_DEEP_CACHE_INTERVAL")
+            self.deep_cache_interval = 1
+        return True
+
+
+    def use_channels_last(self):
+        """NHWC memory format for the convolutions of both UNets and the VAE, which oneDNN runs faster on CPU"""
+        for model in (self.pipe.unet_vton, self.pipe.unet_garm, self.pipe.vae):
+            model.to(memory_format=torch.channels_last)
+
+
+    def compile_models(self):
+        """
+        `torch.compile` the UNets and the VAE encoder/decoder. Inductor's compiled graphs are kept in
+        `OOTD_COMPILE_CACHE_DIR`, so only the first start with a given model and input shape pays for compiling.
+        """
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.abspath(COMPILE_CACHE_DIR))
+        os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+        import torch._inductor.config as inductor_config
+        if hasattr(inductor_config, "fx_graph_cache"):
+            inductor_config.fx_graph_cache = True
+
+        self.pipe.unet_vton = torch.compile(self.pipe.unet_vton)
+        self.pipe.unet_garm = torch.compile(self.pipe.unet_garm)
+        # the VAE may be shared with the other model type, which compiled it already
+        if not hasattr(self.pipe.vae.encoder, "_orig_mod"):
+            self.pipe.vae.encoder = torch.compile(self.pipe.vae.encoder)
+            self.pipe.vae.decoder = torch.compile(self.pipe.vae.decoder)
+
+
+    def autocast(self):
+        """bf16 autocast for the CPU profile, a no-op otherwise"""
+        if self.autocast_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast("cpu", dtype=self.autocast_dtype)
+
+
+    def tokenize_captions(self, captions, max_length):
+        inputs = self.tokenizer(
+            captions, max_length=max_length, padding="max_length", truncation=True, return_tensors="pt"
+        )
+        return inputs.input_ids
+
+
+    def encode_image(self, image_garm):
+        # image_garm may be a single image or a list; one image embedding per garment
+        prompt_image = self.auto_processor(images=image_garm, return_tensors="pt").to(self.gpu_id)
+        prompt_image = self.image_encoder(prompt_image.data['pixel_values']).image_embeds
+        return prompt_image.unsqueeze(1)
+
+
+    def text_embeds(self, model_type, category):
+        """Text encoder output for the fixed HD caption or the DC category caption, computed once"""
+        if model_type == 'hd':
+            key = ("text", model_type, None)
+            captions, max_length = [""], 2
+        elif model_type == 'dc':
+            key = ("text", model_type, category)
+            captions, max_length = [category], 3
+        else:
+            raise ValueError("model_type must be \'hd\' or \'dc\'!")
+
+        if key not in self.constants:
+            with torch.no_grad():
+                self.constants[key] = self.text_encoder(self.tokenize_captions(captions, max_length).to(self.gpu_id))[0]
+        return self.constants[key]
+
+
+    def build_prompt_embeds(self, model_type, category, prompt_image):
+        prompt_embeds = self.text_embeds(model_type, category).repeat(prompt_image.shape[0], 1, 1)
+        if model_type == 'hd':
+            prompt_embeds[:, 1:] = prompt_image[:]
+        else:
+            prompt_embeds = torch.cat([prompt_embeds, prompt_image], dim=1)
+        return prompt_embeds
+
+
+    def uncond_garment_features(self, model_type, category, latent_shape):
+        """
+        `unet_garm` features of the zeroed garment latent, prompted with a zero image embedding, computed
+        once per model type, category and latent size.
+        """
+        key = ("uncond_garment", model_type, category if model_type == 'dc' else None, tuple(latent_shape))
+        if key not in self.constants:
+            unet_garm = self.pipe.unet_garm
+            prompt_image = torch.zeros(
+                1, 1, self.image_encoder.config.projection_dim, device=self.gpu_id, dtype=unet_garm.dtype
+            )
+            prompt_embeds = self.build_prompt_embeds(model_type, category, prompt_image).to(unet_garm.dtype)
+            latents = torch.zeros(1, *latent_shape[1:], device=self.gpu_id, dtype=unet_garm.dtype)
+            with torch.no_grad():
+                _, spatial_attn_outputs = unet_garm(latents, 0, encoder_hidden_states=prompt_embeds, return_dict=False)
+            self.constants[key] = [feature.to(self.pipe.unet_vton.dtype) for feature in spatial_attn_outputs]
+        return self.constants[key]
+
+
+    def encode_prompt(self, model_type, category, image_garm):
+        return self.build_prompt_embeds(model_type, category, self.encode_image(image_garm))
+
+
+    def person_latents(self, image_vton, image_ori):
+        """
+        VAE latents of the masked and original person images. Images not in `person_cache` are encoded
+        together in one VAE forward pass.
+        """
+        images = list(image_vton) + list(image_ori)
+        keys = [image_hash(image) for image in images]
+
+        latents = {
+            key: self.person_cache.get(key, dtype=self.pipe.vae.dtype, device=self.gpu_id)
+            for key in dict.fromkeys(keys)
+        }
+        missing = [key for key, value in latents.items() if value is None]
+        if missing:
+            encoded = self.pipe.encode_images([images[keys.index(key)] for key in missing])
+            for i, key in enumerate(missing):
+                latents[key] = encoded[i : i + 1]
+                self.person_cache.put(key, latents[key])
+
+        stacked = torch.cat([latents[key] for key in keys])
+        return stacked[: len(image_vton)], stacked[len(image_vton) :]
+
+
+    def crop_box(self, mask):
+        """
+        The latent box `OOTD_CROP_TO_MASK` denoises for this mask, or None. Batching only requests with the same
+        box keeps each one's result what it would be alone.
+        """
+        if not CROP_TO_MASK:
+            return None
+        return self.pipe.mask_crop_box(mask, CROP_MARGIN)
+
+
+    def garment_conditioning(self, model_type, category, image_garm, garment_hash=None):
+        """
+        Return (prompt_embeds, spatial_attn_outputs) for a list of garments, one entry per garment,
+        running CLIP and the garment UNet only for garments that are not cached yet.
+        """
+        if garment_hash is None:
+            garment_hash = [None] * len(image_garm)
+        # With the constant unconditional half, entries only hold the conditional garment features
+        keys = [
+            (h or image_hash(image), category, model_type, CONSTANT_UNCOND_GARMENT)
+            for image, h in zip(image_garm, garment_hash)
+        ]
+
+        def restore(entry):
+            entry["image_embeds"] = entry["image_embeds"].to(self.image_encoder.dtype)
+            entry["spatial_attn_outputs"] = [
+                feature.to(self.pipe.unet_vton.dtype) for feature in entry["spatial_attn_outputs"]
+            ]
+            return entry
+
+        entries = {}
+        for key in keys:
+            if key not in entries:
+                entry = self.garment_cache.get(key, device=self.gpu_id)
+                entries[key] = restore(entry) if entry is not None else None
+
+        missing = [key for key, entry in entries.items() if entry is None]
+        if missing:
+            missing_images = [image_garm[keys.index(key)] for key in missing]
+            image_embeds = self.encode_image(missing_images)
+            garm_latents, spatial_attn_outputs = self.pipe.encode_garment(
+                missing_images,
+                self.build_prompt_embeds(model_type, category, image_embeds),
+                with_uncond=not CONSTANT_UNCOND_GARMENT,
+            )
+            per_garment = split_garment_features(spatial_attn_outputs, len(missing))
+            for i, key in enumerate(missing):
+                entry = {
+                    "image_embeds": image_embeds[i : i + 1],
+                    "garm_latents": garm_latents[i : i + 1],
+                    "spatial_attn_outputs": per_garment[i],
+                }
+                self.garment_cache.put(key, entry)
+                # use what cache hits will get (e.g. rounded to fp16), not the exact features
+                entries[key] = restore(self.garment_cache.round_trip(entry))
+
+        image_embeds = torch.cat([entries[key]["image_embeds"] for key in keys])
+        prompt_embeds = self.build_prompt_embeds(model_type, category, image_embeds)
+        garment_features = [entries[key]["spatial_attn_outputs"] for key in keys]
+        if CONSTANT_UNCOND_GARMENT:
+            uncond = self.uncond_garment_features(model_type, category, entries[keys[0]]["garm_latents"].shape)
+            garment_features = [
+                [torch.cat((feature, uncond_feature)) for feature, uncond_feature in zip(features, uncond)]
+                for features in garment_features
+            ]
+        return prompt_embeds, garment_features
+
+
+    def __call__(self,
+                model_type='hd',
+                category='upperbody',
+                image_garm=None,
+                image_vton=None,
+                mask=None,
+                image_ori=None,
+                num_samples=1,
+                num_steps=20,
+                image_scale=1.0,
+                seed=-1,
+                callback_on_step_end=None,
+                garment_hash=None,
+                guidance_interval=None,
+    ):
+        if seed == -1:
+            random.seed(time.time())
+            seed = random.randint(0, 2147483647)
+        print('Initial seed: ' + str(seed))
+        generator = torch.manual_seed(seed)
+
+        with torch.no_grad(), self.autocast():
+            prompt_embeds, garment_features = self.garment_conditioning(
+                model_type, category, [image_garm], [garment_hash]
+            )
+
+            images = self.pipe(prompt_embeds=prompt_embeds,
+                        spatial_attn_outputs=stack_garment_features(garment_features, num_samples),
+                        person_latents=self.person_latents([image_vton], [image_ori]),
+                        image_vton=image_vton,
+                        mask=mask,
+                        image_ori=image_ori,
+                        num_inference_steps=num_steps,
+                        image_guidance_scale=image_scale,
+                        num_images_per_prompt=num_samples,
+                        generator=generator,
+                        callback_on_step_end=callback_on_step_end,
+                        crop_to_mask=CROP_TO_MASK,
+                        crop_margin=CROP_MARGIN,
+                        preallocate=PREALLOCATE_LOOP,
+                        guidance_interval=guidance_interval,
+                        deep_cache_interval=self.deep_cache_interval,
+                        deep_cache_depth=DEEP_CACHE_DEPTH,
+                        early_stop_threshold=EARLY_STOP_THRESHOLD,
+                        early_stop_patience=EARLY_STOP_PATIENCE,
+            ).images
+
+        return images
+
+
+    def run_batch(self,
+                model_type='hd',
+                category='upperbody',
+                image_garm=(),
+                image_vton=(),
+                mask=(),
+                image_ori=(),
+                seeds=(),
+                num_steps=20,
+                image_scale=1.0,
+                callback_on_step_end=None,
+                garment_hashes=None,
+                guidance_interval=None,
+                crop_box=None,
+    ):
+        """
+        Run several independent try-ons (same model_type / category / steps / scale)
+        through a single batched denoising loop, one image per request.
+
+        Each request gets its own generator seeded with its seed, so its noise is
+        exactly what `__call__(seed=...)` would draw for it when run alone.
+        `guidance_interval=(t_lo, t_hi)` applies image guidance only on timesteps in that range.
+        With `OOTD_CROP_TO_MASK`, `crop_box` (see `crop_box()`) is the box every mask of the batch is cropped to.
+        With early termination each request may stop before `num_steps`; the number of steps run for
+        it is stored in its image's `info["steps_run"]`.
+        """
+        if not (len(image_garm) == len(image_vton) == len(mask) == len(image_ori) == len(seeds)):
+            raise ValueError("run_batch inputs must all have the same length")
+        generators = [torch.Generator().manual_seed(seed) for seed in seeds]
+
+        with torch.no_grad(), self.autocast():
+            prompt_embeds, garment_features = self.garment_conditioning(
+                model_type, category, list(image_garm), garment_hashes
+            )
+
+            images = self.pipe(prompt_embeds=prompt_embeds,
+                        spatial_attn_outputs=stack_garment_features(garment_features),
+                        person_latents=self.person_latents(image_vton, image_ori),
+                        image_vton=list(image_vton),
+                        mask=list(mask),
+                        image_ori=list(image_ori),
+                        num_inference_steps=num_steps,
+                        image_guidance_scale=image_scale,
+                        num_images_per_prompt=1,
+                        generator=generators,
+                        callback_on_step_end=callback_on_step_end,
+                        crop_to_mask=CROP_TO_MASK,
+                        crop_margin=CROP_MARGIN,
+                        crop_box=crop_box,
+                        preallocate=PREALLOCATE_LOOP,
+                        guidance_interval=guidance_interval,
+                        deep_cache_interval=self.deep_cache_interval,
+                        deep_cache_depth=DEEP_CACHE_DEPTH,
+                        early_stop_threshold=EARLY_STOP_THRESHOLD,
+                        early_stop_patience=EARLY_STOP_PATIENCE,
+            ).images
+
+        for image, steps_run in zip(images, self.pipe.steps_run):
+            image.info["steps_run"] = steps_run
+        return images
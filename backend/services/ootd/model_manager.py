@@ -0,0 +1,107 @@
+"""
+The loaded OOTDiffusion models of a process, sharing their common components.
+
+The HD and DC checkpoints only differ in `unet_garm` / `unet_vton`. `OOTDModelManager` loads the VAE,
+CLIP text and image encoders, tokenizer and image processor once (`SharedComponents`) and keeps the
+per-model-type UNet pairs in an LRU bounded by `OOTD_UNET_BUDGET_MB`, so one process serves HD and DC
+traffic within a fixed memory budget. A model type evicted from the LRU is loaded again on its next request.
+"""
+import gc
+import logging
+import os
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Bytes of UNet weights kept loaded, summed over model types (0: no limit). The most recently used
+# model stays loaded even if it alone is over budget.
+UNET_BUDGET_MB = int(os.getenv("OOTD_UNET_BUDGET_MB", "0"))
+
+
+def module_bytes(module) -> int:
+    """Bytes of the parameters and buffers in `module`'s state dict, including int8 packed weights"""
+    if not isinstance(module, torch.nn.Module):
+        # ONNX Runtime stand-ins hold their weights outside of torch
+        return 0
+    total = 0
+    for value in module.state_dict().values():
+        tensors = value if isinstance(value, (tuple, list)) else (value,)
+        total += sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+    return total
+
+
+class OOTDModelManager:
+    """
+    Loaded OOTDiffusion models by model type ("hd" / "dc"), in least-recently-used order.
+
+    `load(model_type)` returns a ready model, loading it with the shared components if needed and evicting the
+    least recently used other model types while the UNets are over budget. Reads like a dict of the loaded
+    models: `model_type in manager` does not load, `manager[model_type]` raises `KeyError` for an unloaded
+    (or evicted) model type. Callers serialize `load`, as `OOTDTryOnService._load_model` does.
+    """
+
+    def __init__(self, gpu_id=0, budget_mb=UNET_BUDGET_MB):
+        self.gpu_id = gpu_id
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.models = OrderedDict()
+        self.model_bytes = {}
+        self.shared = None
+
+    def __contains__(self, model_type):
+        return model_type in self.models
+
+    def __getitem__(self, model_type):
+        model = self.models[model_type]
+        self.models.move_to_end(model_type)
+        return model
+
+    def __len__(self):
+        return len(self.models)
+
+    def keys(self):
+        return list(self.models)
+
+    def load(self, model_type):
+        if model_type in self.models:
+            return self[model_type]
+
+        # The OOTDiffusion modules import each other by bare name
+        sys.path.insert(0, str(Path(__file__).parent))
+        from inference_ootd_base import SharedComponents, resolve_device
+
+        if self.shared is None:
+            self.shared = SharedComponents(resolve_device(self.gpu_id))
+        if model_type == "hd":
+            from inference_ootd_hd import OOTDiffusionHD
+            model = OOTDiffusionHD(self.gpu_id, shared=self.shared)
+        elif model_type == "dc":
+            from inference_ootd_dc import OOTDiffusionDC
+            model = OOTDiffusionDC(self.gpu_id, shared=self.shared)
+        else:
+            raise ValueError("model_type must be \'hd\' or \'dc\'!")
+
+        self.models[model_type] = model
+        self.model_bytes[model_type] = module_bytes(model.pipe.unet_garm) + module_bytes(model.pipe.unet_vton)
+        logger.info(f"OOTDiffusion {model_type} UNets: {self.model_bytes[model_type] / 2**20:.0f} MB")
+        self.evict()
+        return model
+
+    def evict(self):
+        """Unload least recently used models until the UNets fit the budget, keeping the most recent one"""
+        if self.budget_bytes <= 0:
+            return
+        evicted = False
+        while len(self.models) > 1 and sum(self.model_bytes.values()) > self.budget_bytes:
+            model_type, _ = self.models.popitem(last=False)
+            freed = self.model_bytes.pop(model_type)
+            logger.info(f"Evicted OOTDiffusion {model_type} model ({freed / 2**20:.0f} MB of UNets)")
+            evicted = True
+        if evicted:
+            # a batch still running on an evicted model keeps it alive until it returns
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
@@ -0,0 +1,289 @@
+"""
+ONNX export of unet_vton / unet_garm and ONNX Runtime stand-ins for them in OotdPipeline.
+
+`UNetVton2DConditionModel.forward` takes the garment features as a Python list that the vton blocks walk
+with a running `spatial_attn_idx`. For export the list is flattened into named inputs
+`garment_feature_0 ... garment_feature_{n-1}` (in `spatial_attn_idx` order); `unet_garm` returns them as
+outputs of the same names. `export_unets` writes
+
+    {output_dir}/unet_garm/model.onnx, config.json
+    {output_dir}/unet_vton/model.onnx, config.json
+
+and `OnnxUNetGarm` / `OnnxUNetVton` are called exactly like the torch UNets by the pipeline, running the
+sessions with IO binding so latents, prompt embeddings and garment features are passed without copies.
+
+The vton graph is traced through a single forward, so the garment key/value cache of `VtonAttnProcessor` is not
+part of it: every call re-projects the garment features with each block's `to_k` / `to_v`, which the torch UNet
+only does on the first denoising step of a request.
+"""
+import json
+import logging
+import math
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+import torch
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+ONNX_OPSET = 17
+
+_NUMPY_DTYPES = {torch.float32: np.float32, torch.float16: np.float16, torch.int64: np.int64}
+_TORCH_DTYPES = {"float32": torch.float32, "float16": torch.float16}
+
+
+class VtonExportWrapper(nn.Module):
+    """unet_vton with the garment feature list flattened into positional inputs"""
+
+    def __init__(self, unet_vton: nn.Module):
+        super().__init__()
+        self.unet_vton = unet_vton
+
+    def forward(self, sample, timestep, encoder_hidden_states, *garment_features):
+        return self.unet_vton(
+            sample, list(garment_features), timestep, encoder_hidden_states=encoder_hidden_states, return_dict=False
+        )[0]
+
+
+class GarmExportWrapper(nn.Module):
+    """unet_garm returning only its spatial attention features, as a tuple"""
+
+    def __init__(self, unet_garm: nn.Module):
+        super().__init__()
+        self.unet_garm = unet_garm
+
+    def forward(self, sample, timestep, encoder_hidden_states):
+        _, spatial_attn_outputs = self.unet_garm(
+            sample, timestep, encoder_hidden_states=encoder_hidden_states, return_dict=False
+        )
+        return tuple(spatial_attn_outputs)
+
+
+def _export(model, args, path: Path, input_names, output_names, dynamic_axes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # models over 2 GB are written with their weights as external data next to model.onnx
+    torch.onnx.export(
+        model,
+        args,
+        str(path),
+        input_names=input_names,
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
+        opset_version=ONNX_OPSET,
+        do_constant_folding=True,
+    )
+
+
+@torch.no_grad()
+def export_unets(unet_garm, unet_vton, prompt_embeds, output_dir, latent_height=128, latent_width=96):
+    """
+    Export both UNets (fp32, on CPU) for `prompt_embeds` shaped conditioning and the given latent size.
+    Batch size, latent size and garment token counts are dynamic axes of the exported graphs.
+    """
+    output_dir = Path(output_dir)
+    unet_garm = unet_garm.to("cpu", torch.float32).eval()
+    unet_vton = unet_vton.to("cpu", torch.float32).eval()
+    prompt_embeds = prompt_embeds.to("cpu", torch.float32)
+    batch_size = prompt_embeds.shape[0]
+    timestep = torch.tensor(0.0)
+
+    garm_sample = torch.randn(batch_size, unet_garm.config.in_channels, latent_height, latent_width)
+    garment_features = GarmExportWrapper(unet_garm)(garm_sample, timestep, prompt_embeds)
+    feature_names = [f"garment_feature_{i}" for i in range(len(garment_features))]
+
+    _export(
+        GarmExportWrapper(unet_garm),
+        (garm_sample, timestep, prompt_embeds),
+        output_dir / "unet_garm" / "model.onnx",
+        input_names=["sample", "timestep", "encoder_hidden_states"],
+        output_names=feature_names,
+        dynamic_axes={
+            "sample": {0: "batch", 2: "height", 3: "width"},
+            "encoder_hidden_states": {0: "batch", 1: "sequence"},
+            **{name: {0: "batch", 1: f"tokens_{i}"} for i, name in enumerate(feature_names)},
+        },
+    )
+
+    vton_sample = torch.randn(batch_size, unet_vton.config.in_channels, latent_height, latent_width)
+    _export(
+        VtonExportWrapper(unet_vton),
+        (vton_sample, timestep, prompt_embeds, *garment_features),
+        output_dir / "unet_vton" / "model.onnx",
+        input_names=["sample", "timestep", "encoder_hidden_states", *feature_names],
+        output_names=["noise_pred"],
+        dynamic_axes={
+            "sample": {0: "batch", 2: "height", 3: "width"},
+            "encoder_hidden_states": {0: "batch", 1: "sequence"},
+            "noise_pred": {0: "batch", 2: "height", 3: "width"},
+            **{name: {0: "garment_batch", 1: f"tokens_{i}"} for i, name in enumerate(feature_names)},
+        },
+    )
+    unet_vton.reset_garment_cache()
+
+    config = {
+        "num_garment_features": len(feature_names),
+        # (latent downsampling, channels) of each garment feature, to allocate them as [batch, tokens, channels]
+        "garment_feature_layout": _feature_layout(
+            [feature.shape for feature in garment_features], latent_height, latent_width
+        ),
+        "num_upsamplers": unet_vton.num_upsamplers,
+        "out_channels": unet_vton.config.out_channels,
+        "dtype": "float32",
+    }
+    for name in ("unet_garm", "unet_vton"):
+        with open(output_dir / name / "config.json", "w") as f:
+            json.dump(config, f, indent=2)
+    logger.info(f"Exported unet_garm and unet_vton to {output_dir}")
+
+
+def _feature_layout(shapes, latent_height, latent_width):
+    """[downsampling, channels] of garment features of these `[batch, tokens, channels]` shapes at this latent size"""
+    return [[round(math.sqrt(latent_height * latent_width / shape[1])), shape[2]] for shape in shapes]
+
+
+def _bind_input(binding, name: str, tensor: torch.Tensor):
+    binding.bind_input(
+        name,
+        tensor.device.type,
+        tensor.device.index or 0,
+        _NUMPY_DTYPES[tensor.dtype],
+        tuple(tensor.shape),
+        tensor.data_ptr(),
+    )
+
+
+def _bind_output(binding, name: str, tensor: torch.Tensor):
+    binding.bind_output(
+        name,
+        tensor.device.type,
+        tensor.device.index or 0,
+        _NUMPY_DTYPES[tensor.dtype],
+        tuple(tensor.shape),
+        tensor.data_ptr(),
+    )
+
+
+class _OnnxUNet:
+    def __init__(self, model_dir, providers: Sequence[str] = ("CPUExecutionProvider",), num_threads: int = 0):
+        import onnxruntime as ort
+
+        model_dir = Path(model_dir)
+        with open(model_dir / "config.json") as f:
+            self.config = json.load(f)
+        self.dtype = _TORCH_DTYPES[self.config["dtype"]]
+        self.num_upsamplers = self.config["num_upsamplers"]
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if num_threads > 0:
+            session_options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(model_dir / "model.onnx"), sess_options=session_options, providers=list(providers)
+        )
+        logger.info(f"Loaded ONNX {model_dir} with providers {self.session.get_providers()}")
+
+    def _inputs(self, sample, timestep, encoder_hidden_states):
+        # the inputs must stay referenced until the session has run
+        return {
+            "sample": sample.to(self.dtype).contiguous(),
+            "timestep": torch.as_tensor(timestep, dtype=torch.float32, device=sample.device).reshape(()),
+            "encoder_hidden_states": encoder_hidden_states.to(self.dtype).contiguous(),
+        }
+
+    def reset_garment_cache(self):
+        pass
+
+    def reset_deep_cache(self):
+        pass
+
+
+class OnnxUNetGarm(_OnnxUNet):
+    """
+    Stand-in for `unet_garm`: `(None, spatial_attn_outputs)` from an ONNX Runtime session, written straight into
+    tensors allocated on the sample's device.
+    """
+
+    def __init__(self, model_dir, providers: Sequence[str] = ("CPUExecutionProvider",), num_threads: int = 0):
+        super().__init__(model_dir, providers, num_threads)
+        self.feature_names = [f"garment_feature_{i}" for i in range(self.config["num_garment_features"])]
+        self.feature_layout = self.config.get("garment_feature_layout")
+
+    def _run(self, inputs, outputs=None):
+        binding = self.session.io_binding()
+        for name, tensor in inputs.items():
+            _bind_input(binding, name, tensor)
+        sample = inputs["sample"]
+        for i, name in enumerate(self.feature_names):
+            if outputs is None:
+                binding.bind_output(name, sample.device.type, sample.device.index or 0)
+            else:
+                _bind_output(binding, name, outputs[i])
+        self.session.run_with_iobinding(binding)
+        return binding
+
+    def __call__(self, sample, timestep, encoder_hidden_states=None, return_dict=False, **kwargs):
+        inputs = self._inputs(sample, timestep, encoder_hidden_states)
+        batch_size, _, height, width = sample.shape
+        if self.feature_layout is None:
+            # exported without the feature layout: read it off one run with ORT allocating the outputs
+            shapes = [value.shape() for value in self._run(inputs).get_outputs()]
+            self.feature_layout = _feature_layout(shapes, height, width)
+
+        spatial_attn_outputs = [
+            torch.empty(
+                (batch_size, (height // scale) * (width // scale), channels), dtype=self.dtype, device=sample.device
+            )
+            for scale, channels in self.feature_layout
+        ]
+        self._run(inputs, spatial_attn_outputs)
+        return None, [feature.to(sample.dtype) for feature in spatial_attn_outputs]
+
+
+class OnnxUNetVton(_OnnxUNet):
+    """
+    Stand-in for `unet_vton`: the noise prediction from an ONNX Runtime session, written straight into a
+    preallocated output tensor. DeepCache feature reuse is not available (`OOTDiffusionBase.use_onnx_unets`
+    turns it off), and the garment keys and values are projected again on every call rather than once per
+    request.
+    """
+
+    def __call__(
+        self,
+        sample,
+        spatial_attn_inputs: List[torch.Tensor],
+        timestep,
+        encoder_hidden_states=None,
+        return_dict=False,
+        deep_cache_depth=None,
+        reuse_deep_cache=False,
+        **kwargs,
+    ):
+        if reuse_deep_cache:
+            raise ValueError("DeepCache feature reuse is not available with the ONNX UNets")
+        inputs = self._inputs(sample, timestep, encoder_hidden_states)
+        for i, feature in enumerate(spatial_attn_inputs):
+            inputs[f"garment_feature_{i}"] = feature.to(self.dtype).contiguous()
+
+        binding = self.session.io_binding()
+        for name, tensor in inputs.items():
+            _bind_input(binding, name, tensor)
+        noise_pred = torch.empty(
+            (sample.shape[0], self.config["out_channels"], *sample.shape[2:]), dtype=self.dtype, device=sample.device
+        )
+        _bind_output(binding, "noise_pred", noise_pred)
+        self.session.run_with_iobinding(binding)
+        return (noise_pred.to(sample.dtype),)
+
+
+def load_onnx_unets(model_dir, providers: Sequence[str], num_threads: int = 0):
+    """(OnnxUNetGarm, OnnxUNetVton) for an `export_unets` output directory, or None if it was not exported"""
+    model_dir = Path(model_dir)
+    if not all((model_dir / name / "model.onnx").exists() for name in ("unet_garm", "unet_vton")):
+        return None
+    return (
+        OnnxUNetGarm(model_dir / "unet_garm", providers, num_threads),
+        OnnxUNetVton(model_dir / "unet_vton", providers, num_threads),
+    )
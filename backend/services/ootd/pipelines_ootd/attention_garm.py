@@ -26,6 +26,8 @@ from diffusers.models.embeddings import SinusoidalPositionalEmbedding
 from diffusers.models.lora import LoRACompatibleLinear
 from diffusers.models.normalization import AdaLayerNorm, AdaLayerNormZero
 
+from .token_merge import bipartite_soft_matching
+
 
 @maybe_allow_in_graph
 class GatedSelfAttentionDense(nn.Module):
@@ -210,6 +212,9 @@ class BasicTransformerBlock(nn.Module):
         self._chunk_size = None
         self._chunk_dim = 0
 
+        # share of the tokens merged before self-attention, see `token_merge.py` (0 disables token merging)
+        self.token_merge_ratio = 0.0
+
     def set_chunk_feed_forward(self, chunk_size: Optional[int], dim: int):
         # Sets chunk feed-forward
         self._chunk_size = chunk_size
@@ -261,12 +266,18 @@ class BasicTransformerBlock(nn.Module):
         cross_attention_kwargs = cross_attention_kwargs.copy() if cross_attention_kwargs is not None else {}
         gligen_kwargs = cross_attention_kwargs.pop("gligen", None)
 
+        # Token merging: similar tokens are averaged before attn1 and unmerged afterwards. The unmerged
+        # hidden states were already stored for the vton UNet above.
+        merge, unmerge = bipartite_soft_matching(
+            norm_hidden_states, self.token_merge_ratio if attention_mask is None else 0.0
+        )
         attn_output = self.attn1(
-            norm_hidden_states,
+            merge(norm_hidden_states),
             encoder_hidden_states=encoder_hidden_states if self.only_cross_attention else None,
             attention_mask=attention_mask,
             **cross_attention_kwargs,
         )
+        attn_output = unmerge(attn_output)
         if self.use_ada_layer_norm_zero:
             attn_output = gate_msa.unsqueeze(1) * attn_output
         elif self.use_ada_layer_norm_single:
@@ -13,9 +13,10 @@
 # limitations under the License.
 
 # Modified by Yuhao Xu for OOTDiffusion (https://github.com/levihsu/OOTDiffusion)
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
 import torch
+import torch.nn.functional as F
 from torch import nn
 
 from diffusers.utils import USE_PEFT_BACKEND
@@ -26,6 +27,122 @@ from diffusers.models.embeddings import SinusoidalPositionalEmbedding
 from diffusers.models.lora import LoRACompatibleLinear
 from diffusers.models.normalization import AdaLayerNorm, AdaLayerNormZero
 
+from .token_merge import bipartite_soft_matching, merge_tokens
+
+
+class VtonAttnProcessor:
+    r"""
+    Self-attention of the vton blocks over the person tokens concatenated with the garment feature.
+
+    Only the person tokens are used as queries, keys and values come from the person and garment tokens
+    together. The garment half of the output used to be computed and then discarded, so this gives the same
+    result as attending over the full concatenated sequence with roughly half the FLOPs and activation memory.
+
+    The garment keys and values can also be passed precomputed. `garment_key_value` projects them once per
+    garment feature tensor and keeps them until it is called with a different one or `reset()` is called,
+    so the denoising loop projects the constant garment half on its first step only. With token merging the
+    garment tokens are merged before the projection and the merged keys and values are cached.
+    """
+
+    def __init__(self):
+        self._garment_source = None
+        self._garment_settings = None
+        self._garment_key_value = None
+
+    def reset(self):
+        self._garment_source = None
+        self._garment_settings = None
+        self._garment_key_value = None
+
+    def garment_key_value(
+        self,
+        attn: Attention,
+        norm: nn.Module,
+        garment_feature: torch.FloatTensor,
+        scale: float = 1.0,
+        merge_ratio: float = 0.0,
+    ) -> Tuple[torch.FloatTensor, torch.FloatTensor]:
+        """
+        Projected keys and values of `norm(garment_feature)`, with `merge_ratio` of its tokens merged, cached
+        for the same tensor, lora scale and merge ratio
+        """
+        if self._garment_source is garment_feature and self._garment_settings == (scale, merge_ratio):
+            return self._garment_key_value
+
+        args = () if USE_PEFT_BACKEND else (scale,)
+        garment_hidden_states = merge_tokens(norm(garment_feature), merge_ratio)
+        key_value = (attn.to_k(garment_hidden_states, *args), attn.to_v(garment_hidden_states, *args))
+
+        self._garment_source = garment_feature
+        self._garment_settings = (scale, merge_ratio)
+        self._garment_key_value = key_value
+        return key_value
+
+    def __call__(
+        self,
+        attn: Attention,
+        hidden_states: torch.FloatTensor,
+        encoder_hidden_states: Optional[torch.FloatTensor] = None,
+        attention_mask: Optional[torch.FloatTensor] = None,
+        temb: Optional[torch.FloatTensor] = None,
+        scale: float = 1.0,
+        garment_hidden_states: Optional[torch.FloatTensor] = None,
+        garment_key_value: Optional[Tuple[torch.FloatTensor, torch.FloatTensor]] = None,
+    ) -> torch.FloatTensor:
+        residual = hidden_states
+        args = () if USE_PEFT_BACKEND else (scale,)
+
+        batch_size = hidden_states.shape[0]
+        if encoder_hidden_states is None:
+            if garment_hidden_states is None:
+                encoder_hidden_states = hidden_states
+            else:
+                encoder_hidden_states = torch.cat((hidden_states, garment_hidden_states), dim=1)
+        elif attn.norm_cross:
+            encoder_hidden_states = attn.norm_encoder_hidden_states(encoder_hidden_states)
+
+        sequence_length = encoder_hidden_states.shape[1]
+        if garment_key_value is not None:
+            sequence_length += garment_key_value[0].shape[1]
+        if attention_mask is not None:
+            attention_mask = attn.prepare_attention_mask(attention_mask, sequence_length, batch_size)
+            # scaled_dot_product_attention expects attention_mask shape to be
+            # (batch, heads, source_length, target_length)
+            attention_mask = attention_mask.view(batch_size, attn.heads, -1, attention_mask.shape[-1])
+
+        query = attn.to_q(hidden_states, *args)
+        key = attn.to_k(encoder_hidden_states, *args)
+        value = attn.to_v(encoder_hidden_states, *args)
+        if garment_key_value is not None:
+            garment_key, garment_value = garment_key_value
+            key = torch.cat((key, garment_key), dim=1)
+            value = torch.cat((value, garment_value), dim=1)
+
+        inner_dim = key.shape[-1]
+        head_dim = inner_dim // attn.heads
+
+        query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        hidden_states = F.scaled_dot_product_attention(
+            query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False
+        )
+        hidden_states = hidden_states.transpose(1, 2).reshape(batch_size, -1, attn.heads * head_dim)
+        hidden_states = hidden_states.to(query.dtype)
+
+        # linear proj
+        hidden_states = attn.to_out[0](hidden_states, *args)
+        # dropout
+        hidden_states = attn.to_out[1](hidden_states)
+
+        if attn.residual_connection:
+            hidden_states = hidden_states + residual
+
+        hidden_states = hidden_states / attn.rescale_output_factor
+
+        return hidden_states
+
 
 @maybe_allow_in_graph
 class GatedSelfAttentionDense(nn.Module):
@@ -168,6 +285,8 @@ class BasicTransformerBlock(nn.Module):
             cross_attention_dim=cross_attention_dim if only_cross_attention else None,
             upcast_attention=upcast_attention,
         )
+        if not only_cross_attention:
+            self.attn1.set_processor(VtonAttnProcessor())
 
         # 2. Cross-Attn
         if cross_attention_dim is not None or double_self_attention:
@@ -210,6 +329,9 @@ class BasicTransformerBlock(nn.Module):
         self._chunk_size = None
         self._chunk_dim = 0
 
+        # share of the tokens merged before self-attention, see `token_merge.py` (0 disables token merging)
+        self.token_merge_ratio = 0.0
+
     def set_chunk_feed_forward(self, chunk_size: Optional[int], dim: int):
         # Sets chunk feed-forward
         self._chunk_size = chunk_size
@@ -230,53 +352,107 @@ class BasicTransformerBlock(nn.Module):
         # Notice that normalization is always applied before the real computation in the following blocks.
         # 0. Self-Attention
         batch_size = hidden_states.shape[0]
+        num_tokens = hidden_states.shape[1]
 
         spatial_attn_input = spatial_attn_inputs[spatial_attn_idx]
         spatial_attn_idx += 1
-        hidden_states = torch.cat((hidden_states, spatial_attn_input), dim=1)
 
-        if self.use_ada_layer_norm:
-            norm_hidden_states = self.norm1(hidden_states, timestep)
-        elif self.use_ada_layer_norm_zero:
-            norm_hidden_states, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.norm1(
-                hidden_states, timestep, class_labels, hidden_dtype=hidden_states.dtype
-            )
-        elif self.use_layer_norm:
-            norm_hidden_states = self.norm1(hidden_states)
-        elif self.use_ada_layer_norm_single:
-            shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = (
-                self.scale_shift_table[None] + timestep.reshape(batch_size, 6, -1)
-            ).chunk(6, dim=1)
+        # 1. Retrieve lora scale.
+        lora_scale = cross_attention_kwargs.get("scale", 1.0) if cross_attention_kwargs is not None else 1.0
+
+        # The garment feature is the same for every denoising step and, with a plain layer norm, so are its
+        # normalized keys and values. They are projected on the first step and reused afterwards.
+        cache_garment = (
+            self.use_layer_norm
+            and self.pos_embed is None
+            and not self.only_cross_attention
+            and isinstance(self.attn1.processor, VtonAttnProcessor)
+        )
+        # Steps without image guidance run the conditional half only, which comes first in the garment feature
+        # Token merging changes the key length, which an attention mask would have to follow
+        merge_ratio = self.token_merge_ratio if attention_mask is None else 0.0
+        if cache_garment:
             norm_hidden_states = self.norm1(hidden_states)
-            norm_hidden_states = norm_hidden_states * (1 + scale_msa) + shift_msa
-            norm_hidden_states = norm_hidden_states.squeeze(1)
+            garment_key, garment_value = self.attn1.processor.garment_key_value(
+                self.attn1, self.norm1, spatial_attn_input, lora_scale, merge_ratio
+            )
+            garment_key_value = (garment_key[:batch_size], garment_value[:batch_size])
         else:
-            raise ValueError("Incorrect norm used")
+            hidden_states = torch.cat((hidden_states, spatial_attn_input[:batch_size]), dim=1)
 
-        if self.pos_embed is not None:
-            norm_hidden_states = self.pos_embed(norm_hidden_states)
+            if self.use_ada_layer_norm:
+                norm_hidden_states = self.norm1(hidden_states, timestep)
+            elif self.use_ada_layer_norm_zero:
+                norm_hidden_states, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.norm1(
+                    hidden_states, timestep, class_labels, hidden_dtype=hidden_states.dtype
+                )
+            elif self.use_layer_norm:
+                norm_hidden_states = self.norm1(hidden_states)
+            elif self.use_ada_layer_norm_single:
+                shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = (
+                    self.scale_shift_table[None] + timestep.reshape(batch_size, 6, -1)
+                ).chunk(6, dim=1)
+                norm_hidden_states = self.norm1(hidden_states)
+                norm_hidden_states = norm_hidden_states * (1 + scale_msa) + shift_msa
+                norm_hidden_states = norm_hidden_states.squeeze(1)
+            else:
+                raise ValueError("Incorrect norm used")
 
-        # 1. Retrieve lora scale.
-        lora_scale = cross_attention_kwargs.get("scale", 1.0) if cross_attention_kwargs is not None else 1.0
+            if self.pos_embed is not None:
+                norm_hidden_states = self.pos_embed(norm_hidden_states)
 
         # 2. Prepare GLIGEN inputs
         cross_attention_kwargs = cross_attention_kwargs.copy() if cross_attention_kwargs is not None else {}
         gligen_kwargs = cross_attention_kwargs.pop("gligen", None)
 
-        attn_output = self.attn1(
-            norm_hidden_states,
-            encoder_hidden_states=encoder_hidden_states if self.only_cross_attention else None,
-            attention_mask=attention_mask,
-            **cross_attention_kwargs,
+        # Only the person half of the output is kept, so only the person tokens are used as queries. A
+        # processor set from outside (e.g. xformers) gets the full concatenated sequence as before.
+        query_restricted = self.only_cross_attention or isinstance(self.attn1.processor, VtonAttnProcessor)
+
+        # Token merging: similar tokens are averaged before attn1 and unmerged afterwards, so the output
+        # still has one token per person token (or per concatenated token) in the original order
+        merge, unmerge = bipartite_soft_matching(
+            norm_hidden_states[:, :num_tokens] if query_restricted else norm_hidden_states, merge_ratio
         )
+        if cache_garment:
+            attn_output = self.attn1(
+                merge(norm_hidden_states),
+                garment_key_value=garment_key_value,
+                attention_mask=attention_mask,
+                **cross_attention_kwargs,
+            )
+        elif self.only_cross_attention:
+            attn_output = self.attn1(
+                merge(norm_hidden_states[:, :num_tokens]),
+                encoder_hidden_states=encoder_hidden_states,
+                attention_mask=attention_mask,
+                **cross_attention_kwargs,
+            )
+        elif query_restricted:
+            attn_output = self.attn1(
+                merge(norm_hidden_states[:, :num_tokens]),
+                garment_hidden_states=merge_tokens(norm_hidden_states[:, num_tokens:], merge_ratio),
+                attention_mask=attention_mask,
+                **cross_attention_kwargs,
+            )
+        else:
+            attn_output = self.attn1(
+                merge(norm_hidden_states),
+                attention_mask=attention_mask,
+                **cross_attention_kwargs,
+            )
+        attn_output = unmerge(attn_output)
         if self.use_ada_layer_norm_zero:
             attn_output = gate_msa.unsqueeze(1) * attn_output
         elif self.use_ada_layer_norm_single:
             attn_output = gate_msa * attn_output
 
-        
-        hidden_states = attn_output + hidden_states
-        hidden_states, _ = hidden_states.chunk(2, dim=1)
+        if query_restricted:
+            hidden_states = attn_output + hidden_states[:, :num_tokens]
+        else:
+            hidden_states = attn_output + hidden_states
+            # the garment feature may be larger than the person tokens when denoising a crop
+            hidden_states = hidden_states[:, :num_tokens]
 
         if hidden_states.ndim == 4:
             hidden_states = hidden_states.squeeze(1)
@@ -14,7 +14,7 @@
 
 # Modified by Yuhao Xu for OOTDiffusion (https://github.com/levihsu/OOTDiffusion)
 import inspect
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import PIL.Image
@@ -75,6 +75,53 @@ def preprocess(image):
     return image
 
 
+def split_garment_features(spatial_attn_outputs, num_garments):
+    """
+    Split `unet_garm` features of `num_garments` garments, laid out as `[cond_0, ..., cond_n-1]` or, computed
+    with guidance, `[cond_0, ..., cond_n-1, uncond_0, ..., uncond_n-1]`, into one list per garment holding its
+    `[cond]` / `[cond, uncond]` rows.
+    """
+    return [[feature[i::num_garments] for feature in spatial_attn_outputs] for i in range(num_garments)]
+
+
+def stack_garment_features(per_garment, num_images_per_prompt=1):
+    """
+    Inverse of `split_garment_features`: batch per-garment features into the layout `OotdPipeline.__call__`
+    expects, each garment repeated `num_images_per_prompt` times like its prompt embedding.
+    """
+    stacked = []
+    for layer in zip(*per_garment):
+        cond = torch.cat([feature[:1] for feature in layer]).repeat_interleave(num_images_per_prompt, dim=0)
+        uncond = torch.cat([feature[1:] for feature in layer]).repeat_interleave(num_images_per_prompt, dim=0)
+        stacked.append(torch.cat((cond, uncond)))
+    return stacked
+
+
+def mask_bounding_box(mask, margin=0, multiple=8):
+    """
+    Bounding box `(top, bottom, left, right)` of the nonzero area of `mask` (`[B, 1, H, W]`, union over the batch),
+    grown by `margin` on every side and to a multiple of `multiple` so that it can be downsampled by the UNet.
+    Returns None if the mask is empty or the box covers the whole mask.
+    """
+    height, width = mask.shape[-2:]
+    rows = mask.amax(dim=(0, 1, 3)).nonzero()
+    cols = mask.amax(dim=(0, 1, 2)).nonzero()
+    if len(rows) == 0:
+        return None
+
+    def grow(start, end, size):
+        start, end = max(start - margin, 0), min(end + margin, size)
+        length = min(-(-(end - start) // multiple) * multiple, size)
+        start = min(start, size - length)
+        return start, start + length
+
+    top, bottom = grow(rows[0].item(), rows[-1].item() + 1, height)
+    left, right = grow(cols[0].item(), cols[-1].item() + 1, width)
+    if (top, bottom, left, right) == (0, height, 0, width):
+        return None
+    return top, bottom, left, right
+
+
 class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMixin):
     r"""
     Args:
@@ -167,6 +214,17 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         return_dict: bool = True,
         callback_on_step_end: Optional[Callable[[int, int, Dict], None]] = None,
         callback_on_step_end_tensor_inputs: List[str] = ["latents"],
+        spatial_attn_outputs: Optional[List[torch.FloatTensor]] = None,
+        crop_to_mask: bool = False,
+        crop_margin: int = 64,
+        crop_box: Optional[Tuple[int, int, int, int]] = None,
+        person_latents: Optional[Tuple[torch.FloatTensor, torch.FloatTensor]] = None,
+        preallocate: bool = False,
+        guidance_interval: Optional[Tuple[float, float]] = None,
+        deep_cache_interval: int = 1,
+        deep_cache_depth: int = 1,
+        early_stop_threshold: Optional[float] = None,
+        early_stop_patience: int = 3,
         **kwargs,
     ):
         r"""
@@ -224,6 +282,47 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
                 The list of tensor inputs for the `callback_on_step_end` function. The tensors specified in the list
                 will be passed as `callback_kwargs` argument. You will only be able to include variables listed in the
                 `._callback_tensor_inputs` attribute of your pipeline class.
+            spatial_attn_outputs (`List[torch.FloatTensor]`, *optional*):
+                Precomputed garment features from [`~OotdPipeline.encode_garment`] (see `stack_garment_features`).
+                When given, the garment branch (VAE encode and `unet_garm` forward) is skipped and `image_garm`
+                is not needed.
+            crop_to_mask (`bool`, *optional*, defaults to `False`):
+                Denoise and decode only the bounding box of the mask (grown by `crop_margin`), and paste the decoded
+                region into `image_ori`. Pixels outside the box are taken from `image_ori` unchanged. The garment
+                features stay full size. `callback_on_step_end` then sees the cropped latents.
+            crop_margin (`int`, *optional*, defaults to 64):
+                Context around the mask, in pixels, included in the crop. The border of the pasted region is
+                blended into `image_ori` over half of it.
+            crop_box (`Tuple[int, int, int, int]`, *optional*):
+                The `(top, bottom, left, right)` box, in latent coordinates, to crop to instead of the bounding box
+                of the whole batch's masks, e.g. [`~OotdPipeline.mask_crop_box`] of each image of a batch sharing
+                one box. Every mask of the batch has to lie inside it.
+            person_latents (`Tuple[torch.FloatTensor, torch.FloatTensor]`, *optional*):
+                Precomputed VAE latents of `image_vton` and `image_ori` (see [`~OotdPipeline.encode_images`]). When
+                given, the person images are not encoded again; `image_ori` is still used by `crop_to_mask`.
+            preallocate (`bool`, *optional*, defaults to `False`):
+                Run the denoising loop on persistent buffers: the UNet input (latents and vton latents) is written in
+                place, guidance is applied in place on the UNet output and the noised repaint latents are computed for
+                all timesteps before the loop, so a step makes no host syncs and allocates only inside the UNet and the
+                scheduler.
+            guidance_interval (`Tuple[float, float]`, *optional*):
+                `(t_lo, t_hi)`: apply image guidance only on steps whose timestep lies in `[t_lo, t_hi]`. The other
+                steps run `unet_vton` on the conditional half alone (batch size halved) and use its prediction as
+                is. Defaults to guidance on every step.
+            deep_cache_interval (`int`, *optional*, defaults to 1):
+                Run a full `unet_vton` forward every `deep_cache_interval` steps only (DeepCache). The steps in between
+                recompute the `deep_cache_depth` outermost down/up blocks and reuse the deep features of the last full
+                step. 1 disables feature reuse.
+            deep_cache_depth (`int`, *optional*, defaults to 1):
+                Number of outermost down/up block pairs recomputed on feature-reuse steps.
+            early_stop_threshold (`float`, *optional*):
+                Stop denoising an image early once its predicted clean latents inside the mask change by less than
+                this between steps (mean absolute change relative to their mean magnitude) for `early_stop_patience`
+                consecutive steps. Its last prediction is then kept as its final latents and decoded directly. Each
+                image of the batch converges on its own; the loop ends once all have. The number of steps run for
+                each image is available as `steps_run` afterwards. Defaults to running every step.
+            early_stop_patience (`int`, *optional*, defaults to 3):
+                Number of consecutive converged steps required to stop early.
 
         Returns:
             [`~pipelines.stable_diffusion.StableDiffusionPipelineOutput`] or `tuple`:
@@ -261,7 +360,7 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         self._guidance_scale = guidance_scale
         self._image_guidance_scale = image_guidance_scale
 
-        if (image_vton is None) or (image_garm is None):
+        if (image_vton is None) or (image_garm is None and spatial_attn_outputs is None):
             raise ValueError("`image` input cannot be undefined.")
 
         # 1. Define call parameters
@@ -288,7 +387,6 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         )
 
         # 3. Preprocess image
-        image_garm = self.image_processor.preprocess(image_garm)
         image_vton = self.image_processor.preprocess(image_vton)
         image_ori = self.image_processor.preprocess(image_ori)
         mask = np.array(mask)
@@ -303,20 +401,36 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         timesteps = self.scheduler.timesteps
 
         # 5. Prepare Image latents
-        garm_latents = self.prepare_garm_latents(
-            image_garm,
-            batch_size,
-            num_images_per_prompt,
-            prompt_embeds.dtype,
-            device,
-            self.do_classifier_free_guidance,
-            generator,
-        )
+        if spatial_attn_outputs is None:
+            image_garm = self.image_processor.preprocess(image_garm)
+            garm_latents = self.prepare_garm_latents(
+                image_garm,
+                batch_size,
+                num_images_per_prompt,
+                prompt_embeds.dtype,
+                device,
+                self.do_classifier_free_guidance,
+                generator,
+            )
+            _, spatial_attn_outputs = self.unet_garm(
+                garm_latents,
+                0,
+                encoder_hidden_states=prompt_embeds,
+                return_dict=False,
+            )
+        else:
+            # Cached features always carry the unconditional half; drop it when guidance is off
+            spatial_attn_outputs = [
+                feature[: batch_size * num_images_per_prompt].to(device=device, dtype=prompt_embeds.dtype)
+                if not self.do_classifier_free_guidance
+                else feature.to(device=device, dtype=prompt_embeds.dtype)
+                for feature in spatial_attn_outputs
+            ]
 
         vton_latents, mask_latents, image_ori_latents = self.prepare_vton_latents(
-            image_vton,
+            person_latents[0] if person_latents is not None else image_vton,
             mask,
-            image_ori,
+            person_latents[1] if person_latents is not None else image_ori,
             batch_size,
             num_images_per_prompt,
             prompt_embeds.dtype,
@@ -344,6 +458,21 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
 
         noise = latents.clone()
 
+        # 7. Restrict denoising to the masked region; everything outside is repainted from image_ori anyway
+        crop = None
+        if crop_to_mask and image_ori.shape[1] != 4:
+            crop = crop_box or mask_bounding_box(
+                mask_latents, crop_margin // self.vae_scale_factor, 2**self.unet_vton.num_upsamplers
+            )
+        if crop is not None:
+            top, bottom, left, right = crop
+            full_image_ori_latents = image_ori_latents
+            latents = latents[..., top:bottom, left:right]
+            noise = noise[..., top:bottom, left:right]
+            vton_latents = vton_latents[..., top:bottom, left:right]
+            mask_latents = mask_latents[..., top:bottom, left:right]
+            image_ori_latents = image_ori_latents[..., top:bottom, left:right]
+
         # 8. Prepare extra step kwargs. TODO: Logic should ideally just be moved out of the pipeline
         extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
 
@@ -351,44 +480,84 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
         num_warmup_steps = len(timesteps) - num_inference_steps * self.scheduler.order
         self._num_timesteps = len(timesteps)
 
-        _, spatial_attn_outputs = self.unet_garm(
-            garm_latents,
-            0,
-            encoder_hidden_states=prompt_embeds,
-            return_dict=False,
-        )
+        # Which steps run the unconditional branch, decided up front to keep host syncs out of the loop
+        if self.do_classifier_free_guidance and guidance_interval is not None:
+            t_lo, t_hi = guidance_interval
+            guided_steps = [t_lo <= t <= t_hi for t in timesteps.tolist()]
+        else:
+            guided_steps = [self.do_classifier_free_guidance] * len(timesteps)
+        cond_batch_size = latents.shape[0]
+
+        # Early termination: consecutive steps whose predicted x0 barely moved inside the mask, per image.
+        # A converged image keeps its final latents while the others go on
+        previous_pred_original = None
+        converged_steps = torch.zeros(cond_batch_size, dtype=torch.long)
+        stopped = torch.zeros(cond_batch_size, dtype=torch.bool)
+        stopped_latents = None
+        self._steps_run = [len(timesteps)] * cond_batch_size
+
+        if preallocate:
+            loop_state = self.prepare_loop_buffers(
+                latents, vton_latents, image_ori_latents, mask_latents, noise, timesteps, scheduler_is_in_sigma_space
+            )
 
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
-                latent_model_input = torch.cat([latents] * 2) if self.do_classifier_free_guidance else latents
-
-                # concat latents, image_latents in the channel dimension
-                scaled_latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
-                latent_vton_model_input = torch.cat([scaled_latent_model_input, vton_latents], dim=1)
-                # latent_vton_model_input = scaled_latent_model_input + vton_latents
+                # Conditional rows come first in vton_latents, prompt_embeds and the garment features, so a step
+                # without guidance uses their first half; the vton blocks slice the garment features themselves
+                guided = guided_steps[i]
+                step_batch_size = cond_batch_size * (2 if guided else 1)
+
+                if preallocate:
+                    latent_model_input = latents
+                    latent_vton_model_input = loop_state["model_input"][:step_batch_size]
+                    scaled_latents = self.scheduler.scale_model_input(latents, t)
+                    num_channels = scaled_latents.shape[1]
+                    # both guidance halves see the same latents
+                    latent_vton_model_input[:, :num_channels].unflatten(0, (-1, cond_batch_size)).copy_(scaled_latents)
+                    spatial_attn_inputs = spatial_attn_outputs
+                else:
+                    latent_model_input = torch.cat([latents] * 2) if guided else latents
+
+                    # concat latents, image_latents in the channel dimension
+                    scaled_latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
+                    latent_vton_model_input = torch.cat(
+                        [scaled_latent_model_input, vton_latents[:step_batch_size]], dim=1
+                    )
+                    # latent_vton_model_input = scaled_latent_model_input + vton_latents
 
-                spatial_attn_inputs = spatial_attn_outputs.copy()
+                    spatial_attn_inputs = spatial_attn_outputs.copy()
 
                 # predict the noise residual
                 noise_pred = self.unet_vton(
                     latent_vton_model_input,
                     spatial_attn_inputs,
                     t,
-                    encoder_hidden_states=prompt_embeds,
+                    encoder_hidden_states=prompt_embeds[:step_batch_size],
                     return_dict=False,
+                    deep_cache_depth=deep_cache_depth if deep_cache_interval > 1 else None,
+                    reuse_deep_cache=deep_cache_interval > 1 and i % deep_cache_interval != 0,
                 )[0]
 
                 # Hack:
                 # For karras style schedulers the model does classifer free guidance using the
                 # predicted_original_sample instead of the noise_pred. So we need to compute the
                 # predicted_original_sample here if we are using a karras style scheduler.
-                if scheduler_is_in_sigma_space:
+                if scheduler_is_in_sigma_space and preallocate:
+                    sigma = loop_state["sigmas"][i]
+                    noise_pred.mul_(-sigma).unflatten(0, (-1, cond_batch_size)).add_(latents)
+                elif scheduler_is_in_sigma_space:
                     step_index = (self.scheduler.timesteps == t).nonzero()[0].item()
                     sigma = self.scheduler.sigmas[step_index]
                     noise_pred = latent_model_input - sigma * noise_pred
 
                 # perform guidance
-                if self.do_classifier_free_guidance:
+                if guided and preallocate:
+                    noise_pred_text_image, noise_pred_text = noise_pred.chunk(2)
+                    noise_pred = (
+                        noise_pred_text_image.sub_(noise_pred_text).mul_(self.image_guidance_scale).add_(noise_pred_text)
+                    )
+                elif guided:
                     noise_pred_text_image, noise_pred_text = noise_pred.chunk(2)
                     noise_pred = (
                         noise_pred_text
@@ -401,22 +570,54 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
                 # expects the noise_pred and computes the predicted_original_sample internally. So we
                 # need to overwrite the noise_pred here such that the value of the computed
                 # predicted_original_sample is correct.
-                if scheduler_is_in_sigma_space:
+                if scheduler_is_in_sigma_space and preallocate:
+                    noise_pred.sub_(latents).div_(-sigma)
+                elif scheduler_is_in_sigma_space:
                     noise_pred = (noise_pred - latents) / (-sigma)
 
+                if early_stop_threshold is not None:
+                    pred_original = self.predicted_original_sample(
+                        noise_pred, t, latents, sigma if scheduler_is_in_sigma_space else None
+                    )
                 # compute the previous noisy sample x_t -> x_t-1
                 latents = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs, return_dict=False)[0]
 
-                init_latents_proper = image_ori_latents * self.vae.config.scaling_factor
-
                 # repainting
-                if i < len(timesteps) - 1:
-                    noise_timestep = timesteps[i + 1]
-                    init_latents_proper = self.scheduler.add_noise(
-                        init_latents_proper, noise, torch.tensor([noise_timestep])
-                    )
-
-                latents = (1 - mask_latents) * init_latents_proper + mask_latents * latents
+                if preallocate:
+                    latents = torch.addcmul(loop_state["repaint"][i], mask_latents, latents)
+                else:
+                    init_latents_proper = image_ori_latents * self.vae.config.scaling_factor
+
+                    if i < len(timesteps) - 1:
+                        noise_timestep = timesteps[i + 1]
+                        init_latents_proper = self.scheduler.add_noise(
+                            init_latents_proper, noise, torch.tensor([noise_timestep])
+                        )
+
+                    latents = (1 - mask_latents) * init_latents_proper + mask_latents * latents
+
+                stop_early = False
+                if early_stop_threshold is not None:
+                    if previous_pred_original is not None:
+                        change = self.masked_relative_change(pred_original, previous_pred_original, mask_latents)
+                        converged_steps = (converged_steps + 1) * (change < early_stop_threshold)
+                    previous_pred_original = pred_original
+                    newly_stopped = (converged_steps >= early_stop_patience) & ~stopped
+                    if i < len(timesteps) - 1 and newly_stopped.any():
+                        # jump to the end: the prediction inside the mask, the original image outside it
+                        init_latents_proper = image_ori_latents * self.vae.config.scaling_factor
+                        final_latents = (1 - mask_latents) * init_latents_proper + mask_latents * pred_original
+                        if stopped_latents is None:
+                            stopped_latents = torch.empty_like(latents)
+                        index = newly_stopped.nonzero().flatten().to(latents.device)
+                        stopped_latents.index_copy_(0, index, final_latents.index_select(0, index).to(latents.dtype))
+                        stopped |= newly_stopped
+                        for j in newly_stopped.nonzero().flatten().tolist():
+                            self._steps_run[j] = i + 1
+                    if stopped.any():
+                        # the scheduler also stepped the converged images; put their final latents back
+                        latents = torch.where(stopped.to(latents.device)[:, None, None, None], stopped_latents, latents)
+                    stop_early = bool(stopped.all()) and i < len(timesteps) - 1
 
                 if callback_on_step_end is not None:
                     callback_kwargs = {}
@@ -427,7 +628,10 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
                     latents = callback_outputs.pop("latents", latents)
                     prompt_embeds = callback_outputs.pop("prompt_embeds", prompt_embeds)
                     negative_prompt_embeds = callback_outputs.pop("negative_prompt_embeds", negative_prompt_embeds)
-                    vton_latents = callback_outputs.pop("vton_latents", vton_latents)
+                    new_vton_latents = callback_outputs.pop("vton_latents", vton_latents)
+                    if preallocate and new_vton_latents is not vton_latents:
+                        loop_state["model_input"][:, -new_vton_latents.shape[1] :].copy_(new_vton_latents)
+                    vton_latents = new_vton_latents
 
                 # call the callback, if provided
                 if i == len(timesteps) - 1 or ((i + 1) > num_warmup_steps and (i + 1) % self.scheduler.order == 0):
@@ -436,10 +640,24 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
                         step_idx = i // getattr(self.scheduler, "order", 1)
                         callback(step_idx, t, latents)
 
+                if stop_early:
+                    logger.info(f"Latents converged, stopping after {i + 1}/{len(timesteps)} steps")
+                    break
+
+        # Release the garment keys/values and deep features the vton UNet cached for this call
+        self.unet_vton.reset_garment_cache()
+        self.unet_vton.reset_deep_cache()
+
         if not output_type == "latent":
             image = self.vae.decode(latents / self.vae.config.scaling_factor, return_dict=False)[0]
+            if crop is not None:
+                image = self.paste_crop(image, image_ori, crop, latents.shape[0], feather=crop_margin // 2)
             image, has_nsfw_concept = self.run_safety_checker(image, device, prompt_embeds.dtype)
         else:
+            if crop is not None:
+                full_latents = full_image_ori_latents * self.vae.config.scaling_factor
+                full_latents[..., top:bottom, left:right] = latents
+                latents = full_latents
             image = latents
             has_nsfw_concept = None
 
@@ -458,6 +676,142 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
 
         return StableDiffusionPipelineOutput(images=image, nsfw_content_detected=has_nsfw_concept)
 
+    @torch.no_grad()
+    def encode_garment(self, image_garm, prompt_embeds, with_uncond=True):
+        """
+        Run the garment branch on its own: VAE-encode `image_garm` and run `unet_garm` once at t=0.
+
+        `prompt_embeds` holds one embedding per garment. By default features are computed with the
+        unconditional (zeroed garment latent) half too, so they can be reused at any guidance scale;
+        with `with_uncond=False` only the conditional half is run and the caller supplies the other.
+        Returns `(garm_latents, spatial_attn_outputs)`, where `garm_latents` is the conditional half only.
+        """
+        device = self._execution_device
+        batch_size = prompt_embeds.shape[0]
+
+        prompt_embeds = self._encode_prompt(
+            None, device, 1, with_uncond, prompt_embeds=prompt_embeds
+        )
+        image_garm = self.image_processor.preprocess(image_garm)
+        garm_latents = self.prepare_garm_latents(
+            image_garm, batch_size, 1, prompt_embeds.dtype, device, with_uncond
+        )
+        _, spatial_attn_outputs = self.unet_garm(
+            garm_latents,
+            0,
+            encoder_hidden_states=prompt_embeds,
+            return_dict=False,
+        )
+        return garm_latents[:batch_size], spatial_attn_outputs
+
+    def prepare_loop_buffers(
+        self, latents, vton_latents, image_ori_latents, mask_latents, noise, timesteps, scheduler_is_in_sigma_space
+    ):
+        """
+        Persistent state for the `preallocate` denoising loop: the UNet input buffer with the vton latents already
+        in place, `(1 - mask) * init_latents_proper` for every step (noised to the next timestep, except the last)
+        and, for sigma-space schedulers, each step's sigma on the device.
+        """
+        batch_size = latents.shape[0] * (2 if self.do_classifier_free_guidance else 1)
+        model_input = torch.empty(
+            (batch_size, latents.shape[1] + vton_latents.shape[1], *latents.shape[2:]),
+            dtype=latents.dtype,
+            device=latents.device,
+        )
+        model_input[:, latents.shape[1] :].copy_(vton_latents)
+
+        init_latents_proper = image_ori_latents * self.vae.config.scaling_factor
+        keep = 1 - mask_latents
+        repaint = []
+        for i in range(len(timesteps)):
+            if i < len(timesteps) - 1:
+                noised = self.scheduler.add_noise(init_latents_proper, noise, timesteps[i + 1 : i + 2].cpu())
+            else:
+                noised = init_latents_proper
+            repaint.append(keep * noised)
+
+        sigmas = None
+        if scheduler_is_in_sigma_space:
+            # matches the per-step `(timesteps == t).nonzero()` lookup, done once here
+            step_indices = [(self.scheduler.timesteps == t).nonzero()[0].item() for t in timesteps]
+            sigmas = self.scheduler.sigmas.to(latents.device)[step_indices]
+
+        return {"model_input": model_input, "repaint": repaint, "sigmas": sigmas}
+
+    def predicted_original_sample(self, model_output, timestep, sample, sigma=None):
+        """x0 predicted from the (guided) model output the scheduler steps with, in the scheduler's own parametrization"""
+        if sigma is not None:
+            # sigma-space schedulers get epsilon back from the hack above: x0 = x - sigma * eps
+            return sample - sigma * model_output
+
+        alpha_prod_t = self.scheduler.alphas_cumprod[int(timestep)].to(device=sample.device, dtype=sample.dtype)
+        beta_prod_t = 1 - alpha_prod_t
+        prediction_type = self.scheduler.config.prediction_type
+        if prediction_type == "epsilon":
+            return (sample - beta_prod_t**0.5 * model_output) / alpha_prod_t**0.5
+        if prediction_type == "v_prediction":
+            return alpha_prod_t**0.5 * sample - beta_prod_t**0.5 * model_output
+        return model_output
+
+    @staticmethod
+    def masked_relative_change(current, previous, mask):
+        """Mean absolute change of `current` over `previous` inside `mask`, relative to `previous`, per sample (on CPU)"""
+        change = ((current - previous) * mask).abs().flatten(1).sum(1)
+        magnitude = (previous * mask).abs().flatten(1).sum(1)
+        return (change / magnitude.clamp(min=1e-6)).float().cpu()
+
+    @torch.no_grad()
+    def encode_images(self, images):
+        """VAE latents (distribution mode, unscaled) of a list of images, in one batched forward pass"""
+        image = self.image_processor.preprocess(images).to(device=self._execution_device, dtype=self.vae.dtype)
+        return self.vae.encode(image).latent_dist.mode()
+
+    def mask_crop_box(self, mask, crop_margin=64):
+        """
+        The box `__call__(crop_to_mask=True, crop_margin=crop_margin)` crops to for this one mask image, in latent
+        coordinates, or None if it would not crop.
+        """
+        mask = (torch.from_numpy(np.array(mask.convert("L"))) >= 127).float()[None, None]
+        height, width = mask.shape[-2:]
+        mask = torch.nn.functional.interpolate(
+            mask, size=(height // self.vae_scale_factor, width // self.vae_scale_factor)
+        )
+        return mask_bounding_box(mask, crop_margin // self.vae_scale_factor, 2**self.unet_vton.num_upsamplers)
+
+    def paste_crop(self, image, image_ori, crop, batch_size, feather=0):
+        """
+        Paste a decoded crop (`crop` in latent coordinates) into the preprocessed original images, blending
+        linearly over `feather` pixels along the edges of the crop that are inside the image.
+        """
+        top, bottom, left, right = (x * self.vae_scale_factor for x in crop)
+        image_ori = image_ori.to(device=image.device, dtype=image.dtype)
+        if batch_size > image_ori.shape[0]:
+            image_ori = torch.cat([image_ori] * (batch_size // image_ori.shape[0]), dim=0)
+        else:
+            image_ori = image_ori.clone()
+
+        height, width = image_ori.shape[-2:]
+        feather = min(feather, (bottom - top) // 2, (right - left) // 2)
+        if feather <= 0:
+            image_ori[..., top:bottom, left:right] = image
+            return image_ori
+
+        ramp = (torch.arange(feather, device=image.device, dtype=image.dtype) + 0.5) / feather
+        rows = torch.ones(bottom - top, device=image.device, dtype=image.dtype)
+        cols = torch.ones(right - left, device=image.device, dtype=image.dtype)
+        if top > 0:
+            rows[:feather] = ramp
+        if bottom < height:
+            rows[-feather:] = torch.minimum(rows[-feather:], ramp.flip(0))
+        if left > 0:
+            cols[:feather] = ramp
+        if right < width:
+            cols[-feather:] = torch.minimum(cols[-feather:], ramp.flip(0))
+        weight = torch.minimum(rows[:, None], cols[None, :])
+        region = image_ori[..., top:bottom, left:right]
+        image_ori[..., top:bottom, left:right] = torch.lerp(region, image, weight)
+        return image_ori
+
     def _encode_prompt(
         self,
         prompt,
@@ -536,7 +890,8 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
             )
             prompt_embeds = prompt_embeds[0]
 
-        prompt_embeds = prompt_embeds.to(dtype=self.text_encoder.dtype, device=device)
+        # the text encoder may be shared with a model of another dtype; match the UNets
+        prompt_embeds = prompt_embeds.to(dtype=self.unet_vton.dtype, device=device)
 
         bs_embed, seq_len, _ = prompt_embeds.shape
         # duplicate text embeddings for each generation per prompt, using mps friendly method
@@ -719,11 +1074,7 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
                     f" size of {batch_size}. Make sure the batch size matches the length of the generators."
                 )
 
-            if isinstance(generator, list):
-                image_latents = [self.vae.encode(image[i : i + 1]).latent_dist.mode() for i in range(batch_size)]
-                image_latents = torch.cat(image_latents, dim=0)
-            else:
-                image_latents = self.vae.encode(image).latent_dist.mode()
+            image_latents = self.vae.encode(image).latent_dist.mode()
 
         if batch_size > image_latents.shape[0] and batch_size % image_latents.shape[0] == 0:
             additional_image_per_prompt = batch_size // image_latents.shape[0]
@@ -764,14 +1115,10 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
                     f" size of {batch_size}. Make sure the batch size matches the length of the generators."
                 )
 
-            if isinstance(generator, list):
-                image_latents = [self.vae.encode(image[i : i + 1]).latent_dist.mode() for i in range(batch_size)]
-                image_latents = torch.cat(image_latents, dim=0)
-                image_ori_latents = [self.vae.encode(image_ori[i : i + 1]).latent_dist.mode() for i in range(batch_size)]
-                image_ori_latents = torch.cat(image_ori_latents, dim=0)
-            else:
-                image_latents = self.vae.encode(image).latent_dist.mode()
-                image_ori_latents = self.vae.encode(image_ori).latent_dist.mode()
+            # The latent mode does not sample, so per-sample generators do not need per-sample encodes:
+            # the masked and original images go through the VAE in one batch
+            latents = self.vae.encode(torch.cat([image, image_ori], dim=0)).latent_dist.mode()
+            image_latents, image_ori_latents = latents.split([image.shape[0], image_ori.shape[0]], dim=0)
 
         mask = torch.nn.functional.interpolate(
             mask, size=(image_latents.size(-2), image_latents.size(-1))
@@ -838,6 +1185,11 @@ class OotdPipeline(DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMix
     def num_timesteps(self):
         return self._num_timesteps
 
+    @property
+    def steps_run(self):
+        """Denoising steps run for each image of the last call"""
+        return self._steps_run
+
     # here `guidance_scale` is defined analog to the guidance weight `w` of equation (2)
     # of the Imagen paper: https://arxiv.org/pdf/2205.11487.pdf . `guidance_scale = 1`
     # corresponds to doing no classifier free guidance.
@@ -0,0 +1,81 @@
+"""
+Token merging (ToMe, https://arxiv.org/abs/2210.09461, as applied to Stable Diffusion in
+https://arxiv.org/abs/2303.17604) for the self-attention of the vton and garment transformer blocks.
+
+The tokens are split into destination tokens (every `dst_stride`-th token) and source tokens. Each source
+token is matched to its most similar destination token, and the best matched share of them is averaged into
+their destination before attention. Unmerging copies the output of a destination token back to the source
+tokens merged into it, so the sequence keeps its length and order.
+"""
+import functools
+from typing import Callable, Tuple
+
+import torch
+
+
+def _identity(x: torch.Tensor) -> torch.Tensor:
+    return x
+
+
+@functools.lru_cache(maxsize=32)
+def _split_indices(num_tokens: int, dst_stride: int, device: torch.device) -> Tuple[torch.Tensor, torch.Tensor]:
+    is_dst = torch.zeros(num_tokens, dtype=torch.bool)
+    is_dst[::dst_stride] = True
+    positions = torch.arange(num_tokens)
+    return positions[~is_dst].to(device), positions[is_dst].to(device)
+
+
+def bipartite_soft_matching(
+    metric: torch.Tensor, ratio: float, dst_stride: int = 4
+) -> Tuple[Callable[[torch.Tensor], torch.Tensor], Callable[[torch.Tensor], torch.Tensor]]:
+    """
+    `merge` and `unmerge` functions for tokens of shape (batch, tokens, channels), matched on `metric`
+    (batch, tokens, channels). `ratio` is the share of all tokens to merge away, at most the share of
+    source tokens. A ratio of 0 returns identity functions.
+    """
+    if ratio <= 0:
+        return _identity, _identity
+
+    batch_size, num_tokens, _ = metric.shape
+    src_idx, dst_idx = _split_indices(num_tokens, dst_stride, metric.device)
+    num_merged = min(int(num_tokens * ratio), len(src_idx))
+    if num_merged <= 0:
+        return _identity, _identity
+
+    metric = metric / metric.norm(dim=-1, keepdim=True)
+    scores = metric[:, src_idx] @ metric[:, dst_idx].transpose(1, 2)
+    node_max, node_idx = scores.max(dim=-1)
+    edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+    unmerged_idx = edge_idx[:, num_merged:]
+    merged_idx = edge_idx[:, :num_merged]
+    merged_dst_idx = node_idx[..., None].gather(1, merged_idx)
+
+    def merge(x: torch.Tensor) -> torch.Tensor:
+        channels = x.shape[-1]
+        src, dst = x[:, src_idx], x[:, dst_idx]
+        unmerged = src.gather(1, unmerged_idx.expand(-1, -1, channels))
+        src = src.gather(1, merged_idx.expand(-1, -1, channels))
+        dst = dst.scatter_reduce(1, merged_dst_idx.expand(-1, -1, channels), src, reduce="mean")
+        return torch.cat((unmerged, dst), dim=1)
+
+    def unmerge(x: torch.Tensor) -> torch.Tensor:
+        channels = x.shape[-1]
+        num_unmerged = unmerged_idx.shape[1]
+        unmerged, dst = x[:, :num_unmerged], x[:, num_unmerged:]
+
+        src = x.new_empty(batch_size, len(src_idx), channels)
+        src.scatter_(1, unmerged_idx.expand(-1, -1, channels), unmerged)
+        src.scatter_(1, merged_idx.expand(-1, -1, channels), dst.gather(1, merged_dst_idx.expand(-1, -1, channels)))
+
+        out = x.new_empty(batch_size, num_tokens, channels)
+        out[:, src_idx] = src
+        out[:, dst_idx] = dst
+        return out
+
+    return merge, unmerge
+
+
+def merge_tokens(x: torch.Tensor, ratio: float) -> torch.Tensor:
+    """Merges `x` matched on itself, for tokens that are only attended to and never unmerged"""
+    merge, _ = bipartite_soft_matching(x, ratio)
+    return merge(x)
@@ -20,6 +20,7 @@ import torch
 import torch.nn as nn
 import torch.utils.checkpoint
 
+from .attention_garm import BasicTransformerBlock
 from .unet_garm_2d_blocks import (
     UNetMidBlock2D,
     UNetMidBlock2DCrossAttn,
@@ -804,6 +805,31 @@ class UNetGarm2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
                 if hasattr(upsample_block, k) or getattr(upsample_block, k, None) is not None:
                     setattr(upsample_block, k, None)
 
+    def set_token_merge_ratio(self, ratio: float, max_depth: int = 1):
+        r"""Sets the share of tokens merged before self-attention (token merging, https://arxiv.org/abs/2303.17604).
+
+        Args:
+            ratio (`float`): Share of the tokens of a transformer block to merge. 0 disables token merging.
+            max_depth (`int`, *optional*, defaults to 1):
+                Merge tokens in the `max_depth` outermost (highest resolution) down and up blocks only, where the
+                sequences are longest. The mid block is included once `max_depth` covers all down blocks.
+        """
+        if not 0 <= ratio < 1:
+            raise ValueError(f"`ratio` must be in [0, 1), got {ratio}")
+        if max_depth < 1:
+            raise ValueError(f"`max_depth` must be at least 1, got {max_depth}")
+
+        blocks = list(self.down_blocks[:max_depth]) + list(self.up_blocks[-max_depth:])
+        if max_depth >= len(self.down_blocks) and self.mid_block is not None:
+            blocks.append(self.mid_block)
+        for module in self.modules():
+            if isinstance(module, BasicTransformerBlock):
+                module.token_merge_ratio = 0.0
+        for block in blocks:
+            for module in block.modules():
+                if isinstance(module, BasicTransformerBlock):
+                    module.token_merge_ratio = ratio
+
     def forward(
         self,
         sample: torch.FloatTensor,
@@ -20,6 +20,7 @@ import torch
 import torch.nn as nn
 import torch.utils.checkpoint
 
+from .attention_vton import BasicTransformerBlock, VtonAttnProcessor
 from .unet_vton_2d_blocks import (
     UNetMidBlock2D,
     UNetMidBlock2DCrossAttn,
@@ -628,6 +629,9 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
                 positive_len=positive_len, out_dim=cross_attention_dim, feature_type=feature_type
             )
 
+        # (input shape, deep features entering the shallow up blocks, spatial_attn_idx there) of the last full step
+        self._deep_cache = None
+
     @property
     def attn_processors(self) -> Dict[str, AttentionProcessor]:
         r"""
@@ -694,7 +698,10 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
         """
         if all(proc.__class__ in ADDED_KV_ATTENTION_PROCESSORS for proc in self.attn_processors.values()):
             processor = AttnAddedKVProcessor()
-        elif all(proc.__class__ in CROSS_ATTENTION_PROCESSORS for proc in self.attn_processors.values()):
+        elif all(
+            proc.__class__ in CROSS_ATTENTION_PROCESSORS or isinstance(proc, VtonAttnProcessor)
+            for proc in self.attn_processors.values()
+        ):
             processor = AttnProcessor()
         else:
             raise ValueError(
@@ -804,6 +811,48 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
                 if hasattr(upsample_block, k) or getattr(upsample_block, k, None) is not None:
                     setattr(upsample_block, k, None)
 
+    def reset_garment_cache(self):
+        """Drops the garment keys/values cached by the vton self-attention processors."""
+        for processor in self.attn_processors.values():
+            if isinstance(processor, VtonAttnProcessor):
+                processor.reset()
+
+    def reset_deep_cache(self):
+        """Drops the deep features kept for `reuse_deep_cache`."""
+        self._deep_cache = None
+
+    def set_token_merge_ratio(self, ratio: float, max_depth: int = 1):
+        r"""Sets the share of tokens merged before self-attention (token merging, https://arxiv.org/abs/2303.17604).
+
+        Args:
+            ratio (`float`): Share of the tokens of a transformer block to merge. 0 disables token merging.
+            max_depth (`int`, *optional*, defaults to 1):
+                Merge tokens in the `max_depth` outermost (highest resolution) down and up blocks only, where the
+                sequences are longest. The mid block is included once `max_depth` covers all down blocks.
+        """
+        if not 0 <= ratio < 1:
+            raise ValueError(f"`ratio` must be in [0, 1), got {ratio}")
+        if max_depth < 1:
+            raise ValueError(f"`max_depth` must be at least 1, got {max_depth}")
+
+        blocks = list(self.down_blocks[:max_depth]) + list(self.up_blocks[-max_depth:])
+        if max_depth >= len(self.down_blocks) and self.mid_block is not None:
+            blocks.append(self.mid_block)
+        for module in self.modules():
+            if isinstance(module, BasicTransformerBlock):
+                module.token_merge_ratio = 0.0
+        for block in blocks:
+            for module in block.modules():
+                if isinstance(module, BasicTransformerBlock):
+                    module.token_merge_ratio = ratio
+
+    def _deep_cache_usable(self, sample: torch.FloatTensor, deep_cache_depth: Optional[int]) -> bool:
+        if self._deep_cache is None or not deep_cache_depth:
+            return False
+        input_shape, cached_sample, _ = self._deep_cache
+        # a step without image guidance can reuse the conditional half of a guided step, not the other way round
+        return input_shape[1:] == sample.shape[1:] and cached_sample.shape[0] >= sample.shape[0]
+
     def forward(
         self,
         sample: torch.FloatTensor,
@@ -820,6 +869,8 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
         down_intrablock_additional_residuals: Optional[Tuple[torch.Tensor]] = None,
         encoder_attention_mask: Optional[torch.Tensor] = None,
         return_dict: bool = True,
+        deep_cache_depth: Optional[int] = None,
+        reuse_deep_cache: bool = False,
     ) -> Union[UNet2DConditionOutput, Tuple]:
         r"""
         The [`UNet2DConditionModel`] forward method.
@@ -869,6 +920,13 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
                 additional residual to be added to UNet mid block output, for example from ControlNet side model
             down_intrablock_additional_residuals (`tuple` of `torch.Tensor`, *optional*):
                 additional residuals to be added within UNet down blocks, for example from T2I-Adapter side model(s)
+            deep_cache_depth (`int`, *optional*):
+                Number of outermost down/up block pairs that make up the shallow part of the UNet for feature reuse
+                (DeepCache). When set, a full forward keeps the features entering the shallow up blocks.
+            reuse_deep_cache (`bool`, *optional*, defaults to `False`):
+                Run only the shallow down and up blocks and take the deep features (deep down blocks, mid block and
+                deep up blocks) from the last full forward. Falls back to a full forward if there is nothing usable
+                cached.
 
         Returns:
             [`~models.unet_2d_condition.UNet2DConditionOutput`] or `tuple`:
@@ -1069,8 +1127,13 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
             down_intrablock_additional_residuals = down_block_additional_residuals
             is_adapter = True
 
+        if deep_cache_depth is not None and not 0 < deep_cache_depth < len(self.up_blocks):
+            raise ValueError(f"`deep_cache_depth` must be between 1 and {len(self.up_blocks) - 1}")
+        reuse_deep_cache = reuse_deep_cache and self._deep_cache_usable(sample, deep_cache_depth)
+        input_shape = sample.shape
+
         down_block_res_samples = (sample,)
-        for downsample_block in self.down_blocks:
+        for downsample_block in self.down_blocks[:deep_cache_depth] if reuse_deep_cache else self.down_blocks:
             if hasattr(downsample_block, "has_cross_attention") and downsample_block.has_cross_attention:
                 # For t2i-adapter CrossAttnDownBlock2D
                 additional_residuals = {}
@@ -1107,7 +1170,7 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
             down_block_res_samples = new_down_block_res_samples
 
         # 4. mid
-        if self.mid_block is not None:
+        if self.mid_block is not None and not reuse_deep_cache:
             if hasattr(self.mid_block, "has_cross_attention") and self.mid_block.has_cross_attention:
                 sample, spatial_attn_inputs, spatial_attn_idx = self.mid_block(
                     sample,
@@ -1134,9 +1197,22 @@ class UNetVton2DConditionModel(ModelMixin, ConfigMixin, UNet2DConditionLoadersMi
             sample = sample + mid_block_additional_residual
 
         # 5. up
-        for i, upsample_block in enumerate(self.up_blocks):
+        first_shallow_block = len(self.up_blocks) - deep_cache_depth if deep_cache_depth else None
+        up_blocks = enumerate(self.up_blocks)
+        if reuse_deep_cache:
+            _, cached_sample, spatial_attn_idx = self._deep_cache
+            sample = cached_sample[: sample.shape[0]]
+            # the shallow up blocks take the first skip connections; the rest belong to the skipped deep blocks
+            num_shallow_res = sum(len(block.resnets) for block in self.up_blocks[first_shallow_block:])
+            down_block_res_samples = down_block_res_samples[:num_shallow_res]
+            up_blocks = enumerate(self.up_blocks[first_shallow_block:], start=first_shallow_block)
+
+        for i, upsample_block in up_blocks:
             is_final_block = i == len(self.up_blocks) - 1
 
+            if i == first_shallow_block and not reuse_deep_cache:
+                self._deep_cache = (input_shape, sample, spatial_attn_idx)
+
             res_samples = down_block_res_samples[-len(upsample_block.resnets) :]
             down_block_res_samples = down_block_res_samples[: -len(upsample_block.resnets)]
 
@@ -0,0 +1,69 @@
+import fnmatch
+from typing import Iterable, Optional, Tuple, Type, Union
+
+import torch
+from torch import nn
+
+
+class DynamicQuantizedLinear(nn.Module):
+    """
+    int8 dynamic-quantized stand-in for an `nn.Linear` / diffusers `LoRACompatibleLinear`.
+
+    Weights are int8 per output channel, activations are quantized on the fly per call. The diffusers
+    call sites pass a LoRA `scale` positionally, which is accepted and ignored (quantized layers carry
+    no LoRA). Inputs are computed in fp32 and the output is cast back, so the layer also works under
+    bf16 autocast.
+    """
+
+    def __init__(self, quantized: nn.Module):
+        super().__init__()
+        self.quantized = quantized
+
+    @classmethod
+    def from_float(cls, linear: nn.Linear) -> "DynamicQuantizedLinear":
+        # nnqd.Linear.from_float only accepts exact nn.Linear types, not subclasses like LoRACompatibleLinear
+        float_linear = nn.Linear(linear.in_features, linear.out_features, bias=linear.bias is not None)
+        float_linear.weight = nn.Parameter(linear.weight.detach().float())
+        if linear.bias is not None:
+            float_linear.bias = nn.Parameter(linear.bias.detach().float())
+        float_linear.qconfig = torch.ao.quantization.default_dynamic_qconfig
+        return cls(torch.ao.nn.quantized.dynamic.Linear.from_float(float_linear))
+
+    def forward(self, hidden_states: torch.Tensor, scale: float = 1.0) -> torch.Tensor:
+        return self.quantized(hidden_states.float()).to(hidden_states.dtype)
+
+
+def quantize_dynamic_int8(
+    model: nn.Module,
+    name: str,
+    exclude: Iterable[str] = (),
+    within: Optional[Union[Type[nn.Module], Tuple[Type[nn.Module], ...]]] = None,
+) -> int:
+    """
+    Swap the `nn.Linear` layers of `model` for `DynamicQuantizedLinear`, in place.
+
+    Only layers inside modules of type(s) `within` are swapped, if it is given. A layer is skipped if its qualified
+    name `{name}.{path in model}` (e.g. `unet_vton.up_blocks.3.attentions.2.transformer_blocks.0.attn1.to_q`)
+    matches one of the `exclude` glob patterns, or if it has a LoRA layer attached. Returns the number of layers
+    swapped.
+    """
+    exclude = list(exclude)
+    within_paths = None
+    if within is not None:
+        within_paths = [path for path, module in model.named_modules() if isinstance(module, within)]
+
+    targets = []
+    for parent_path, parent in model.named_modules():
+        for child_name, child in parent.named_children():
+            if not isinstance(child, nn.Linear) or getattr(child, "lora_layer", None) is not None:
+                continue
+            path = f"{parent_path}.{child_name}" if parent_path else child_name
+            if within_paths is not None and not any(path.startswith(prefix + ".") for prefix in within_paths):
+                continue
+            if any(fnmatch.fnmatchcase(f"{name}.{path}", pattern) for pattern in exclude):
+                continue
+            targets.append((parent, child_name, child))
+
+    for parent, child_name, child in targets:
+        setattr(parent, child_name, DynamicQuantizedLinear.from_float(child))
+    return len(targets)
@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Union
+
+import torch
+
+
+def map_tensors(fn: Callable[[torch.Tensor], torch.Tensor], value: Any) -> Any:
+    """Apply `fn` to every tensor in a nested dict / list / tuple structure"""
+    if isinstance(value, torch.Tensor):
+        return fn(value)
+    if isinstance(value, dict):
+        return {k: map_tensors(fn, v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(map_tensors(fn, v) for v in value)
+    return value
+
+
+def nbytes(value: Any) -> int:
+    total = 0
+
+    def count(tensor):
+        nonlocal total
+        total += tensor.numel() * tensor.element_size()
+        return tensor
+
+    map_tensors(count, value)
+    return total
+
+
+class TensorLRUCache:
+    """
+    Thread-safe LRU cache of (nested structures of) tensors, bounded by total size in bytes.
+
+    If `store_dtype` is set, floating point tensors are stored in that dtype
+    (e.g. float16 to halve the footprint) and cast back on `get(key, dtype=...)`.
+    If `store_device` is set (e.g. "cpu"), tensors are kept there and moved
+    back with `get(key, device=...)`.
+    """
+
+    def __init__(self, max_bytes: int, store_dtype: Optional[torch.dtype] = None,
+                 store_device: Optional[Union[str, torch.device]] = None):
+        self.max_bytes = max_bytes
+        self.store_dtype = store_dtype
+        self.store_device = store_device
+
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _to_storage(self, tensor: torch.Tensor) -> torch.Tensor:
+        tensor = tensor.detach()
+        if self.store_device is not None:
+            tensor = tensor.to(self.store_device)
+        if self.store_dtype is not None and tensor.is_floating_point():
+            tensor = tensor.to(self.store_dtype)
+        return tensor
+
+    def round_trip(self, value: Any) -> Any:
+        """`value` with its floating point tensors rounded to `store_dtype`, as a later `get` returns them"""
+        if self.store_dtype is None:
+            return value
+        return map_tensors(lambda t: t.to(self.store_dtype) if t.is_floating_point() else t, value)
+
+    def get(self, key: Hashable, dtype: Optional[torch.dtype] = None,
+            device: Optional[Union[str, torch.device]] = None) -> Any:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        def restore(tensor):
+            if device is not None:
+                tensor = tensor.to(device, non_blocking=True)
+            if dtype is not None and tensor.is_floating_point():
+                tensor = tensor.to(dtype)
+            return tensor
+
+        return map_tensors(restore, value)
+
+    def put(self, key: Hashable, value: Any):
+        value = map_tensors(self._to_storage, value)
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self.current_bytes -= self._sizes.pop(evicted_key)
+                self.evictions += 1
+
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.current_bytes += size
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
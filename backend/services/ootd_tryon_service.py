@@ -1,18 +1,35 @@
 import os
 import sys
 import torch
-from PIL import Image
+from PIL import Image, ImageDraw
 from pathlib import Path
 import logging
-from typing import Optional
-import time
-import numpy as np
+from typing import Callable, Optional, Tuple
+import random
+import threading
+
+from services.blob_store import derive_key
+from services.executor import get_executor
+from services.metrics import get_metrics
+from services.micro_batcher import MicroBatcher
+from services.ootd.model_manager import OOTDModelManager
 
 logger = logging.getLogger(__name__)
 
+# get_mask_location's category names
+MASK_CATEGORY_FOR_CLOTH_TYPE = {"upper": "upper_body", "lower": "lower_body", "overall": "dresses"}
+# Human parsing and openpose run on the person image at this size
+MASK_INPUT_SIZE = (384, 512)
+
+# OOTDiffusion ships two checkpoints: "hd" (VITON-HD, upper body only) and "dc" (Dress Code, all categories)
+MODEL_TYPE_FOR_CLOTH_TYPE = {"upper": "hd", "lower": "dc", "overall": "dc"}
+OOTD_CATEGORY_FOR_CLOTH_TYPE = {"upper": "upperbody", "lower": "lowerbody", "overall": "dress"}
+OOTD_IMAGE_SIZE = (768, 1024)
+
 class OOTDTryOnService:
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        use_cuda = torch.cuda.is_available() and os.getenv("OOTD_DEVICE", "auto") != "cpu"
+        self.device = "cuda" if use_cuda else "cpu"
         logger.info(f"OOTDTryOnService initialized on device: {self.device}")
         
         self.checkpoints_dir = Path("checkpoints")
@@ -20,117 +37,281 @@ class OOTDTryOnService:
         self.results_dir.mkdir(exist_ok=True)
         
         self.model_loaded = False
-        self.ootd_model = None
+        self._config_key = None
+        # (Parsing, OpenPose) for the inpainting masks, loaded on first use; False if they failed to load
+        self.mask_models = None
+        # HD / DC models sharing their VAE and CLIP models, with the UNets in a memory-budgeted LRU
+        self.ootd_models = OOTDModelManager(0)
+        
+        self.num_steps = int(os.getenv("OOTD_NUM_STEPS", "20"))
+        self.image_scale = float(os.getenv("OOTD_IMAGE_SCALE", "2.0"))
+        # "t_lo,t_hi": image guidance only for timesteps in that range, conditional-only UNet calls elsewhere
+        self.guidance_interval = self._parse_guidance_interval(os.getenv("OOTD_GUIDANCE_INTERVAL", ""))
+        
+        # Loading runs in a worker thread; the pipeline's scheduler is stateful so calls are serialized
+        self._load_lock = threading.Lock()
+        self._inference_lock = threading.Lock()
         
-        # OOTDiffusion paths
-        self.model_path = self.checkpoints_dir / "ootd"
-        self.vae_path = self.checkpoints_dir / "ootd" / "ootd_vae"
-        self.unet_path = self.checkpoints_dir / "ootd" / "ootd_unet"
+        # Concurrent requests with the same model/category/steps/scale (and crop box) share one denoising loop
+        self.batcher = MicroBatcher(
+            self._run_batch,
+            max_batch_size=int(os.getenv("OOTD_MAX_BATCH", "4")),
+            window_ms=float(os.getenv("OOTD_BATCH_WINDOW_MS", "25")),
+        )
     
-    def _load_model(self):
+    @staticmethod
+    def _parse_guidance_interval(value: str) -> Optional[Tuple[float, float]]:
+        if not value.strip():
+            return None
+        try:
+            t_lo, t_hi = (float(part) for part in value.split(","))
+        except ValueError:
+            logger.warning(f"Ignoring invalid OOTD_GUIDANCE_INTERVAL {value!r}, expected 't_lo,t_hi'")
+            return None
+        return (min(t_lo, t_hi), max(t_lo, t_hi))
+    
+    def config_key(self) -> str:
+        """Fingerprint of every setting that changes the output image (steps, scale, guidance and the model settings)"""
+        if self._config_key is None:
+            # The OOTDiffusion modules import each other by bare name
+            ootd_dir = str(Path(__file__).parent / "ootd")
+            if ootd_dir not in sys.path:
+                sys.path.insert(0, ootd_dir)
+            from inference_ootd_base import config_key
+            
+            self._config_key = derive_key(
+                "ootd", config_key(self.device), self.num_steps, self.image_scale, self.guidance_interval
+            )
+        return self._config_key
+    
+    def _load_model(self, model_type: str = "hd"):
         """Load OOTDiffusion model"""
-        if self.model_loaded:
-            return
-        
+        with self._load_lock:
+            if model_type in self.ootd_models:
+                return
+            self._load_model_locked(model_type)
+    
+    def _load_model_locked(self, model_type: str):
         try:
-            logger.info("Loading OOTDiffusion model...")
-            logger.info(f"Model path: {self.model_path}")
+            logger.info(f"Loading OOTDiffusion {model_type} model...")
+            logger.info(f"Checkpoints: {self.checkpoints_dir}")
             logger.info(f"Device: {self.device}")
             
-            # Add OOTDiffusion to path
-            sys.path.insert(0, str(Path(__file__).parent / "ootd"))
-            
-            from pipelines_ootd.pipeline_ootd import OotdPipeline
-            
-            # Load the pipeline
-            logger.info("Initializing OOTDiffusion pipeline...")
-            
-            self.ootd_model = OotdPipeline.from_pretrained(
-                str(self.model_path),
-                torch_dtype=torch.float32,  # Use float32 for 4GB GPU
-                use_safetensors=True
-            ).to(self.device)
-            
-            # Enable memory optimizations
-            if self.device != "cpu":
-                logger.info("Enabling memory optimizations for 4GB GPU...")
-                self.ootd_model.enable_attention_slicing()
-                self.ootd_model.enable_vae_slicing()
-                if hasattr(self.ootd_model, 'enable_model_cpu_offload'):
-                    self.ootd_model.enable_model_cpu_offload()
+            self.ootd_models.load(model_type)
             
             self.model_loaded = True
-            logger.info("OOTDiffusion model loaded successfully!")
+            logger.info(f"OOTDiffusion {model_type} model loaded successfully!")
         
         except Exception as e:
             logger.error(f"Failed to load OOTDiffusion model: {str(e)}", exc_info=True)
             logger.warning("Model loading failed. Please ensure:")
             logger.warning(f"1. Checkpoints exist in: {self.checkpoints_dir}")
             logger.warning("2. All OOTDiffusion files are properly copied")
-            self.model_loaded = False
     
-    async def run_tryon(self, cloth_path: str, person_path: str, category: str) -> str:
-        """Run virtual try-on"""
-        logger.info(f"Running OOTDiffusion try-on: cloth={cloth_path}, person={person_path}, category={category}")
+    async def run_tryon(
+        self,
+        cloth_img: Image.Image,
+        person_img: Image.Image,
+        category: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        cloth_hash: Optional[str] = None,
+    ) -> Tuple[Image.Image, int]:
+        """
+        Run virtual try-on on decoded images and return (result image, denoising steps run)
         
-        # Load model if not loaded
-        if not self.model_loaded:
-            self._load_model()
+        progress_callback(step, total_steps) is invoked from the inference thread
+        after every denoising step (via OotdPipeline's callback_on_step_end).
+        With early termination the steps run can be fewer than total_steps.
+        cloth_hash is the garment's content key, used as the garment cache key.
+        """
+        logger.info(f"Running OOTDiffusion try-on: category={category}")
         
-        # Load images
-        cloth_img = Image.open(cloth_path).convert("RGB")
-        person_img = Image.open(person_path).convert("RGB")
+        cloth_type = self._map_category(category)
+        model_type = MODEL_TYPE_FOR_CLOTH_TYPE[cloth_type]
         
-        if self.model_loaded and self.ootd_model:
-            result_img = await self._run_ootd_inference(person_img, cloth_img, category)
-        else:
+        # Load model if not loaded
+        if model_type not in self.ootd_models:
+            await get_executor().run_io(self._load_model, model_type)
+        
+        if model_type not in self.ootd_models:
             logger.error("OOTDiffusion model not loaded, cannot perform try-on")
             raise RuntimeError("OOTDiffusion model failed to load")
         
-        # Save result
-        timestamp = int(time.time())
-        result_filename = f"tryon_result_{timestamp}.png"
-        result_path = self.results_dir / result_filename
-        result_img.save(result_path)
-        
-        logger.info(f"Try-on result saved: {result_path}")
-        return str(result_path)
+        return await self._run_ootd_inference(person_img, cloth_img, category, progress_callback, cloth_hash)
     
-    async def _run_ootd_inference(self, person_img: Image.Image, cloth_img: Image.Image, category: str) -> Image.Image:
+    async def _run_ootd_inference(
+        self,
+        person_img: Image.Image,
+        cloth_img: Image.Image,
+        category: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        cloth_hash: Optional[str] = None,
+    ) -> Tuple[Image.Image, int]:
         """Run OOTDiffusion inference"""
         logger.info("Running OOTDiffusion inference...")
         
         try:
-            # Prepare inputs
-            # OOTDiffusion expects specific input format
             cloth_type = self._map_category(category)
             
-            logger.info(f"Inference parameters: cloth_type={cloth_type}")
+            logger.info(f"Inference parameters: cloth_type={cloth_type}, steps={self.num_steps}")
             
-            # Run inference
-            with torch.no_grad():
-                result = self.ootd_model(
-                    cloth_image=cloth_img,
-                    person_image=person_img,
-                    cloth_type=cloth_type,
-                    num_inference_steps=20,
-                    guidance_scale=2.0,
-                )
+            # Masks are per request; requests only share a batch if they crop to the same box
+            inputs, crop_box = await get_executor().run_compute(self._prepare_request, person_img, cloth_type)
             
-            if isinstance(result, dict) and 'images' in result:
-                result_img = result['images'][0]
-            elif isinstance(result, list):
-                result_img = result[0]
-            else:
-                result_img = result
+            # Run inference through the micro-batcher (which executes in the compute pool)
+            key = (MODEL_TYPE_FOR_CLOTH_TYPE[cloth_type], cloth_type, self.num_steps, self.image_scale, crop_box)
+            request = {
+                "inputs": inputs,
+                "cloth_img": cloth_img,
+                "cloth_hash": cloth_hash,
+                "seed": random.randint(0, 2147483647),
+                "progress_callback": progress_callback,
+            }
+            result_img, steps_run = await self.batcher.submit(key, request)
             
-            logger.info("OOTDiffusion inference complete!")
-            return result_img
+            logger.info(f"OOTDiffusion inference complete after {steps_run} steps!")
+            return result_img, steps_run
         
         except Exception as e:
             logger.error(f"OOTDiffusion inference failed: {str(e)}", exc_info=True)
             raise
     
+    def _prepare_request(self, person_img: Image.Image, cloth_type: str):
+        """The pipeline inputs of a person image, and the crop box of its mask (None without OOTD_CROP_TO_MASK)"""
+        inputs = self._prepare_inputs(person_img.convert("RGB"), cloth_type)
+        model_type = MODEL_TYPE_FOR_CLOTH_TYPE[cloth_type]
+        self._load_model(model_type)
+        if model_type not in self.ootd_models:
+            raise RuntimeError(f"OOTDiffusion {model_type} model failed to load")
+        return inputs, self.ootd_models[model_type].crop_box(inputs[2])
+    
+    def _run_batch(self, key, requests):
+        """
+        Run a micro-batch of compatible requests as one batched pipeline call.
+        Returns (image, steps_run) per request.
+        """
+        model_type, cloth_type, num_steps, image_scale, crop_box = key
+        # The model may have been evicted since the request was queued
+        self._load_model(model_type)
+        if model_type not in self.ootd_models:
+            raise RuntimeError(f"OOTDiffusion {model_type} model failed to load")
+        model = self.ootd_models[model_type]
+        
+        inputs = [r["inputs"] for r in requests]
+        image_garm = [r["cloth_img"].convert("RGB").resize(OOTD_IMAGE_SIZE, Image.Resampling.LANCZOS) for r in requests]
+        
+        progress_callbacks = [
+            (i, r["progress_callback"]) for i, r in enumerate(requests) if r["progress_callback"] is not None
+        ]
+        def report_progress(pipe, step, timestep, callback_kwargs):
+            # A request that converged early stays at the steps it ran
+            for i, progress_callback in progress_callbacks:
+                progress_callback(min(step + 1, pipe.steps_run[i]), num_steps)
+            return {}
+        
+        callback_on_step_end = report_progress if progress_callbacks else None
+        with self._inference_lock, torch.no_grad():
+            images = model.run_batch(
+                model_type=model_type,
+                category=OOTD_CATEGORY_FOR_CLOTH_TYPE[cloth_type],
+                image_garm=image_garm,
+                image_vton=[image_vton for _, image_vton, _ in inputs],
+                mask=[mask for _, _, mask in inputs],
+                image_ori=[image_ori for image_ori, _, _ in inputs],
+                seeds=[r["seed"] for r in requests],
+                num_steps=num_steps,
+                image_scale=image_scale,
+                callback_on_step_end=callback_on_step_end,
+                garment_hashes=[r["cloth_hash"] for r in requests],
+                guidance_interval=self.guidance_interval,
+                crop_box=crop_box,
+            )
+        
+        steps_run = [image.info.get("steps_run", num_steps) for image in images]
+        metrics = get_metrics()
+        metrics.incr("ootd.denoising_steps", sum(steps_run))
+        early_stops = [steps for steps in steps_run if steps < num_steps]
+        if early_stops:
+            metrics.incr("ootd.early_stops", len(early_stops))
+            metrics.incr("ootd.steps_saved", sum(num_steps - steps for steps in early_stops))
+        return list(zip(images, steps_run))
+    
+    def warm_up(self, model_type: str):
+        """One single-step inference on blank images, to prime kernels and the CUDA allocator"""
+        self._load_model(model_type)
+        if model_type not in self.ootd_models:
+            raise RuntimeError(f"OOTDiffusion {model_type} model failed to load")
+        
+        cloth_type = "upper" if model_type == "hd" else "lower"
+        blank = Image.new("RGB", OOTD_IMAGE_SIZE, (255, 255, 255))
+        inputs, crop_box = self._prepare_request(blank, cloth_type)
+        request = {"inputs": inputs, "cloth_img": blank, "cloth_hash": None, "seed": 0, "progress_callback": None}
+        self._run_batch((model_type, cloth_type, 1, self.image_scale, crop_box), [request])
+        # Don't keep the blank images in the garment / person caches
+        self.ootd_models[model_type].garment_cache.clear()
+        self.ootd_models[model_type].person_cache.clear()
+    
+    def _load_mask_models(self):
+        with self._load_lock:
+            if self.mask_models is None:
+                try:
+                    # The vendored preprocessors import each other as preprocess.* from services/
+                    sys.path.insert(0, str(Path(__file__).parent))
+                    from preprocess.humanparsing.run_parsing import Parsing
+                    from preprocess.openpose.run_openpose import OpenPose
+                    self.mask_models = (Parsing(0), OpenPose(0))
+                except Exception as e:
+                    logger.error(f"Failed to load the human parsing / openpose models: {str(e)}", exc_info=True)
+                    logger.warning("Falling back to fixed rectangular try-on masks")
+                    self.mask_models = False
+        return self.mask_models
+    
+    def _prepare_inputs(self, person_img: Image.Image, cloth_type: str):
+        """Build the (image_ori, masked image_vton, mask) triple OOTDiffusion expects"""
+        image_ori = person_img.resize(OOTD_IMAGE_SIZE, Image.Resampling.LANCZOS)
+        mask = self._garment_mask(image_ori, cloth_type)
+        
+        # Same as OOTDiffusion's run_ootd.py: the masked area is filled with neutral gray
+        mask_gray = Image.new("RGB", OOTD_IMAGE_SIZE, (127, 127, 127))
+        image_vton = Image.composite(mask_gray, image_ori, mask)
+        return image_ori, image_vton, mask
+    
+    def _garment_mask(self, image_ori: Image.Image, cloth_type: str) -> Image.Image:
+        """Inpainting mask from human parsing and openpose keypoints, as in OOTDiffusion's run_ootd.py"""
+        mask_models = self._load_mask_models()
+        if mask_models:
+            from services.ootd.utils_ootd import get_mask_location
+            
+            parsing_model, openpose_model = mask_models
+            person_small = image_ori.resize(MASK_INPUT_SIZE)
+            try:
+                keypoints = openpose_model(person_small)
+                model_parse, _ = parsing_model(person_small)
+                mask, _ = get_mask_location(
+                    MODEL_TYPE_FOR_CLOTH_TYPE[cloth_type],
+                    MASK_CATEGORY_FOR_CLOTH_TYPE[cloth_type],
+                    model_parse,
+                    keypoints,
+                )
+                return mask.resize(OOTD_IMAGE_SIZE, Image.NEAREST)
+            except Exception as e:
+                # e.g. openpose found no person in the image
+                logger.warning(f"Garment mask from parsing / openpose failed ({str(e)}), using a fixed mask")
+        return self._fixed_mask(cloth_type)
+    
+    def _fixed_mask(self, cloth_type: str) -> Image.Image:
+        """Rectangle over the garment's usual area, for when parsing / openpose are unavailable"""
+        width, height = OOTD_IMAGE_SIZE
+        mask = Image.new("L", OOTD_IMAGE_SIZE, 0)
+        draw = ImageDraw.Draw(mask)
+        if cloth_type == "lower":
+            draw.rectangle([(width * 0.25, height * 0.45), (width * 0.75, height * 0.9)], fill=255)
+        elif cloth_type == "overall":
+            draw.rectangle([(width * 0.2, height * 0.15), (width * 0.8, height * 0.9)], fill=255)
+        else:
+            draw.rectangle([(width * 0.2, height * 0.15), (width * 0.8, height * 0.6)], fill=255)
+        return mask
+    
     def _map_category(self, category: str) -> str:
         """Map our category names to OOTDiffusion format"""
         mapping = {
@@ -3,8 +3,11 @@ import numpy as np
 from PIL import Image
 import mediapipe as mp
 from pathlib import Path
+from typing import Optional
 import logging
 
+from services.blob_store import atomic_save_image
+
 logger = logging.getLogger(__name__)
 
 class PersonPreprocessor:
@@ -20,7 +23,20 @@ class PersonPreprocessor:
             min_detection_confidence=0.5
         )
     
-    def process(self, image_path: str) -> str:
+    def process(self, image_path: str, output_path: Optional[str] = None) -> str:
+        img_resized = self.process_image(image_path)
+        
+        if output_path is None:
+            output_path = self.output_dir / f"person_processed_{Path(image_path).stem}.png"
+        
+        pil_img = Image.fromarray(img_resized)
+        atomic_save_image(pil_img, Path(output_path))
+        
+        logger.info(f"Person processed successfully: {output_path}")
+        return str(output_path)
+    
+    def process_image(self, image_path: str) -> np.ndarray:
+        """Run the preprocessing steps and return the RGB array without writing it to disk"""
         try:
             logger.info(f"Processing person image: {image_path}")
             
@@ -40,14 +56,7 @@ class PersonPreprocessor:
             img_resized = self._resize_person(img_enhanced)
             logger.info("Image resized")
             
-            output_filename = f"person_processed_{Path(image_path).stem}.png"
-            output_path = self.output_dir / output_filename
-            
-            pil_img = Image.fromarray(img_resized)
-            pil_img.save(output_path)
-            
-            logger.info(f"Person processed successfully: {output_path}")
-            return str(output_path)
+            return img_resized
         except Exception as e:
             logger.error(f"Error processing person image: {str(e)}", exc_info=True)
             raise
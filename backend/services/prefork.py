@@ -0,0 +1,126 @@
+"""
+Pre-fork serving: load the model weights once in a parent process, then fork the uvicorn workers from it.
+
+Forked workers share the parent's weight pages copy-on-write (and the page cache of any weights that stay
+memory-mapped), so N workers cost little more memory than one, and a worker restart doesn't reload anything. Started by main.py with
+PREFORK_WORKERS > 1.
+
+Only torch models on CPU are loaded before the fork: CUDA contexts and ONNX Runtime sessions (rembg,
+`OOTD_ONNX_DIR`) don't survive one, so those, and every warm-up inference, happen in each worker.
+
+Each worker has its own memory, so whatever requests hand over to each other has to go through the
+filesystem (see main.py's `share_state_across_workers`). Every worker gets its index in `PREFORK_WORKER_INDEX`
+(kept across restarts), so that once-per-server tasks such as the janitor run in worker 0 only.
+"""
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import time
+from typing import Callable, List, Optional
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+WORKER_INDEX_ENV = "PREFORK_WORKER_INDEX"
+
+
+def is_primary_worker() -> bool:
+    """True in pre-forked worker 0, and in any process not started by `serve`"""
+    return os.getenv(WORKER_INDEX_ENV, "0") == "0"
+
+
+def preload_ootd(tryon_service) -> List[str]:
+    """Load the `OOTD_PRELOAD_MODEL_TYPES` models in this process, if they can be shared with forked workers"""
+    model_types = tryon_service.preload_model_types()
+    if not model_types:
+        return []
+    if tryon_service._get_ootd_service().device != "cpu":
+        logger.warning("CUDA can't be used across a fork; each worker loads its own OOTDiffusion models")
+        return []
+    if os.getenv("OOTD_ONNX_DIR"):
+        logger.warning("ONNX Runtime sessions can't be used across a fork; each worker loads its own OOTDiffusion models")
+        return []
+
+    for model_type in model_types:
+        tryon_service.load_local_model(model_type)
+    return model_types
+
+
+def serve(app, host: str, port: int, workers: int, preload: Optional[Callable[[], object]] = None):
+    """Run `preload()`, then serve `app` from `workers` forked processes sharing one listening socket"""
+    if not hasattr(os, "fork"):
+        logger.warning("os.fork is not available on this platform, serving from a single process")
+        if preload is not None:
+            preload()
+        uvicorn.run(app, host=host, port=port, reload=False)
+        return
+
+    # No collections while loading leaves no freed holes between long-lived objects; freezing them before the
+    # fork keeps the workers' collections from writing to (and un-sharing) the pages they live in
+    gc.disable()
+    start = time.perf_counter()
+    if preload is not None:
+        preload()
+    gc.freeze()
+    logger.info(f"Pre-fork parent loaded in {time.perf_counter() - start:.1f}s, starting {workers} workers")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    config = uvicorn.Config(app, host=host, port=port, reload=False)
+
+    children = {}
+    stopping = False
+
+    def start_worker(index):
+        pid = os.fork()
+        if pid == 0:
+            os.environ[WORKER_INDEX_ENV] = str(index)
+            gc.enable()
+            # otherwise every worker draws the same seeds
+            random.seed()
+            status = 1
+            try:
+                uvicorn.Server(config).run(sockets=[sock])
+                status = 0
+            except Exception:
+                logger.exception(f"Worker {os.getpid()} failed")
+            finally:
+                os._exit(status)
+        children[pid] = (time.monotonic(), index)
+        logger.info(f"Started worker {index} (pid {pid})")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for index in range(workers):
+        start_worker(index)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        child = children.pop(pid, None)
+        if stopping or child is None:
+            continue
+        started_at, index = child
+        logger.warning(f"Worker {index} (pid {pid}) exited with code {os.waitstatus_to_exitcode(status)}, restarting it")
+        # don't spin on a worker that fails at startup
+        if time.monotonic() - started_at < 5:
+            time.sleep(5)
+        start_worker(index)
+    sock.close()
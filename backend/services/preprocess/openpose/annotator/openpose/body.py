@@ -3,6 +3,7 @@ import sys
 PROJECT_ROOT = Path(__file__).absolute().parents[3].absolute()
 # print(PROJECT_ROOT)
 
+import os
 import cv2
 import numpy as np
 import math
@@ -11,20 +12,37 @@ from scipy.ndimage.filters import gaussian_filter
 import matplotlib.pyplot as plt
 import matplotlib
 import torch
+from safetensors.torch import load_file, save_file
 from torchvision import transforms
 
 from . import util
 from .model import bodypose_model
 
 
+def load_mmap_state_dict(model_path):
+    """
+    State dict of `model_path`, memory-mapped from a safetensors copy written next to it on first use,
+    instead of read fully into memory by torch.load
+    """
+    safetensors_path = os.path.splitext(model_path)[0] + ".safetensors"
+    if not os.path.exists(safetensors_path):
+        state_dict = torch.load(model_path, map_location="cpu")
+        tmp_path = safetensors_path + ".tmp"
+        save_file({name: tensor.contiguous() for name, tensor in state_dict.items()}, tmp_path)
+        os.replace(tmp_path, safetensors_path)
+    return load_file(safetensors_path)
+
+
 class Body(object):
     def __init__(self, model_path):
-        self.model = bodypose_model()
+        # built without allocating weights; assign=True makes the mapped tensors the weights
+        with torch.device("meta"):
+            self.model = bodypose_model()
+        model_dict = util.transfer(self.model, load_mmap_state_dict(model_path))
+        self.model.load_state_dict(model_dict, assign=True)
         if torch.cuda.is_available():
             self.model = self.model.cuda()
         #     print('cuda')
-        model_dict = util.transfer(self.model, torch.load(model_path))
-        self.model.load_state_dict(model_dict)
         self.model.eval()
 
 
@@ -5,7 +5,7 @@ import cv2
 import os
 from pathlib import Path
 
-PROJECT_ROOT = Path(__file__).absolute().parents[3].absolute()
+PROJECT_ROOT = Path(__file__).absolute().parents[4].absolute()
 
 annotator_ckpts_path = os.path.join(PROJECT_ROOT, 'checkpoints/openpose/ckpts')
 # print(annotator_ckpts_path)
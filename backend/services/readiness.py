@@ -0,0 +1,136 @@
+import os
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def memory_snapshot() -> Dict[str, Optional[int]]:
+    """Resident set size of this process and CUDA memory allocated by torch, in bytes (None if unknown)"""
+    rss = None
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    cuda = None
+    try:
+        import torch
+        if torch.cuda.is_available():
+            cuda = torch.cuda.memory_allocated()
+    except ImportError:
+        pass
+    return {"rss_bytes": rss, "cuda_allocated_bytes": cuda}
+
+
+def _delta(after: Optional[int], before: Optional[int]) -> Optional[int]:
+    if after is None or before is None:
+        return None
+    return after - before
+
+
+class ModelState:
+    PENDING = "pending"
+    LOADING = "loading"
+    WARMING_UP = "warming_up"
+    READY = "ready"
+    FAILED = "failed"
+    LAZY = "lazy"
+
+
+class ModelStatus:
+    def __init__(self, name: str, state: str):
+        self.name = name
+        self.state = state
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.memory: Dict[str, Optional[int]] = {}
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "memory": self.memory,
+            "error": self.error,
+        }
+
+
+class Readiness:
+    """
+    Startup preload state for the readiness probe.
+
+    With `PRELOAD_MODELS=1` every registered model is loaded and warmed up by
+    `preload()` and the service is ready once all of them succeeded. Otherwise
+    models stay lazy (loaded by the first request that needs them) and the
+    service is ready immediately.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = enabled if enabled is not None else os.getenv("PRELOAD_MODELS", "0") == "1"
+        self.models: Dict[str, ModelStatus] = {}
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def register(self, name: str):
+        self.models[name] = ModelStatus(name, ModelState.PENDING if self.enabled else ModelState.LAZY)
+
+    @property
+    def ready(self) -> bool:
+        if not self.enabled:
+            return True
+        return all(status.state == ModelState.READY for status in self.models.values())
+
+    async def preload(
+        self,
+        name: str,
+        load: Callable[[], Awaitable[Optional[dict]]],
+        warm_up: Optional[Callable[[], Awaitable[Optional[dict]]]] = None,
+    ) -> bool:
+        """
+        Run `load` then `warm_up`, recording timings and the memory they added.
+        Stages that run in another process return their own memory figures instead.
+        """
+        status = self.models.setdefault(name, ModelStatus(name, ModelState.PENDING))
+        before = memory_snapshot()
+        try:
+            status.state = ModelState.LOADING
+            start = time.perf_counter()
+            reported = await load()
+            status.load_seconds = round(time.perf_counter() - start, 3)
+
+            if warm_up is not None:
+                status.state = ModelState.WARMING_UP
+                start = time.perf_counter()
+                reported = await warm_up() or reported
+                status.warmup_seconds = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            status.state = ModelState.FAILED
+            status.error = str(e)
+            logger.error(f"Preloading {name} failed: {str(e)}", exc_info=True)
+            return False
+
+        after = memory_snapshot()
+        status.memory = reported or {
+            "rss_bytes": _delta(after["rss_bytes"], before["rss_bytes"]),
+            "cuda_allocated_bytes": _delta(after["cuda_allocated_bytes"], before["cuda_allocated_bytes"]),
+        }
+        status.state = ModelState.READY
+        logger.info(
+            f"Preloaded {name}: load {status.load_seconds}s, warm-up {status.warmup_seconds}s, memory {status.memory}"
+        )
+        return True
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "preload": self.enabled,
+            # which worker answered, when several serve the same port
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "models": {name: status.to_dict() for name, status in self.models.items()},
+        }
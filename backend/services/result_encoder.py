@@ -0,0 +1,111 @@
+import os
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from services.artifact_store import ArtifactStore
+from services.blob_store import atomic_save_image
+
+try:
+    # Pillow 10 has no built-in AVIF support; the plugin registers it when installed
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+logger = logging.getLogger(__name__)
+
+# format -> (Pillow format, media type, file suffix, save options)
+RESULT_FORMATS = {
+    "avif": ("AVIF", "image/avif", ".avif", {"quality": int(os.getenv("RESULT_AVIF_QUALITY", "60"))}),
+    "webp": ("WEBP", "image/webp", ".webp", {"quality": int(os.getenv("RESULT_WEBP_QUALITY", "85")), "method": 6}),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg", {"quality": int(os.getenv("RESULT_JPEG_QUALITY", "88")), "optimize": True, "progressive": True}),
+    "png": ("PNG", "image/png", ".png", {"optimize": True}),
+}
+
+# Tried in order when the format is negotiated from the Accept header
+PREFERRED_FORMATS = ("avif", "webp", "jpeg")
+
+RESULT_SIZES = ("full", "thumb")
+THUMBNAIL_SIZE = int(os.getenv("RESULT_THUMBNAIL_SIZE", "256"))
+
+
+def _format_available(fmt: str) -> bool:
+    Image.init()
+    return RESULT_FORMATS[fmt][0] in Image.SAVE
+
+
+class ResultEncoder:
+    """
+    Compact encodings of try-on results, produced once per (result, format, size).
+
+    Variants are written next to each other in `variants_dir` as
+    `<result key>.<size><suffix>` and served from there on every later request,
+    so the encode cost is paid on the first view only.
+    """
+
+    def __init__(self, artifact_store: ArtifactStore, variants_dir: Path):
+        self.artifacts = artifact_store
+        self.variants_dir = Path(variants_dir)
+        self.variants_dir.mkdir(parents=True, exist_ok=True)
+
+        self.formats = [fmt for fmt in RESULT_FORMATS if _format_available(fmt)]
+        self._locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        logger.info(f"Result formats available: {', '.join(self.formats)}")
+
+    def negotiate(self, accept: Optional[str], requested: Optional[str] = None) -> str:
+        """Explicit `requested` format if supported, else the best format the client accepts"""
+        if requested and requested != "auto":
+            if requested not in self.formats:
+                raise ValueError(f"Unsupported format: {requested}")
+            return requested
+
+        accept = (accept or "").lower()
+        for fmt in PREFERRED_FORMATS:
+            if fmt in self.formats and RESULT_FORMATS[fmt][1] in accept:
+                return fmt
+        return "png"
+
+    def media_type(self, fmt: str) -> str:
+        return RESULT_FORMATS[fmt][1]
+
+    def variant_path(self, key: str, fmt: str, size: str) -> Path:
+        return self.variants_dir / f"{key}.{size}{RESULT_FORMATS[fmt][2]}"
+
+    def variant(self, key: str, fmt: str, size: str = "full") -> Optional[Path]:
+        """Path of the encoded variant, encoding it on first use. Blocking; run in a worker thread."""
+        if size not in RESULT_SIZES:
+            raise ValueError(f"Unsupported size: {size}")
+        path = self.variant_path(key, fmt, size)
+        if path.exists():
+            return path
+
+        # Concurrent first views of the same variant encode it only once
+        with self._locks_lock:
+            lock = self._locks.setdefault((key, fmt, size), threading.Lock())
+        try:
+            with lock:
+                if path.exists():
+                    return path
+                return self._encode(key, fmt, size, path)
+        finally:
+            with self._locks_lock:
+                self._locks.pop((key, fmt, size), None)
+
+    def _encode(self, key: str, fmt: str, size: str, path: Path) -> Optional[Path]:
+        image = self.artifacts.get_image("results", key)
+        if image is None:
+            return None
+        if size == "thumb":
+            image = image.copy()
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
+        if fmt == "jpeg" and image.mode != "RGB":
+            image = image.convert("RGB")
+
+        pil_format, _, _, save_kwargs = RESULT_FORMATS[fmt]
+        atomic_save_image(image, path, format=pil_format, **save_kwargs)
+        logger.info(f"Encoded result {key[:12]}... as {fmt}/{size} ({path.stat().st_size} bytes)")
+        return path
@@ -0,0 +1,43 @@
+"""
+Entry points for stages executed in the StageExecutor process pool.
+
+Each worker process lazily builds and keeps its own preprocessor instances,
+so models (e.g. the MediaPipe pose graph) are loaded once per worker rather
+than once per request, and are never shared between threads.
+"""
+
+import logging
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_person_preprocessor = None
+
+
+def _get_person_preprocessor():
+    global _person_preprocessor
+    if _person_preprocessor is None:
+        from services.person_preprocessor import PersonPreprocessor
+        _person_preprocessor = PersonPreprocessor()
+    return _person_preprocessor
+
+
+def preprocess_person(image_path: str, output_path: Optional[str] = None) -> str:
+    return _get_person_preprocessor().process(image_path, output_path)
+
+
+def preprocess_person_image(image_path: str) -> np.ndarray:
+    """Returns the decoded result; pickling the array back is much cheaper than a PNG round-trip"""
+    return _get_person_preprocessor().process_image(image_path)
+
+
+def warm_up() -> dict:
+    """Load the pose model in this worker and run it once; returns this worker's memory use"""
+    from services.readiness import memory_snapshot
+
+    preprocessor = _get_person_preprocessor()
+    img = np.full((256, 256, 3), 255, dtype=np.uint8)
+    preprocessor._resize_person(preprocessor._enhance_image(preprocessor._detect_and_crop_person(img)))
+    return memory_snapshot()
@@ -4,8 +4,11 @@ import torch
 from PIL import Image
 from pathlib import Path
 import logging
-from typing import Optional
-import time
+from typing import Callable, Optional, Tuple
+
+from services.executor import get_executor
+from services.blob_store import hash_file, derive_key
+from services.artifact_store import ArtifactStore, artifact_key
 
 # Set HuggingFace cache to D drive
 os.environ['HF_HOME'] = 'D:/huggingface_cache'
@@ -15,7 +18,8 @@ os.environ['HF_DATASETS_CACHE'] = 'D:/huggingface_cache/datasets'
 logger = logging.getLogger(__name__)
 
 class TryOnService:
-    def __init__(self):
+    def __init__(self, artifact_store: ArtifactStore):
+        self.artifacts = artifact_store
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         logger.info(f"TryOnService initialized on device: {self.device}")
         
@@ -24,6 +28,38 @@ class TryOnService:
         
         self.model_loaded = False
         self.pipe = None
+        
+        # "remote": HF Space / Colab API with local compositing fallback
+        # "local": OOTDiffusion checkpoints on this machine (reports per-step progress)
+        self.backend = os.getenv("TRYON_BACKEND", "remote").lower()
+        self.ootd_service = None
+    
+    def _get_ootd_service(self):
+        if self.ootd_service is None:
+            from services.ootd_tryon_service import OOTDTryOnService
+            self.ootd_service = OOTDTryOnService()
+        return self.ootd_service
+    
+    def preload_model_types(self):
+        """OOTDiffusion checkpoints to load at startup (local backend only)"""
+        if self.backend != "local":
+            return []
+        return [t.strip() for t in os.getenv("OOTD_PRELOAD_MODEL_TYPES", "hd,dc").split(",") if t.strip()]
+    
+    def load_local_model(self, model_type: str):
+        ootd_service = self._get_ootd_service()
+        ootd_service._load_model(model_type)
+        if model_type not in ootd_service.ootd_models:
+            raise RuntimeError(f"OOTDiffusion {model_type} model failed to load")
+    
+    def warm_up_local_model(self, model_type: str):
+        self._get_ootd_service().warm_up(model_type)
+    
+    def config_key(self) -> str:
+        """Backend and, for the local backend, everything in its configuration that changes the result image"""
+        if self.backend == "local":
+            return f"local:{self._get_ootd_service().config_key()}"
+        return self.backend
     
     def _load_model(self):
         if self.model_loaded:
@@ -59,8 +95,38 @@ class TryOnService:
             logger.warning("Falling back to mock mode for testing...")
             self.model_loaded = False
     
-    async def run_tryon(self, cloth_path: str, person_path: str, category: str) -> str:
+    async def run_tryon(
+        self,
+        cloth_path: str,
+        person_path: str,
+        category: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ) -> Tuple[str, Optional[int]]:
+        """
+        `cloth_path` / `person_path` are artifact ids (or paths named by one) of preprocessed
+        images, or plain file paths. Returns the path the result is (lazily) stored at, and the
+        denoising steps run for it (None unless it was just generated by the local backend).
+        """
         logger.info(f"Running virtual try-on: cloth={cloth_path}, person={person_path}, category={category}")
+        executor = get_executor()
+        
+        cloth_key, cloth_img = await self._load_input("cloth", cloth_path)
+        person_key, person_img = await self._load_input("person", person_path)
+        
+        # Results are content-addressed by their inputs: identical requests reuse the stored result
+        result_key = derive_key("tryon", cloth_key, person_key, category, self.config_key())
+        result_path = self.artifacts.path("results", result_key)
+        if self.artifacts.contains("results", result_key):
+            logger.info(f"Reusing stored try-on result: {result_path}")
+            return str(result_path), None
+        
+        if self.backend == "local":
+            result_img, steps_run = await self._get_ootd_service().run_tryon(
+                cloth_img, person_img, category, progress_callback=progress_callback, cloth_hash=cloth_key
+            )
+            await executor.run_io(self.artifacts.put, "results", result_key, result_img)
+            logger.info(f"Try-on result stored: {result_key[:12]}...")
+            return str(result_path), steps_run
         
         # Try HuggingFace Space API first
         try:
@@ -72,25 +138,39 @@ class TryOnService:
                 raise ValueError("HUGGINGFACE_TOKEN not configured")
             hf_space = HFSpaceOOTD(hf_token=hf_token)
             logger.info("Using HuggingFace Space API for OOTDiffusion...")
-            result_path = await hf_space.run_tryon(cloth_path, person_path, category)
-            return result_path
+            # The Space needs real files to upload
+            cloth_file = await self._persist_input("cloth", cloth_key, cloth_path)
+            person_file = await self._persist_input("person", person_key, person_path)
+            return await hf_space.run_tryon(cloth_file, person_file, category, result_path=str(result_path)), None
         except Exception as e:
             logger.warning(f"HF Space API failed: {e}")
             logger.info("Falling back to local compositing...")
             
             # Fallback to local compositing
-            cloth_img = Image.open(cloth_path).convert("RGB")
-            person_img = Image.open(person_path).convert("RGB")
-            
-            result_img = self._mock_tryon(person_img, cloth_img)
-            
-            timestamp = int(time.time())
-            result_filename = f"tryon_result_{timestamp}.png"
-            result_path = self.results_dir / result_filename
-            result_img.save(result_path)
-            
-            logger.info(f"Try-on result saved: {result_path}")
-            return str(result_path)
+            result_img = await executor.run_compute(self._mock_tryon, person_img, cloth_img)
+            await executor.run_io(self.artifacts.put, "results", result_key, result_img)
+            logger.info(f"Try-on result stored: {result_key[:12]}...")
+            return str(result_path), None
+    
+    async def _load_input(self, namespace: str, ref: str) -> Tuple[str, Image.Image]:
+        """(content key, decoded image) for an artifact id or a file path"""
+        key = artifact_key(ref)
+        if key is not None:
+            image = await get_executor().run_io(self.artifacts.get_image, namespace, key)
+            if image is not None:
+                return key, image
+        if not os.path.exists(ref):
+            raise FileNotFoundError(f"Unknown {namespace} image: {ref}")
+        return await get_executor().run_io(self._load_file, ref)
+    
+    def _load_file(self, path: str) -> Tuple[str, Image.Image]:
+        image = Image.open(path)
+        image.load()
+        return hash_file(path), image
+    
+    async def _persist_input(self, namespace: str, key: str, ref: str) -> str:
+        path = await get_executor().run_io(self.artifacts.persist, namespace, key)
+        return str(path) if path is not None else ref
     
     def _run_ootdiffusion(self, person_img: Image.Image, cloth_img: Image.Image, category: str) -> Image.Image:
         logger.info("Running Stable Diffusion Inpainting inference...")
@@ -64,7 +64,7 @@ export default function TryOnResult({
   const handleDownload = () => {
     if (resultPath) {
       const link = document.createElement('a')
-      link.href = `http://localhost:8000/api/result/${resultPath.split('/').pop()}`
+      link.href = `http://localhost:8000/api/result/${resultPath.split('/').pop()}?format=png`
       link.download = 'look1nce-result.png'
       link.click()
     }
@@ -9,24 +9,111 @@ const api = axios.create({
   },
 })
 
-export const preprocessCloth = async (file: File, category: string) => {
-  const formData = new FormData()
-  formData.append('file', file)
-  formData.append('category', category)
+// SHA-256 of a file, as used by the backend to address uploads
+export const hashFile = async (file: File) => {
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+  return Array.from(new Uint8Array(digest))
+    .map((b) => b.toString(16).padStart(2, '0'))
+    .join('')
+}
 
-  const response = await api.post('/api/preprocess/cloth', formData)
-  return response.data
+export const uploadExists = async (hash: string) => {
+  try {
+    await api.head(`/api/uploads/${hash}`)
+    return true
+  } catch {
+    return false
+  }
+}
+
+// The server can evict an upload between the HEAD check and the POST and then answers 404 for its hash;
+// buildForm(true) attaches every file so the request can be retried once without relying on the hashes
+const postWithUploads = async (url: string, buildForm: (attachAll: boolean) => FormData, hashOnly: boolean) => {
+  try {
+    const response = await api.post(url, buildForm(false))
+    return response.data
+  } catch (error) {
+    if (!hashOnly || !axios.isAxiosError(error) || error.response?.status !== 404) {
+      throw error
+    }
+    const response = await api.post(url, buildForm(true))
+    return response.data
+  }
+}
+
+export const preprocessCloth = async (file: File, category: string) => {
+  const hash = await hashFile(file)
+  const known = await uploadExists(hash)
+  return postWithUploads(
+    '/api/preprocess/cloth',
+    (attachAll) => {
+      const formData = new FormData()
+      formData.append('hash', hash)
+      if (attachAll || !known) {
+        formData.append('file', file)
+      }
+      formData.append('category', category)
+      return formData
+    },
+    known
+  )
 }
 
 export const preprocessPerson = async (file: File) => {
+  const hash = await hashFile(file)
+  const known = await uploadExists(hash)
+  return postWithUploads(
+    '/api/preprocess/person',
+    (attachAll) => {
+      const formData = new FormData()
+      formData.append('hash', hash)
+      if (attachAll || !known) {
+        formData.append('file', file)
+      }
+      return formData
+    },
+    known
+  )
+}
+
+export const runVirtualTryOn = async (
+  clothPath: string,
+  personPath: string,
+  category: string
+) => {
   const formData = new FormData()
-  formData.append('file', file)
+  formData.append('cloth_path', clothPath)
+  formData.append('person_path', personPath)
+  formData.append('category', category)
 
-  const response = await api.post('/api/preprocess/person', formData)
+  const response = await api.post('/api/tryon', formData)
   return response.data
 }
 
-export const runVirtualTryOn = async (
+// Upload, preprocessing and try-on in a single request
+export const runFullTryOn = async (clothFile: File, personFile: File, category: string) => {
+  const [clothHash, personHash] = await Promise.all([hashFile(clothFile), hashFile(personFile)])
+  const [clothKnown, personKnown] = await Promise.all([uploadExists(clothHash), uploadExists(personHash)])
+  return postWithUploads(
+    '/api/tryon/full',
+    (attachAll) => {
+      const formData = new FormData()
+      formData.append('cloth_hash', clothHash)
+      formData.append('person_hash', personHash)
+      if (attachAll || !clothKnown) {
+        formData.append('cloth_file', clothFile)
+      }
+      if (attachAll || !personKnown) {
+        formData.append('person_file', personFile)
+      }
+      formData.append('category', category)
+      return formData
+    },
+    clothKnown || personKnown
+  )
+}
+
+export const submitTryOnJob = async (
   clothPath: string,
   personPath: string,
   category: string
@@ -36,12 +123,29 @@ export const runVirtualTryOn = async (
   formData.append('person_path', personPath)
   formData.append('category', category)
 
-  const response = await api.post('/api/tryon', formData)
+  const response = await api.post('/api/jobs', formData)
+  return response.data
+}
+
+export const getTryOnJob = async (jobId: string) => {
+  const response = await api.get(`/api/jobs/${jobId}`)
   return response.data
 }
 
-export const getResultUrl = (filename: string) => {
-  return `${API_BASE_URL}/api/result/${filename}`
+export const getTryOnJobEventsUrl = (jobId: string) => {
+  return `${API_BASE_URL}/api/jobs/${jobId}/events`
+}
+
+// format: png | webp | jpeg | avif (default: negotiated from Accept); size: full | thumb
+export const getResultUrl = (
+  filename: string,
+  options: { format?: string; size?: 'full' | 'thumb' } = {}
+) => {
+  const params = new URLSearchParams()
+  if (options.format) params.set('format', options.format)
+  if (options.size) params.set('size', options.size)
+  const query = params.toString()
+  return `${API_BASE_URL}/api/result/${filename}${query ? `?${query}` : ''}`
 }
 
 export const checkHealth = async () => {